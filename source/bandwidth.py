@@ -0,0 +1,284 @@
+"""
+Общий для процесса ограничитель скорости скачивания.
+
+Все загрузки (видео, аудио, маленькое видео ради звука, передача аудио в
+ffmpeg) берут байты из одного лимита. У каждого задания свой «ведро
+токенов», а общий лимит делится между активными заданиями:
+
+* сначала получают скорость задания с более высоким приоритетом, затем —
+  следующие по убыванию; внутри одного приоритета — пропорционально весу;
+* задание, которое само качает медленнее выделенного (упирается в сервер),
+  получает столько, сколько реально использует, остаток уходит остальным;
+* вытесненное задание не отменяется, а качает на минимальной скорости
+  MIN_RATE, чтобы сервер не закрыл соединение.
+
+Лимит меняется на ходу (set_rate) и может зависеть от времени суток
+(расписание вида «23:00-07:00=0,07:00-23:00=2M»).
+"""
+
+import re
+import threading
+import time
+from datetime import datetime
+
+from progress_model import format_bytes
+
+# Задание, которое столько секунд не получало данных, не участвует в делении
+IDLE_SECONDS = 2.0
+# Скорость вытесненного задания (байт/с)
+MIN_RATE = 16 * 1024
+# Сколько секунд скорости может накопиться у задания про запас
+BURST_SECONDS = 0.5
+# Как часто пересчитывать доли заданий (сек)
+REALLOCATE_INTERVAL = 0.5
+# Дольше этого ожидание не длится: проверяем отмену и новые доли
+MAX_WAIT = 0.25
+
+PRIORITY_NAMES = {'low': -1, 'normal': 0, 'high': 1}
+RATE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+RATE_RE = re.compile(r'(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s)?', re.IGNORECASE)
+SCHEDULE_RE = re.compile(r'(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=\s*(.+)')
+UNLIMITED_WORDS = ('', '0', 'none', 'unlimited', 'нет')
+
+
+def parse_rate(text):
+    """Скорость из строки вида «500K», «2M», «1.5MB/s» (байт/с); None — без ограничения"""
+    text = str(text or '').strip()
+    if text.lower() in UNLIMITED_WORDS:
+        return None
+    match = RATE_RE.fullmatch(text)
+    if not match:
+        raise ValueError(f"Некорректная скорость: {text}")
+    return int(float(match.group(1)) * RATE_UNITS[match.group(2).lower()]) or None
+
+
+def format_rate(rate):
+    """Лимит скорости для вывода"""
+    return f"{format_bytes(rate)}/с" if rate else "без ограничения"
+
+
+def parse_priority(value):
+    """Приоритет из числа или названия (low / normal / high)"""
+    text = str(value if value is not None else 0).strip().lower()
+    if text in PRIORITY_NAMES:
+        return PRIORITY_NAMES[text]
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError(f"Некорректный приоритет: {value}")
+
+
+def parse_schedule(text):
+    """Расписание «ЧЧ:ММ-ЧЧ:ММ=скорость,...» в список (начало, конец, скорость).
+
+    Начало и конец — минуты от полуночи; интервал может переходить через
+    полночь. Скорость 0 — без ограничения в этом интервале.
+    """
+    rules = []
+    for part in str(text or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        match = SCHEDULE_RE.fullmatch(part)
+        if not match:
+            raise ValueError(f"Некорректный интервал расписания: {part}")
+        start_h, start_m, end_h, end_m, rate = match.groups()
+        start = int(start_h) * 60 + int(start_m)
+        end = int(end_h) * 60 + int(end_m)
+        if start >= 24 * 60 or end > 24 * 60:
+            raise ValueError(f"Некорректное время в расписании: {part}")
+        rules.append((start, end, parse_rate(rate)))
+    return rules
+
+
+class BandwidthSlot:
+    """Доля общего лимита для одного задания"""
+
+    def __init__(self, scheduler, priority=0, weight=1.0):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.weight = max(float(weight), 0.01)
+        # Выделенная скорость (None — без ограничения) и накопленные токены
+        self.rate = None
+        self.tokens = 0.0
+        self.refilled_at = time.monotonic()
+        self.last_active = 0.0
+        # Фактическая скорость за последнюю секунду (None — ещё не измерена)
+        # и пришлось ли за это время ждать лимита
+        self.measured = None
+        self.saturated = True
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_waited = False
+
+    def consume(self, nbytes, cancelled=None):
+        """Учесть nbytes полученных данных; ждёт, если доля задания исчерпана"""
+        self.scheduler._consume(self, nbytes, cancelled)
+
+    def set_priority(self, priority=None, weight=None):
+        """Изменить приоритет и вес задания на ходу"""
+        self.scheduler._update_slot(self, priority, weight)
+
+    def close(self):
+        """Задание завершено — доля больше не нужна"""
+        self.scheduler._release(self)
+
+    def demand(self):
+        """Сколько задание готово забрать: если оно упирается в выделенную
+        скорость — сколько угодно, иначе — чуть больше, чем качает сейчас"""
+        if self.measured is None or self.saturated:
+            return float('inf')
+        return self.measured * 1.25 + MIN_RATE
+
+    def _account(self, nbytes, now):
+        self._window_bytes += nbytes
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            self.measured = self._window_bytes / elapsed
+            self.saturated = self._window_waited
+            self._window_start = now
+            self._window_bytes = 0
+            self._window_waited = False
+
+
+class BandwidthScheduler:
+    """Общий лимит скорости (байт/с) с приоритетами, весами и расписанием"""
+
+    def __init__(self, rate=None, schedule=None):
+        self._rate = rate
+        self._schedule = list(schedule or [])
+        self._slots = set()
+        self._cond = threading.Condition()
+        self._allocated_at = 0.0
+
+    # ------------------------------------------------------------------
+    # Настройка
+    # ------------------------------------------------------------------
+
+    def set_rate(self, rate):
+        """Изменить лимит (None — без ограничения); действует сразу"""
+        with self._cond:
+            self._rate = rate
+            self._reallocate(time.monotonic())
+            self._cond.notify_all()
+
+    def set_schedule(self, schedule):
+        """Задать расписание: список (начало, конец, скорость) из parse_schedule"""
+        with self._cond:
+            self._schedule = list(schedule or [])
+            self._reallocate(time.monotonic())
+            self._cond.notify_all()
+
+    def current_rate(self):
+        """Действующий лимит с учётом расписания"""
+        now = datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self._schedule:
+            if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+                return rate
+        return self._rate
+
+    def register(self, priority=0, weight=1.0):
+        """Получить долю для нового задания"""
+        slot = BandwidthSlot(self, priority, weight)
+        with self._cond:
+            self._slots.add(slot)
+        return slot
+
+    # ------------------------------------------------------------------
+    # Деление лимита
+    # ------------------------------------------------------------------
+
+    def _refill(self, slot, now):
+        if slot.rate is not None:
+            slot.tokens = min(slot.tokens + (now - slot.refilled_at) * slot.rate,
+                              slot.rate * BURST_SECONDS)
+        slot.refilled_at = now
+
+    @staticmethod
+    def _water_fill(slots, budget):
+        """Поделить budget по весам, не давая заданию больше, чем оно использует"""
+        shares = {}
+        pending = list(slots)
+        while pending:
+            total_weight = sum(s.weight for s in pending)
+            per_weight = budget / total_weight
+            limited = [s for s in pending if s.demand() < per_weight * s.weight]
+            if not limited:
+                for s in pending:
+                    shares[s] = per_weight * s.weight
+                break
+            for s in limited:
+                shares[s] = s.demand()
+                budget -= shares[s]
+                pending.remove(s)
+        return shares
+
+    def _reallocate(self, now):
+        """Пересчитать скорости заданий (под блокировкой)"""
+        self._allocated_at = now
+        total = self.current_rate()
+        for slot in self._slots:
+            self._refill(slot, now)
+        if not total:
+            for slot in self._slots:
+                slot.rate = None
+            return
+
+        active = [s for s in self._slots if now - s.last_active <= IDLE_SECONDS]
+        remaining = float(total)
+        for priority in sorted({s.priority for s in active}, reverse=True):
+            group = [s for s in active if s.priority == priority]
+            shares = self._water_fill(group, max(remaining, 0.0))
+            for slot in group:
+                if slot.rate is None:
+                    slot.tokens = 0.0
+                slot.rate = max(shares[slot], MIN_RATE)
+                remaining -= shares[slot]
+        for slot in self._slots:
+            if slot not in active:
+                # Простаивающее задание при первых же данных получит долю заново
+                slot.rate = None
+
+    def _consume(self, slot, nbytes, cancelled):
+        with self._cond:
+            now = time.monotonic()
+            was_idle = now - slot.last_active > IDLE_SECONDS
+            slot.last_active = now
+            slot._account(nbytes, now)
+            if was_idle or now - self._allocated_at >= REALLOCATE_INTERVAL:
+                self._reallocate(now)
+            if slot.rate is None:
+                return
+            self._refill(slot, now)
+            slot.tokens -= nbytes
+            # Данные уже получены: ждём, пока долг задания не покроется его скоростью
+            while slot.tokens < 0:
+                if cancelled and cancelled():
+                    return
+                slot._window_waited = True
+                self._cond.wait(min(-slot.tokens / slot.rate, MAX_WAIT))
+                now = time.monotonic()
+                slot.last_active = now
+                if now - self._allocated_at >= REALLOCATE_INTERVAL:
+                    self._reallocate(now)
+                if slot.rate is None:
+                    slot.tokens = 0.0
+                    return
+                self._refill(slot, now)
+
+    def _update_slot(self, slot, priority, weight):
+        with self._cond:
+            if priority is not None:
+                slot.priority = priority
+            if weight is not None:
+                slot.weight = max(float(weight), 0.01)
+            self._reallocate(time.monotonic())
+            self._cond.notify_all()
+
+    def _release(self, slot):
+        with self._cond:
+            self._slots.discard(slot)
+            self._reallocate(time.monotonic())
+            self._cond.notify_all()
+
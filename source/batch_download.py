@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Пакетное скачивание без графического интерфейса.
+
+Использование:
+    python batch_download.py urls.txt -o D:\\Videos --height 1080 -j 4
+
+В файле со списком — по одному URL на строку, пустые строки и строки,
+начинающиеся с '#', пропускаются.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+
+from bandwidth import BandwidthScheduler, format_rate, parse_priority, parse_rate, parse_schedule
+from download_archive import DownloadArchive
+from downloader_engine import DownloadEngine, analyze_error, log_tools
+from download_queue import DownloadJob, DownloadQueue
+from filename_index import FilenameIndex
+from ffmpeg_tools import discover_tools
+from fragment_concurrency import FragmentConcurrency
+from metadata_cache import MetadataCache
+from progress_model import ProgressSampler, format_progress
+from resume_journal import find_interrupted
+from retry_policy import default_policy, format_retry_metrics
+from stage_metrics import MetricsServer, default_registry
+from ydl_session import default_session
+
+
+def read_url_list(path):
+    """Прочитать список URL из файла"""
+    urls = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                urls.append(line)
+    return urls
+
+
+def watch_rate_file(path, bandwidth):
+    """Проверка файла с лимитом скорости: при изменении файла лимит применяется на ходу"""
+    state = {'mtime': None}
+
+    def check():
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return
+        if mtime == state['mtime']:
+            return
+        state['mtime'] = mtime
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                rate = parse_rate(f.read())
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Лимит скорости из {path} не применён: {e}", flush=True)
+            return
+        bandwidth.set_rate(rate)
+        print(f"Лимит скорости: {format_rate(rate)}", flush=True)
+
+    return check
+
+
+def job_summary_writer(path):
+    """Запись сводки завершённого задания строкой JSON в файл (дописывается)"""
+    lock = threading.Lock()
+    written = set()
+
+    def write(job):
+        with lock:
+            if job.id in written:
+                return
+            written.add(job.id)
+        summary = {'job': job.id, 'state': job.state, 'url': job.url, 'error': job.error,
+                   **job.engine.job_metrics.summary()}
+        line = json.dumps(summary, ensure_ascii=False)
+        with lock:
+            try:
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+            except OSError as e:
+                print(f"⚠️ Сводка задания не записана в {path}: {e}", flush=True)
+
+    return write
+
+
+def parse_args(argv=None):
+    """Разобрать аргументы командной строки"""
+    parser = argparse.ArgumentParser(description="YouTube Downloader — пакетное скачивание по списку URL")
+    parser.add_argument('url_file', nargs='?', help="файл со списком URL (по одному на строку)")
+    parser.add_argument('-o', '--output', default=str(Path.home() / "Downloads"),
+                        help="папка для сохранения (по умолчанию ~/Downloads)")
+    parser.add_argument('--height', type=int, default=None,
+                        help="максимальное разрешение по высоте, например 720 (по умолчанию — лучшее)")
+    parser.add_argument('--redownload', action='store_true',
+                        help="скачивать заново, даже если файл уже существует")
+    parser.add_argument('--resume', action='store_true',
+                        help="возобновить прерванные загрузки, найденные в папке сохранения")
+    parser.add_argument('-j', '--jobs', type=int, default=2,
+                        help="число параллельных загрузок (по умолчанию 2)")
+    parser.add_argument('--per-host', type=int, default=2,
+                        help="максимум одновременных загрузок с одного хоста (по умолчанию 2)")
+    parser.add_argument('--cache-dir', default=None,
+                        help="папка кэша информации о видео (по умолчанию ~/.youtube_downloader/metadata_cache)")
+    parser.add_argument('--cache-ttl', type=int, default=6 * 3600,
+                        help="срок жизни записи кэша в секундах (по умолчанию 6 часов)")
+    parser.add_argument('--no-cache', action='store_true', help="не использовать кэш информации о видео")
+    parser.add_argument('--archive', default=None,
+                        help="файл архива скачанных видео (по умолчанию ~/.youtube_downloader/download_archive.txt)")
+    parser.add_argument('--no-archive', action='store_true',
+                        help="не пропускать видео из архива и не записывать в него")
+    parser.add_argument('--max-fragments', type=int, default=16,
+                        help="максимум параллельных фрагментов DASH/HLS на одну загрузку (по умолчанию 16)")
+    parser.add_argument('--max-connections', type=int, default=32,
+                        help="общий лимит соединений для фрагментов всех заданий (по умолчанию 32)")
+    parser.add_argument('--pipe-audio', action='store_true',
+                        help="передавать аудио в ffmpeg через канал, без временного файла")
+    parser.add_argument('--limit-rate', type=parse_rate, default=None,
+                        help="общий лимит скорости всех загрузок, например 500K или 2M (по умолчанию без ограничения)")
+    parser.add_argument('--schedule', type=parse_schedule, default=None,
+                        help="лимит по времени суток, например 23:00-07:00=0,07:00-23:00=2M (0 — без ограничения)")
+    parser.add_argument('--rate-file', default=None,
+                        help="файл с лимитом скорости; изменения файла применяются во время работы")
+    parser.add_argument('--priority', type=parse_priority, default=0,
+                        help="приоритет заданий из списка при делении лимита: low, normal, high или число")
+    parser.add_argument('--weight', type=float, default=1.0,
+                        help="вес заданий из списка среди заданий того же приоритета (по умолчанию 1)")
+    parser.add_argument('--metrics-file', default=None,
+                        help="файл метрик в текстовом формате Prometheus (обновляется каждые 5 секунд)")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="отдавать метрики Prometheus по адресу http://127.0.0.1:ПОРТ/metrics")
+    parser.add_argument('--job-summaries', default=None,
+                        help="файл, куда дописывается сводка каждого задания (строка JSON)")
+    parser.add_argument('--profile', action='store_true',
+                        help="профилировать задания: профили сохраняются в папку --profile-dir")
+    parser.add_argument('--profile-dir', default=None,
+                        help="папка профилей заданий (по умолчанию ~/.youtube_downloader/profiles)")
+    parser.add_argument('--progress-interval', type=float, default=2.0,
+                        help="как часто выводить прогресс активных загрузок, в секундах (0 — не выводить)")
+    parser.add_argument('--ffmpeg', default=None, help="путь к ffmpeg")
+    parser.add_argument('--ffprobe', default=None, help="путь к ffprobe")
+    return parser.parse_args(argv)
+
+
+def run_batch(urls, args):
+    """Обработать список URL через очередь, вернуть (успешно, пропущено, ошибок)"""
+    metadata_cache = None if args.no_cache else MetadataCache(args.cache_dir, ttl=args.cache_ttl)
+    archive = None if args.no_archive else DownloadArchive(args.archive)
+    filename_index = FilenameIndex()
+    fragment_controller = FragmentConcurrency(max_level=args.max_fragments, global_limit=args.max_connections)
+    bandwidth = BandwidthScheduler(args.limit_rate, args.schedule)
+    job_options = {'priority': args.priority, 'weight': args.weight,
+                   'profile': args.profile, 'profile_dir': args.profile_dir}
+    registry = default_registry()
+    write_job_summary = job_summary_writer(args.job_summaries) if args.job_summaries else None
+    # ffmpeg/ffprobe ищутся один раз на весь пакет, движки заданий получают готовый результат
+    tools = discover_tools(args.ffmpeg, args.ffprobe)
+    log_tools(tools, lambda message: print(message, flush=True))
+
+    def engine_factory(job):
+        return DownloadEngine(
+            download_path=args.output,
+            log=lambda message: print(f"[{job.id}] {message}", flush=True),
+            confirm_redownload=lambda existing: args.redownload,
+            metadata_cache=metadata_cache,
+            pipe_audio=args.pipe_audio,
+            fragment_controller=fragment_controller,
+            archive=archive,
+            filename_index=filename_index,
+            bandwidth=bandwidth,
+            priority=job.options.get('priority', 0),
+            weight=job.options.get('weight', 1.0),
+            metrics=registry,
+            tools=tools,
+        )
+
+    def on_update(job):
+        if job.state == DownloadJob.EXPANDED:
+            print(f"[{job.id}] 📃 {job.title}: добавлено видео — {job.entries_added}", flush=True)
+        elif job.state == DownloadJob.DONE:
+            print(f"[{job.id}] ✅ Сохранено: {job.result}", flush=True)
+        elif job.state == DownloadJob.FAILED:
+            print(f"[{job.id}] ❌ {job.error}", flush=True)
+            print(analyze_error(job.error or ''), flush=True)
+        if write_job_summary and job.engine and job.state in (
+                DownloadJob.DONE, DownloadJob.SKIPPED, DownloadJob.FAILED, DownloadJob.CANCELLED):
+            write_job_summary(job)
+
+    queue = DownloadQueue(engine_factory, max_workers=args.jobs,
+                          per_host_limit=args.per_host, on_update=on_update)
+
+    def print_progress():
+        for job in queue.jobs():
+            if job.state == DownloadJob.RUNNING and job.engine:
+                line = format_progress(job.engine.progress.snapshot())
+                if line:
+                    print(f"[{job.id}] {line}", flush=True)
+
+    samplers = []
+    if args.progress_interval > 0:
+        samplers.append(ProgressSampler(print_progress, args.progress_interval).start())
+    if args.rate_file:
+        check_rate_file = watch_rate_file(args.rate_file, bandwidth)
+        check_rate_file()
+        samplers.append(ProgressSampler(check_rate_file, 1.0).start())
+    if args.metrics_file:
+        samplers.append(ProgressSampler(lambda: registry.write_textfile(args.metrics_file), 5.0).start())
+    metrics_server = None
+    if args.metrics_port is not None:
+        try:
+            metrics_server = MetricsServer(registry, args.metrics_port).start()
+            print(f"Метрики: http://127.0.0.1:{metrics_server.server_address[1]}/metrics", flush=True)
+        except OSError as e:
+            print(f"⚠️ Не удалось открыть порт метрик {args.metrics_port}: {e}", flush=True)
+
+    for url in urls:
+        queue.add(url, max_height=args.height, options=job_options)
+    if args.resume:
+        for journal in find_interrupted(args.output):
+            if journal.data['url'] not in urls:
+                queue.add(journal.data['url'], format_id=journal.data.get('format_id'),
+                          options=job_options, title=journal.data.get('title'))
+    try:
+        queue.join()
+    except KeyboardInterrupt:
+        queue.shutdown(cancel=True)
+        raise
+    finally:
+        for sampler in samplers:
+            sampler.stop()
+        if metrics_server:
+            metrics_server.stop()
+        if args.metrics_file and not registry.write_textfile(args.metrics_file):
+            print(f"⚠️ Не удалось записать метрики в {args.metrics_file}", flush=True)
+
+    if metadata_cache:
+        stats = metadata_cache.stats()
+        print(f"Кэш информации: попаданий {stats['hits']}, промахов {stats['misses']}", flush=True)
+    session_stats = default_session().stats()
+    print(f"Экземпляры yt-dlp: создано {session_stats['created']}, "
+          f"использовано повторно {session_stats['reused']}", flush=True)
+    retry_summary = format_retry_metrics(default_policy().metrics.snapshot())
+    if retry_summary:
+        print(f"Повторы после ошибок: {retry_summary}", flush=True)
+
+    jobs = queue.jobs()
+    done = sum(1 for job in jobs if job.state == DownloadJob.DONE)
+    skipped = sum(1 for job in jobs if job.state == DownloadJob.SKIPPED)
+    failed = sum(1 for job in jobs if job.state in (DownloadJob.FAILED, DownloadJob.CANCELLED))
+    return done, skipped, failed
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.url_file and not args.resume:
+        print("❌ Укажите файл со списком URL или --resume", file=sys.stderr)
+        return 2
+    try:
+        urls = read_url_list(args.url_file) if args.url_file else []
+    except OSError as e:
+        print(f"❌ Не удалось прочитать список URL: {e}", file=sys.stderr)
+        return 2
+
+    if not urls and not args.resume:
+        print("Список URL пуст")
+        return 0
+
+    try:
+        done, skipped, failed = run_batch(urls, args)
+    except KeyboardInterrupt:
+        print("\n⏹️ Прервано пользователем")
+        return 130
+
+    print(f"\nГотово: {done}, пропущено: {skipped}, ошибок: {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
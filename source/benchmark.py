@@ -0,0 +1,758 @@
+#!/usr/bin/env python3
+"""
+Замер скорости конвейера скачивания без доступа к сети.
+
+Использование:
+    python benchmark.py -n 3 -o results.json --compare previous.json
+
+Локальный HTTP-сервер отдаёт тестовые медиафайлы, а заглушка экстрактора
+yt-dlp описывает их как видео с форматами, похожими на YouTube:
+
+* progressive — один файл со звуком;
+* dash — видео без звука и отдельное аудио (скачиваются параллельно и
+  объединяются ffmpeg);
+* dash_pipe — то же, но аудио передаётся в ffmpeg через канал;
+* fragmented — видео DASH фрагментами с подбором их параллельности.
+
+Каждый прогон сценария — отдельный процесс, который целиком выполняет
+DownloadEngine.download_video. Для каждого этапа записываются время,
+процессорное время, байты в папке загрузки и пиковая память процесса,
+для прогона — переданные сервером байты и скорость. Результаты
+сохраняются в JSON; с --compare скорость сравнивается с прошлым
+запуском, и падение больше --threshold процентов считается регрессией.
+
+Если найден ffmpeg, тестовый ролик создаётся им (или берётся из --clip)
+и проходит все этапы, включая объединение и финализацию. Без ffmpeg
+файлы заполняются случайными байтами, а сценарии с ffmpeg пропускаются.
+
+Прогон засчитывается, только если итоговый файл годен: в нём есть видео и
+звук, длительность совпадает с исходным роликом, а размер не меньше
+видеопотока (для файлов из случайных байт проверяется только размер).
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor
+
+from bandwidth import format_rate, parse_rate
+from downloader_engine import DownloadEngine
+from ffmpeg_tools import discover_tools
+from fragment_concurrency import FragmentConcurrency
+from media_probe import first_stream, probe_media
+from progress_model import format_bytes
+from retry_policy import RetryPolicy
+from ydl_session import YDLSession
+
+SCENARIOS = ('progressive', 'dash', 'dash_pipe', 'fragmented')
+# Сценарии, которые без ffmpeg не отличаются от других или не выполнимы
+FFMPEG_SCENARIOS = ('dash_pipe',)
+SEND_CHUNK = 64 * 1024
+RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)$')
+
+
+def parse_size(text):
+    """Размер из строки вида «32M», «512K» (байт)"""
+    size = parse_rate(text)
+    if not size:
+        raise ValueError(f"Некорректный размер: {text}")
+    return size
+
+
+def parse_scenarios(text):
+    """Список сценариев через запятую"""
+    names = [name.strip() for name in str(text).split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown or not names:
+        raise argparse.ArgumentTypeError(
+            f"неизвестный сценарий: {', '.join(unknown) or text} (доступны: {', '.join(SCENARIOS)})")
+    return names
+
+
+def peak_rss():
+    """Пиковый объём памяти процесса в байтах (None — узнать нельзя)"""
+    try:
+        import resource
+    except ImportError:
+        return _peak_rss_windows()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux ru_maxrss в килобайтах, в macOS — в байтах
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _peak_rss_windows():
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    except Exception:
+        pass
+    return None
+
+
+def disk_usage(directory):
+    """Сколько байт занимают файлы в папке (без вложенных папок)"""
+    total = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        total += entry.stat().st_size
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return total
+
+
+# ----------------------------------------------------------------------
+# Тестовые файлы
+# ----------------------------------------------------------------------
+
+def _ffmpeg(ffmpeg, *args):
+    subprocess.run([ffmpeg, '-hide_banner', '-v', 'error', '-y', *args],
+                   check=True, capture_output=True)
+
+
+def _random_file(path, size):
+    with open(path, 'wb') as f:
+        while size > 0:
+            chunk = min(size, 1024 * 1024)
+            f.write(os.urandom(chunk))
+            size -= chunk
+
+
+def prepare_media(media_dir, size, duration, clip=None, tools=None):
+    """Создать файлы для сервера: progressive.mp4 (со звуком), video.mp4 и audio.m4a.
+
+    Возвращает (словарь имя → путь, источник: 'clip', 'ffmpeg' или 'random').
+    """
+    os.makedirs(media_dir, exist_ok=True)
+    media = {name: os.path.join(media_dir, name) for name in ('progressive.mp4', 'video.mp4', 'audio.m4a')}
+    ffmpeg = (tools or {}).get('ffmpeg')
+    if clip and not ffmpeg:
+        raise RuntimeError("Для --clip нужен ffmpeg: из ролика делаются отдельные видео и аудио")
+
+    if ffmpeg:
+        if clip:
+            _ffmpeg(ffmpeg, '-i', clip, '-map', '0:v:0', '-map', '0:a:0', '-c', 'copy',
+                    '-movflags', '+faststart', media['progressive.mp4'])
+            source = 'clip'
+        else:
+            # Шум не даёт кодировщику сжать тестовую таблицу до пары килобайт
+            video_codec = 'libx264' if 'libx264' in (tools.get('encoders') or ()) else 'mpeg4'
+            _ffmpeg(ffmpeg, '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=30',
+                    '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+                    '-t', str(duration), '-vf', 'noise=alls=20:allf=t', '-pix_fmt', 'yuv420p',
+                    '-c:v', video_codec, '-b:v', '6M', '-c:a', 'aac', '-b:a', '128k',
+                    '-movflags', '+faststart', media['progressive.mp4'])
+            source = 'ffmpeg'
+        _ffmpeg(ffmpeg, '-i', media['progressive.mp4'], '-map', '0:v:0', '-c', 'copy',
+                '-movflags', '+faststart', media['video.mp4'])
+        # moov в начале, как у аудио YouTube: иначе ffmpeg не разберёт m4a из канала (dash_pipe)
+        _ffmpeg(ffmpeg, '-i', media['progressive.mp4'], '-map', '0:a:0', '-c', 'copy',
+                '-movflags', '+faststart', media['audio.m4a'])
+        return media, source
+
+    _random_file(media['progressive.mp4'], size)
+    _random_file(media['video.mp4'], size)
+    _random_file(media['audio.m4a'], max(size // 8, 64 * 1024))
+    return media, 'random'
+
+
+def _format(base_url, media, format_id, name, **fields):
+    return {
+        'format_id': format_id,
+        'url': f"{base_url}/media/{name}",
+        'protocol': 'http',
+        'filesize': os.path.getsize(media[name]),
+        **fields,
+    }
+
+
+def scenario_info(scenario, base_url, media, duration, fragment_size):
+    """Информация о видео сценария в том виде, в каком её вернул бы экстрактор"""
+    video = {'ext': 'mp4', 'width': 1280, 'height': 720, 'vcodec': 'avc1.64001f', 'acodec': 'none', 'fps': 30}
+    audio = _format(base_url, media, 'audio', 'audio.m4a', ext='m4a', vcodec='none',
+                    acodec='mp4a.40.2', abr=128)
+    if scenario == 'progressive':
+        formats = [_format(base_url, media, 'progressive', 'progressive.mp4',
+                           **{**video, 'acodec': 'mp4a.40.2'})]
+    elif scenario == 'fragmented':
+        count = -(-os.path.getsize(media['video.mp4']) // fragment_size)
+        fragmented = _format(base_url, media, 'dash-video', 'video.mp4', **video)
+        fragmented.update(protocol='http_dash_segments',
+                          fragments=[{'url': f"{base_url}/frag/video.mp4/{i}"} for i in range(count)])
+        formats = [fragmented, audio]
+    else:
+        formats = [_format(base_url, media, 'dash-video', 'video.mp4', **video), audio]
+    return {
+        'id': scenario,
+        'title': f"benchmark {scenario}",
+        'duration': duration,
+        'formats': formats,
+    }
+
+
+# ----------------------------------------------------------------------
+# Локальный сервер
+# ----------------------------------------------------------------------
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    """Отдаёт /info/<сценарий>.json, /media/<файл> и /frag/<файл>/<номер> (с Range)"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond()
+
+    def respond(self, head=False):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        parts = urlparse(self.path).path.strip('/').split('/')
+
+        if len(parts) == 2 and parts[0] == 'info' and parts[1].endswith('.json'):
+            info = server.infos.get(parts[1][:-len('.json')])
+            if info is None:
+                self.send_error(404)
+                return
+            body = json.dumps(info).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if not head:
+                self.wfile.write(body)
+            return
+
+        path = server.media.get(parts[1]) if len(parts) in (2, 3) else None
+        if path is None or parts[0] not in ('media', 'frag') or (parts[0] == 'frag') != (len(parts) == 3):
+            self.send_error(404)
+            return
+        start, end = 0, os.path.getsize(path)
+        if parts[0] == 'frag':
+            try:
+                start = int(parts[2]) * server.fragment_size
+            except ValueError:
+                self.send_error(404)
+                return
+            end = min(end, start + server.fragment_size)
+            if start >= end:
+                self.send_error(404)
+                return
+
+        total = end - start
+        first, last = 0, total - 1
+        match = RANGE_RE.match(self.headers.get('Range') or '')
+        if match:
+            first = int(match.group(1))
+            if match.group(2):
+                last = min(int(match.group(2)), total - 1)
+            if first >= total:
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{total}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+        self.send_response(206 if match else 200)
+        self.send_header('Content-Type', 'audio/mp4' if path.endswith('.m4a') else 'video/mp4')
+        self.send_header('Content-Length', str(last - first + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if match:
+            self.send_header('Content-Range', f"bytes {first}-{last}/{total}")
+        self.end_headers()
+        if not head:
+            self.send_file(path, start + first, last - first + 1)
+
+    def send_file(self, path, offset, length):
+        server = self.server
+        started = time.monotonic()
+        sent = 0
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                while sent < length:
+                    data = f.read(min(SEND_CHUNK, length - sent))
+                    if not data:
+                        break
+                    self.wfile.write(data)
+                    sent += len(data)
+                    if server.rate:
+                        # Скорость одного соединения, как у медленного сервера
+                        delay = sent / server.rate - (time.monotonic() - started)
+                        if delay > 0:
+                            time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            server.count_bytes(sent)
+
+
+class MediaServer(ThreadingHTTPServer):
+    """Локальный сервер тестовых файлов со счётчиком отданных байт"""
+
+    daemon_threads = True
+
+    def __init__(self, media, latency=0.0, rate=None, fragment_size=1024 * 1024):
+        super().__init__(('127.0.0.1', 0), MediaRequestHandler)
+        self.media = media
+        self.infos = {}
+        self.latency = latency
+        self.rate = rate
+        self.fragment_size = fragment_size
+        self.bytes_sent = 0
+        self._bytes_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count_bytes(self, nbytes):
+        with self._bytes_lock:
+            self.bytes_sent += nbytes
+
+    def take_bytes(self):
+        """Отданные байты с прошлого вызова"""
+        with self._bytes_lock:
+            nbytes, self.bytes_sent = self.bytes_sent, 0
+            return nbytes
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+# ----------------------------------------------------------------------
+# Прогон сценария (в отдельном процессе)
+# ----------------------------------------------------------------------
+
+class BenchmarkIE(InfoExtractor):
+    """Заглушка экстрактора: информация о видео берётся с локального сервера"""
+
+    IE_NAME = 'benchmark'
+    _VALID_URL = r'https?://127\.0\.0\.1:\d+/watch/(?P<id>\w+)'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        return self._download_json(url.replace('/watch/', '/info/') + '.json', video_id)
+
+
+class BenchmarkSession(YDLSession):
+    """Сессия yt-dlp, в которой есть только заглушка экстрактора"""
+
+    def __init__(self):
+        super().__init__({'allowed_extractors': [BenchmarkIE.ie_key()]})
+
+    def _create(self):
+        ydl = super()._create()
+        ydl.add_info_extractor(BenchmarkIE())
+        return ydl
+
+
+class StageRecorder:
+    """Время, процессорное время, байты на диске и пиковая память по этапам"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.stages = {}
+        self._open = {}
+
+    def begin(self, name):
+        if name not in self._open:
+            self._open[name] = (time.perf_counter(), time.process_time())
+
+    def end(self, name):
+        started = self._open.pop(name, None)
+        if started is None:
+            return
+        stage = self.stages.setdefault(name, {'wall_s': 0.0, 'cpu_s': 0.0})
+        # Этап мог выполняться несколько раз — время суммируется
+        stage['wall_s'] += time.perf_counter() - started[0]
+        stage['cpu_s'] += time.process_time() - started[1]
+        stage['disk_bytes'] = disk_usage(self.directory)
+        stage['peak_rss_bytes'] = peak_rss()
+
+    def close(self):
+        """Завершить этапы, конец которых движок не отметил (например, при ошибке)"""
+        for name in list(self._open):
+            self.end(name)
+
+    def results(self):
+        return {name: {**stage, 'wall_s': round(stage['wall_s'], 4), 'cpu_s': round(stage['cpu_s'], 4)}
+                for name, stage in self.stages.items()}
+
+
+class BenchmarkEngine(DownloadEngine):
+    """Движок, отмечающий начало и конец этапов в StageRecorder"""
+
+    def __init__(self, recorder, **kwargs):
+        super().__init__(**kwargs)
+        self.recorder = recorder
+
+    def get_video_info(self, url, use_cache=True, allow_playlist=False):
+        self.recorder.begin('info')
+        try:
+            return super().get_video_info(url, use_cache, allow_playlist)
+        finally:
+            self.recorder.end('info')
+
+    def start_stage(self, stage_num, stage_name):
+        super().start_stage(stage_num, stage_name)
+        self.recorder.begin(self.STAGE_KEYS[stage_num])
+
+    def finish_stage(self, stage_num, completion_text):
+        super().finish_stage(stage_num, completion_text)
+        self.recorder.end(self.STAGE_KEYS[stage_num])
+
+
+def check_output(path, media_dir, ffmpeg_path=None, ffprobe_path=None):
+    """Проверить итоговый файл прогона: None — годен, иначе причина"""
+    size = os.path.getsize(path)
+    video_size = os.path.getsize(os.path.join(media_dir, 'video.mp4'))
+    if size < video_size * 0.9:
+        return f"итоговый файл {format_bytes(size)} меньше видеопотока {format_bytes(video_size)}"
+    reference = probe_media(os.path.join(media_dir, 'progressive.mp4'), ffprobe_path, ffmpeg_path)
+    if reference is None:
+        # Файлы из случайных байт: разбирать нечего, достаточно размера
+        return None
+    probe = probe_media(path, ffprobe_path, ffmpeg_path)
+    if probe is None:
+        return "не удалось разобрать итоговый файл"
+    if first_stream(probe, 'video') is None:
+        return "в итоговом файле нет видео"
+    if first_stream(probe, 'audio') is None:
+        return "в итоговом файле нет звука"
+    duration = probe.get('duration') or 0
+    expected = reference.get('duration') or 0
+    if expected and abs(duration - expected) > max(0.5, expected * 0.05):
+        return f"длительность {duration:.1f} с вместо {expected:.1f} с"
+    return None
+
+
+def run_scenario(scenario, base_url, workdir, ffmpeg_path=None, ffprobe_path=None, verbose=False):
+    """Выполнить download_video для сценария и вернуть замеры"""
+    download_dir = os.path.join(workdir, scenario)
+    shutil.rmtree(download_dir, ignore_errors=True)
+    os.makedirs(download_dir)
+    recorder = StageRecorder(download_dir)
+    log_lines = []
+
+    def log(message):
+        log_lines.append(message)
+        if verbose:
+            print(f"[{scenario}] {message}", file=sys.stderr, flush=True)
+
+    session = BenchmarkSession()
+    engine = BenchmarkEngine(
+        recorder,
+        download_path=download_dir,
+        log=log,
+        ffmpeg_path=ffmpeg_path,
+        ffprobe_path=ffprobe_path,
+        pipe_audio=(scenario == 'dash_pipe'),
+        fragment_controller=FragmentConcurrency() if scenario == 'fragmented' else None,
+        session=session,
+        retry_policy=RetryPolicy(),
+    )
+    result = {'ok': False, 'error': None, 'output_bytes': 0}
+    recorder.begin('total')
+    try:
+        path = engine.download_video(f"{base_url}/watch/{scenario}")
+        if path and os.path.exists(path):
+            result['output_bytes'] = os.path.getsize(path)
+            result['error'] = check_output(path, os.path.join(workdir, 'media'), ffmpeg_path, ffprobe_path)
+            result['ok'] = result['error'] is None
+        else:
+            result['error'] = "итоговый файл не создан"
+    except Exception as e:
+        result['error'] = str(e)
+    finally:
+        recorder.close()
+        session.close()
+    if not result['ok']:
+        result['log_tail'] = log_lines[-10:]
+    stages = recorder.results()
+    result['total'] = stages.pop('total')
+    result['stages'] = stages
+    result['retries'] = engine.retry_policy.metrics.snapshot()
+    # Байты и запуски ffmpeg/ffprobe по этапам — из замеров самого движка
+    result['job'] = engine.job_metrics.summary()
+    return result
+
+
+# ----------------------------------------------------------------------
+# Запуск, сводка и сравнение
+# ----------------------------------------------------------------------
+
+def run_worker(scenario, server, workdir, args):
+    """Прогон сценария в отдельном процессе: своя пиковая память и холодный старт"""
+    output = os.path.join(workdir, f"{scenario}.result.json")
+    cmd = [sys.executable, os.path.abspath(__file__), '--worker', scenario,
+           '--base-url', server.base_url, '--workdir', workdir, '--worker-output', output]
+    if args.ffmpeg:
+        cmd += ['--ffmpeg', args.ffmpeg]
+    if args.ffprobe:
+        cmd += ['--ffprobe', args.ffprobe]
+    if args.verbose:
+        cmd.append('--verbose')
+
+    server.take_bytes()
+    try:
+        os.remove(output)
+    except OSError:
+        pass
+    try:
+        # Вывод yt-dlp идёт в stdout процесса — без --verbose он не нужен
+        proc = subprocess.run(cmd, stdout=None if args.verbose else subprocess.DEVNULL,
+                              stderr=None if args.verbose else subprocess.PIPE,
+                              text=True, errors='ignore', timeout=args.timeout)
+        with open(output, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    except subprocess.TimeoutExpired:
+        result = {'ok': False, 'error': f"прогон не уложился в {args.timeout} с"}
+    except (OSError, ValueError):
+        stderr_tail = (proc.stderr or '').strip().splitlines()[-3:]
+        result = {'ok': False, 'error': f"процесс замера завершился с кодом {proc.returncode}: "
+                                        f"{' '.join(stderr_tail)}"}
+    result['network_bytes'] = server.take_bytes()
+    wall = (result.get('total') or {}).get('wall_s')
+    result['throughput'] = result['network_bytes'] / wall if result['ok'] and wall else None
+    return result
+
+
+def summarize(runs):
+    """Медианы по успешным прогонам (память и байты на диске — максимум)"""
+    ok = [run for run in runs if run.get('ok')]
+    if not ok:
+        return None
+
+    def peak(values):
+        values = [v for v in values if v is not None]
+        return max(values) if values else None
+
+    stages = {}
+    for name in dict.fromkeys(name for run in ok for name in run['stages']):
+        values = [run['stages'][name] for run in ok if name in run['stages']]
+        stages[name] = {
+            'wall_s': round(statistics.median(v['wall_s'] for v in values), 4),
+            'cpu_s': round(statistics.median(v['cpu_s'] for v in values), 4),
+            'disk_bytes': peak(v.get('disk_bytes') for v in values),
+            'peak_rss_bytes': peak(v.get('peak_rss_bytes') for v in values),
+        }
+    return {
+        'runs_ok': len(ok),
+        'wall_s': round(statistics.median(run['total']['wall_s'] for run in ok), 4),
+        'cpu_s': round(statistics.median(run['total']['cpu_s'] for run in ok), 4),
+        'throughput': statistics.median(run['throughput'] for run in ok if run['throughput']),
+        'peak_rss_bytes': peak(run['total'].get('peak_rss_bytes') for run in ok),
+        'stages': stages,
+    }
+
+
+def print_summary(scenario, summary):
+    memory = summary['peak_rss_bytes']
+    print(f"{scenario}: {summary['wall_s']:.2f} с, процессор {summary['cpu_s']:.2f} с, "
+          f"{format_rate(summary['throughput'])}" + (f", память {format_bytes(memory)}" if memory else ""),
+          flush=True)
+    for name, stage in summary['stages'].items():
+        print(f"    {name}: {stage['wall_s']:.3f} с, процессор {stage['cpu_s']:.3f} с, "
+              f"на диске {format_bytes(stage['disk_bytes'] or 0)}", flush=True)
+
+
+def compare_results(previous, current, threshold):
+    """Сравнить скорость с прошлым запуском; вернуть сценарии, где она упала больше threshold %"""
+    regressions = []
+    print("\nСравнение с прошлым запуском:", flush=True)
+    if previous.get('settings') != current['settings'] or previous.get('media') != current['media']:
+        print("  ⚠️ Настройки замера или тестовые файлы отличаются — сравнение приблизительное", flush=True)
+    for scenario, entry in current['scenarios'].items():
+        before = ((previous.get('scenarios') or {}).get(scenario) or {}).get('summary')
+        after = entry.get('summary')
+        if not before or not after or not before.get('throughput'):
+            print(f"  {scenario}: сравнить не с чем", flush=True)
+            continue
+        change = (after['throughput'] - before['throughput']) / before['throughput'] * 100
+        mark = ""
+        if change < -threshold:
+            regressions.append(scenario)
+            mark = "  ⚠️ регрессия"
+        print(f"  {scenario}: {format_rate(before['throughput'])} → {format_rate(after['throughput'])} "
+              f"({change:+.1f}%), время {before['wall_s']:.2f} → {after['wall_s']:.2f} с{mark}", flush=True)
+    return regressions
+
+
+def parse_args(argv=None):
+    """Разобрать аргументы командной строки"""
+    parser = argparse.ArgumentParser(description="YouTube Downloader — замер скорости скачивания без сети")
+    parser.add_argument('--scenarios', type=parse_scenarios, default=list(SCENARIOS),
+                        help=f"сценарии через запятую (по умолчанию все: {','.join(SCENARIOS)})")
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help="сколько раз прогнать каждый сценарий (по умолчанию 3; в сводке — медиана)")
+    parser.add_argument('-o', '--output', default='benchmark_results.json',
+                        help="файл результатов JSON (по умолчанию benchmark_results.json)")
+    parser.add_argument('--compare', default=None,
+                        help="файл результатов прошлого запуска для сравнения")
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help="падение скорости в процентах, которое считается регрессией (по умолчанию 10)")
+    parser.add_argument('--clip', default=None,
+                        help="свой тестовый ролик со звуком вместо созданного ffmpeg")
+    parser.add_argument('--duration', type=int, default=10,
+                        help="длительность создаваемого ролика в секундах (по умолчанию 10)")
+    parser.add_argument('--size', type=parse_size, default=32 * 1024 * 1024,
+                        help="размер файлов из случайных байт, если ffmpeg нет (по умолчанию 32M)")
+    parser.add_argument('--fragment-size', type=parse_size, default=1024 * 1024,
+                        help="размер фрагмента в сценарии fragmented (по умолчанию 1M)")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="задержка ответа сервера в миллисекундах (по умолчанию 0)")
+    parser.add_argument('--server-rate', type=parse_rate, default=None,
+                        help="скорость одного соединения с сервером, например 2M (по умолчанию без ограничения)")
+    parser.add_argument('--workdir', default=None,
+                        help="рабочая папка (по умолчанию временная, удаляется после замера)")
+    parser.add_argument('--timeout', type=float, default=600.0,
+                        help="предельное время одного прогона в секундах (по умолчанию 600)")
+    parser.add_argument('--verbose', action='store_true', help="выводить лог движка и yt-dlp")
+    parser.add_argument('--ffmpeg', default=None, help="путь к ffmpeg")
+    parser.add_argument('--ffprobe', default=None, help="путь к ffprobe")
+    # Служебные: запуск одного прогона в отдельном процессе
+    parser.add_argument('--worker', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-output', default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def run_benchmark(args, workdir):
+    """Подготовить файлы, запустить сервер и все прогоны; вернуть результаты"""
+    tools = discover_tools(args.ffmpeg, args.ffprobe)
+    media, source = prepare_media(os.path.join(workdir, 'media'), args.size, args.duration,
+                                  args.clip, tools)
+    server = MediaServer(media, latency=args.latency / 1000.0, rate=args.server_rate,
+                         fragment_size=args.fragment_size).start()
+    print(f"Тестовые файлы: {source}, "
+          + ", ".join(f"{name} {format_bytes(os.path.getsize(path))}" for name, path in media.items()),
+          flush=True)
+
+    results = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'yt_dlp': yt_dlp.version.__version__,
+        'ffmpeg': tools.get('version') if tools.get('ffmpeg') else None,
+        'media': source,
+        'settings': {
+            'repeat': args.repeat,
+            'duration': args.duration,
+            'size': args.size,
+            'fragment_size': args.fragment_size,
+            'latency_ms': args.latency,
+            'server_rate': args.server_rate,
+        },
+        'scenarios': {},
+    }
+    try:
+        for scenario in args.scenarios:
+            if scenario in FFMPEG_SCENARIOS and not tools.get('ffmpeg'):
+                print(f"{scenario}: пропущен — нужен ffmpeg", flush=True)
+                results['scenarios'][scenario] = {'skipped': "нужен ffmpeg", 'runs': [], 'summary': None}
+                continue
+            server.infos[scenario] = scenario_info(scenario, server.base_url, media,
+                                                   args.duration, args.fragment_size)
+            runs = []
+            for _ in range(max(args.repeat, 1)):
+                run = run_worker(scenario, server, workdir, args)
+                if not run['ok']:
+                    print(f"{scenario}: ❌ {run['error']}", flush=True)
+                runs.append(run)
+            summary = summarize(runs)
+            results['scenarios'][scenario] = {'runs': runs, 'summary': summary}
+            if summary:
+                print_summary(scenario, summary)
+    finally:
+        server.stop()
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.worker:
+        result = run_scenario(args.worker, args.base_url, args.workdir,
+                              args.ffmpeg, args.ffprobe, args.verbose)
+        with open(args.worker_output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        return 0
+
+    previous = None
+    if args.compare:
+        try:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                previous = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"❌ Не удалось прочитать результаты для сравнения: {e}", file=sys.stderr)
+            return 2
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='ytdl_benchmark_')
+    try:
+        results = run_benchmark(args, workdir)
+    except KeyboardInterrupt:
+        print("\n⏹️ Прервано пользователем")
+        return 130
+    except (OSError, RuntimeError, subprocess.CalledProcessError) as e:
+        print(f"❌ Не удалось подготовить замер: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=1)
+    print(f"\nРезультаты сохранены: {args.output}", flush=True)
+
+    failed = [name for name, entry in results['scenarios'].items()
+              if not entry.get('skipped') and not entry['summary']]
+    regressions = compare_results(previous, results, args.threshold) if previous else []
+    if failed:
+        print(f"❌ Не выполнены: {', '.join(failed)}")
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Архив скачанных видео.
+
+Текстовый файл, по строке на скачанное видео: «экстрактор_id формат».
+Файл читается один раз в множество, поэтому проверка — O(1) и не требует
+ни сети, ни просмотра папки загрузки. Новая запись дописывается одной
+операцией записи с fsync, так что при сбое файл не остаётся полузаписанным.
+"""
+
+import os
+import threading
+from pathlib import Path
+
+from metadata_cache import video_key_for_info, video_key_for_url
+
+
+def default_archive_path():
+    """Файл архива по умолчанию"""
+    return str(Path.home() / ".youtube_downloader" / "download_archive.txt")
+
+
+def format_key(format_id=None, max_height=None):
+    """Запрошенный формат как часть ключа архива"""
+    if format_id:
+        return format_id
+    if max_height:
+        return f"height<={max_height}"
+    return "best"
+
+
+class DownloadArchive:
+    """Множество скачанных «видео + формат», сохраняемое в файл"""
+
+    def __init__(self, path=None):
+        self.path = Path(path or default_archive_path())
+        self._entries = set()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        self._entries.add(line)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _line(video_key, fmt):
+        return f"{video_key} {fmt}"
+
+    def contains(self, url, fmt="best"):
+        """Скачано ли видео по этому URL в этом формате (без сети)"""
+        line = self._line(video_key_for_url(url), fmt)
+        with self._lock:
+            return line in self._entries
+
+    def add(self, url, info=None, fmt="best"):
+        """Отметить видео как скачанное (по ключу URL и по ключу из info)"""
+        keys = {video_key_for_url(url), video_key_for_info(info) if info else None} - {None}
+        with self._lock:
+            new_lines = [self._line(key, fmt) for key in sorted(keys)
+                         if self._line(key, fmt) not in self._entries]
+            if not new_lines:
+                return
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                try:
+                    os.write(fd, ''.join(line + '\n' for line in new_lines).encode('utf-8'))
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError:
+                # Архив не критичен: при ошибке записи видео просто не будет пропущено в следующий раз
+                return
+            self._entries.update(new_lines)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
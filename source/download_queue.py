@@ -0,0 +1,411 @@
+"""
+Очередь заданий на скачивание с ограниченным пулом потоков.
+
+Каждое задание обрабатывается собственным DownloadEngine, поэтому задания
+независимы друг от друга. Количество одновременно работающих заданий
+ограничено числом воркеров и лимитом на один хост.
+"""
+
+import threading
+from urllib.parse import urlparse
+
+from downloader_engine import DownloadCancelled, DownloadFailed, is_playlist_info, iter_playlist_entries
+from job_profiler import JobProfiler, hottest, profile_path
+from metadata_cache import video_key_for_url
+
+
+class DownloadJob:
+    """Одно задание в очереди"""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    EXPANDING = 'expanding'
+    EXPANDED = 'expanded'
+    DONE = 'done'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    STATE_NAMES = {
+        QUEUED: 'В очереди',
+        RUNNING: 'Скачивается',
+        EXPANDING: 'Чтение плейлиста',
+        EXPANDED: 'Плейлист',
+        DONE: 'Готово',
+        SKIPPED: 'Пропущено',
+        FAILED: 'Ошибка',
+        CANCELLED: 'Прервано',
+    }
+
+    def __init__(self, job_id, url, format_id=None, max_height=None, video_info=None,
+                 download_path=None, options=None, title=None):
+        self.id = job_id
+        self.url = url
+        self.format_id = format_id
+        self.max_height = max_height
+        self.video_info = video_info
+        self.download_path = download_path
+        # Дополнительные настройки движка для этого задания (pipe_audio, priority, weight, profile, profile_dir)
+        self.options = dict(options or {})
+        self.title = (video_info or {}).get('title') or title or url
+        # Для плейлиста — сколько видео из него добавлено в очередь
+        self.entries_added = 0
+        self.state = self.QUEUED
+        self.result = None
+        self.error = None
+        self.temp_file = None
+        # Файл профиля задания (если профилирование включено)
+        self.profile_path = None
+        self.engine = None
+        self.cancel_requested = False
+
+    @property
+    def duplicate_key(self):
+        """Задания с одинаковым ключом качали бы в одни и те же временные файлы"""
+        return (video_key_for_url(self.url), self.format_id, self.max_height, self.download_path)
+
+    @property
+    def host(self):
+        """Хост URL без www./m. — ключ для лимита соединений на хост"""
+        host = (urlparse(self.url).hostname or '').lower()
+        for prefix in ('www.', 'm.'):
+            if host.startswith(prefix):
+                host = host[len(prefix):]
+        return host
+
+    @property
+    def state_name(self):
+        return self.STATE_NAMES.get(self.state, self.state)
+
+    @property
+    def priority(self):
+        """Приоритет задания в общем лимите скорости"""
+        return self.options.get('priority', 0)
+
+    @property
+    def is_finished(self):
+        return self.state not in (self.QUEUED, self.RUNNING, self.EXPANDING)
+
+    def cancel(self):
+        """Запросить отмену задания"""
+        self.cancel_requested = True
+        if self.engine:
+            self.engine.cancel()
+
+
+class DownloadQueue:
+    """Очередь заданий с пулом из max_workers потоков.
+
+    engine_factory(job) — создаёт DownloadEngine для задания;
+    on_update(job) — вызывается из рабочего потока при смене состояния задания.
+    """
+
+    def __init__(self, engine_factory, max_workers=2, per_host_limit=2, on_update=None):
+        self.engine_factory = engine_factory
+        self.max_workers = max(1, int(max_workers))
+        self.per_host_limit = max(1, int(per_host_limit))
+        self.on_update = on_update
+
+        self._jobs = []
+        self._pending = []
+        self._running_per_host = {}
+        self._next_id = 1
+        self._workers = []
+        self._active_workers = 0
+        # Потоки, раскрывающие плейлисты (не занимают воркеров)
+        self._expanding = 0
+        self._stopping = False
+        self._cond = threading.Condition()
+
+    # ------------------------------------------------------------------
+    # Управление заданиями
+    # ------------------------------------------------------------------
+
+    def add(self, url, format_id=None, max_height=None, video_info=None, download_path=None,
+            options=None, title=None):
+        """Добавить задание в конец очереди.
+
+        Если то же видео с тем же форматом уже ждёт или скачивается, новое
+        задание не создаётся — возвращается существующее.
+        """
+        job = DownloadJob(0, url, format_id, max_height, video_info, download_path, options, title)
+        key = job.duplicate_key
+        with self._cond:
+            for existing in self._jobs:
+                if not existing.is_finished and existing.duplicate_key == key:
+                    return existing
+            job.id = self._next_id
+            self._next_id += 1
+            self._jobs.append(job)
+            self._pending.append(job)
+            self._ensure_workers()
+            self._cond.notify_all()
+        self._notify(job)
+        return job
+
+    def jobs(self):
+        """Снимок списка заданий в порядке очереди"""
+        with self._cond:
+            pending_order = {job.id: index for index, job in enumerate(self._pending)}
+            # Сначала незавершённые по позиции в очереди, затем остальные в порядке добавления
+            return sorted(self._jobs, key=lambda j: (j.state != DownloadJob.RUNNING,
+                                                     j.is_finished,
+                                                     pending_order.get(j.id, 0)))
+
+    def get(self, job_id):
+        with self._cond:
+            for job in self._jobs:
+                if job.id == job_id:
+                    return job
+        return None
+
+    def move(self, job_id, offset):
+        """Сдвинуть ожидающее задание на offset позиций (-1 — выше, 1 — ниже)"""
+        with self._cond:
+            for index, job in enumerate(self._pending):
+                if job.id == job_id:
+                    new_index = max(0, min(len(self._pending) - 1, index + offset))
+                    if new_index == index:
+                        return False
+                    self._pending.insert(new_index, self._pending.pop(index))
+                    return True
+        return False
+
+    def cancel(self, job_id):
+        """Прервать задание: ожидающее снимается с очереди, активное — останавливается"""
+        job = self.get(job_id)
+        if not job:
+            return False
+        with self._cond:
+            if job in self._pending:
+                self._pending.remove(job)
+                job.state = DownloadJob.CANCELLED
+                job.cancel_requested = True
+                self._cond.notify_all()
+            elif job.state in (DownloadJob.RUNNING, DownloadJob.EXPANDING):
+                job.cancel()
+            else:
+                return False
+        self._notify(job)
+        return True
+
+    def cancel_all(self):
+        """Прервать все незавершённые задания"""
+        for job in self.jobs():
+            if not job.is_finished:
+                self.cancel(job.id)
+
+    def retry(self, job_id):
+        """Вернуть завершившееся с ошибкой или прерванное задание в очередь"""
+        job = self.get(job_id)
+        if not job:
+            return False
+        with self._cond:
+            if job.state not in (DownloadJob.FAILED, DownloadJob.CANCELLED):
+                return False
+            job.state = DownloadJob.QUEUED
+            job.cancel_requested = False
+            job.error = None
+            self._pending.append(job)
+            self._ensure_workers()
+            self._cond.notify_all()
+        self._notify(job)
+        return True
+
+    def set_priority(self, job_id, priority, weight=None):
+        """Изменить приоритет задания в общем лимите скорости (в том числе активного)"""
+        job = self.get(job_id)
+        if not job:
+            return False
+        job.options['priority'] = priority
+        if weight is not None:
+            job.options['weight'] = weight
+        if job.engine:
+            job.engine.set_priority(priority, weight)
+        self._notify(job)
+        return True
+
+    def set_max_workers(self, max_workers):
+        """Изменить число параллельных загрузок на лету"""
+        with self._cond:
+            self.max_workers = max(1, int(max_workers))
+            self._ensure_workers()
+            self._cond.notify_all()
+
+    def set_per_host_limit(self, per_host_limit):
+        """Изменить лимит одновременных заданий на один хост"""
+        with self._cond:
+            self.per_host_limit = max(1, int(per_host_limit))
+            self._cond.notify_all()
+
+    def active_count(self):
+        """Сколько заданий ожидает или выполняется"""
+        with self._cond:
+            return len(self._pending) + self._active_workers + self._expanding
+
+    def join(self):
+        """Дождаться завершения всех заданий"""
+        with self._cond:
+            while self._pending or self._active_workers or self._expanding:
+                self._cond.wait()
+
+    def shutdown(self, cancel=True):
+        """Остановить воркеры (при cancel=True — прервав активные задания)"""
+        if cancel:
+            self.cancel_all()
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+    # ------------------------------------------------------------------
+    # Воркеры
+    # ------------------------------------------------------------------
+
+    def _ensure_workers(self):
+        """Запустить недостающие рабочие потоки (вызывается под блокировкой)"""
+        self._workers = [w for w in self._workers if w.is_alive()]
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._worker_loop, daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    def _take_next_job(self):
+        """Первое ожидающее задание, чей хост не упёрся в лимит (под блокировкой)"""
+        if self._active_workers >= self.max_workers:
+            return None
+        for job in self._pending:
+            if self._running_per_host.get(job.host, 0) < self.per_host_limit:
+                self._pending.remove(job)
+                self._running_per_host[job.host] = self._running_per_host.get(job.host, 0) + 1
+                self._active_workers += 1
+                job.state = DownloadJob.RUNNING
+                return job
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job = None
+                while not self._stopping:
+                    # Лишние воркеры после уменьшения max_workers завершаются
+                    if len([w for w in self._workers if w.is_alive()]) > self.max_workers:
+                        self._workers.remove(threading.current_thread())
+                        return
+                    job = self._take_next_job()
+                    if job:
+                        break
+                    self._cond.wait()
+                if self._stopping:
+                    return
+
+            self._notify(job)
+            try:
+                if self._run_job(job):
+                    self._notify(job)
+            finally:
+                with self._cond:
+                    self._active_workers -= 1
+                    self._running_per_host[job.host] -= 1
+                    self._cond.notify_all()
+
+    def _run_job(self, job):
+        """Выполнить задание в текущем потоке.
+
+        Возвращает False, если задание передано потоку раскрытия плейлиста.
+        """
+        engine = self.engine_factory(job)
+        job.engine = engine
+        if job.cancel_requested:
+            engine.cancel()
+        profiler = JobProfiler(engine).start() if job.options.get('profile') else None
+        try:
+            # Уже скачанное пропускаем до любых сетевых запросов
+            if engine.is_archived(job.url, job.format_id, job.max_height, job.title):
+                job.state = DownloadJob.SKIPPED
+                return True
+
+            if job.video_info:
+                engine.video_info = job.video_info
+                engine.available_formats = engine.build_format_list(job.video_info)
+            else:
+                info = engine.get_video_info(job.url, allow_playlist=True)
+                if is_playlist_info(info):
+                    self._start_expansion(job, info)
+                    return False
+            job.title = engine.video_info.get('title') or job.url
+            self._notify(job)
+
+            format_id = job.format_id or engine.find_format_by_height(job.max_height)
+            job.result = engine.download_video(job.url, format_id)
+            job.state = DownloadJob.DONE if job.result else DownloadJob.SKIPPED
+            if job.result:
+                engine.record_in_archive(job.url, job.format_id, job.max_height)
+        except DownloadCancelled:
+            job.state = DownloadJob.CANCELLED
+        except DownloadFailed as e:
+            job.state = DownloadJob.FAILED
+            job.error = str(e)
+            job.temp_file = e.temp_file
+        except Exception as e:
+            job.state = DownloadJob.CANCELLED if engine.download_cancelled else DownloadJob.FAILED
+            job.error = str(e)
+            job.temp_file = engine.current_temp_file
+        finally:
+            if profiler:
+                self._save_profile(job, engine, profiler)
+        return True
+
+    @staticmethod
+    def _save_profile(job, engine, profiler):
+        """Остановить профилировщик задания и сохранить профиль в папку профилей"""
+        profiler.stop()
+        job.profile_path = profile_path(engine, job.url, job.options.get('profile_dir'))
+        if not profiler.save(job.profile_path):
+            engine.log_message(f"⚠️ Не удалось сохранить профиль: {job.profile_path}")
+            job.profile_path = None
+            return
+        summary = profiler.summary()
+        engine.log_message(f"🔬 Профиль задания: {job.profile_path}")
+        if summary:
+            engine.log_message(f"🔬 Дольше всего: {hottest(summary)}")
+
+    def _start_expansion(self, job, playlist_info):
+        """Раскрыть плейлист в отдельном потоке, не занимая воркер"""
+        with self._cond:
+            self._expanding += 1
+            job.state = DownloadJob.EXPANDING
+            job.title = playlist_info.get('title') or job.url
+        self._notify(job)
+        threading.Thread(target=self._expand_playlist, args=(job, playlist_info), daemon=True).start()
+
+    def _expand_playlist(self, job, playlist_info):
+        """Добавлять видео плейлиста в очередь по мере получения страниц списка"""
+        try:
+            for url, title in iter_playlist_entries(playlist_info):
+                if job.cancel_requested or self._stopping:
+                    break
+                self.add(url, max_height=job.max_height, download_path=job.download_path,
+                         options=job.options, title=title)
+                job.entries_added += 1
+        except Exception as e:
+            job.error = str(e)
+        finally:
+            if job.engine:
+                job.engine.close_playlist()
+            with self._cond:
+                if job.cancel_requested:
+                    job.state = DownloadJob.CANCELLED
+                elif job.error and not job.entries_added:
+                    job.state = DownloadJob.FAILED
+                else:
+                    job.state = DownloadJob.EXPANDED
+                self._expanding -= 1
+                self._cond.notify_all()
+            self._notify(job)
+
+    def _notify(self, job):
+        if self.on_update:
+            try:
+                self.on_update(job)
+            except Exception:
+                pass
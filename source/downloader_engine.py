@@ -0,0 +1,1457 @@
+"""
+Движок скачивания без графического интерфейса.
+
+Вся логика конвейера (получение информации, скачивание потоков, объединение
+через ffmpeg) живёт здесь и общается с внешним миром только через колбэки,
+поэтому её можно использовать и из Tk-окна, и из командной строки.
+"""
+
+import errno
+import os
+import subprocess
+import hashlib
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+
+import yt_dlp
+
+from download_archive import format_key
+from ffmpeg_tools import discover_tools
+from filename_index import FilenameIndex
+from media_probe import probe_container, probe_media, first_stream
+from metadata_cache import video_key_for_info, video_key_for_url
+from progress_model import ProgressModel
+from resume_journal import ResumeJournal, find_interrupted
+from retry_policy import (CODEC, DISK_FULL, ERROR_CLASS_NAMES, NETWORK, PERMISSION, THROTTLED,
+                          UNAVAILABLE, UNKNOWN, classify_error, default_policy)
+from stage_metrics import JobMetrics, default_registry, format_job_metrics, run_tool, tool_name
+from ydl_session import default_session
+
+
+class DownloadCancelled(Exception):
+    """Загрузка прервана пользователем"""
+
+
+class DownloadFailed(Exception):
+    """Загрузка завершилась ошибкой"""
+
+    def __init__(self, message, temp_file=None):
+        super().__init__(message)
+        self.temp_file = temp_file
+
+
+# Временные файлы, которые сейчас использует какое-либо задание процесса
+_claimed_temp_files = set()
+_claimed_lock = threading.Lock()
+
+
+def default_log(message):
+    """Лог по умолчанию — в stdout"""
+    print(message, flush=True)
+
+
+ERROR_RECOMMENDATIONS = {
+    NETWORK: """• Проверьте подключение к интернету
+• Попробуйте перезапустить роутер
+• Проверьте настройки брандмауэра
+• Попробуйте использовать VPN""",
+    THROTTLED: """• Сервер временно ограничил число запросов
+• Подождите несколько минут и возобновите загрузку
+• Уменьшите число параллельных загрузок""",
+    DISK_FULL: """• Освободите место на диске
+• Удалите ненужные файлы
+• Выберите другую папку для сохранения
+• Очистите корзину""",
+    PERMISSION: """• Запустите программу от имени администратора
+• Проверьте права доступа к папке
+• Выберите другую папку для сохранения
+• Закройте другие программы, использующие файл""",
+    CODEC: """• Попробуйте другое разрешение видео
+• Обновите yt-dlp: pip install --upgrade yt-dlp
+• Проверьте, поддерживается ли формат вашей системой""",
+    UNAVAILABLE: """• Проверьте правильность URL
+• Убедитесь, что видео не приватное
+• Попробуйте другой URL
+• Проверьте, доступно ли видео в вашем регионе""",
+}
+
+
+def log_tools(tools, log):
+    """Сообщить, какие ffmpeg/ffprobe найдены (tools — результат discover_tools)"""
+    if tools.get('ffmpeg'):
+        version = tools.get('version')
+        log(f"FFmpeg: {tools['ffmpeg']}" + (f" (версия {version})" if version else ""))
+    else:
+        log("FFmpeg не найден в PATH. Можно указать путь вручную.")
+    if tools.get('ffprobe'):
+        log(f"FFprobe: {tools['ffprobe']}")
+
+
+def analyze_error(error_msg):
+    """Анализировать ошибку и дать рекомендации"""
+    error_class = classify_error(error_msg)
+    if error_class == UNKNOWN and any(keyword in error_msg.lower() for keyword in ['url', 'video']):
+        error_class = UNAVAILABLE
+    return ERROR_RECOMMENDATIONS.get(
+        error_class,
+        "• Попробуйте перезапустить программу\n• Обновите yt-dlp: pip install --upgrade yt-dlp\n"
+        "• Проверьте логи для подробной информации\n• Обратитесь за помощью с текстом ошибки")
+
+
+def is_playlist_info(info):
+    """Результат извлечения — плейлист/канал, а не одно видео"""
+    return bool(info) and info.get('_type') in ('playlist', 'multi_video')
+
+
+def iter_playlist_entries(info):
+    """Лениво перебрать записи плейлиста: (URL, название)"""
+    for entry in info.get('entries') or []:
+        if not entry:
+            continue
+        url = entry.get('url') or entry.get('webpage_url')
+        if url:
+            yield url, entry.get('title')
+
+
+class DownloadEngine:
+    """Конвейер скачивания одного видео.
+
+    log(message) — куда писать сообщения;
+    confirm_redownload(existing_path) — спросить, качать ли заново уже
+    существующий файл (None — не качать повторно);
+    metadata_cache — MetadataCache для результатов extract_info (необязательно);
+    pipe_audio — передавать аудио в ffmpeg через канал, без временного файла;
+    fragment_controller — FragmentConcurrency для подбора числа параллельных
+    фрагментов DASH/HLS (без него фрагменты качаются по одному);
+    archive — DownloadArchive для пропуска уже скачанных видео без сети;
+    filename_index — FilenameIndex, общий для заданий (иначе свой у движка);
+    bandwidth — BandwidthScheduler, общий лимит скорости; priority и weight —
+    приоритет и вес задания при делении лимита;
+    session — YDLSession с готовыми экземплярами yt-dlp (по умолчанию общая для процесса);
+    tools — результат discover_tools, если ffmpeg уже найден (например, один раз
+    на весь пакет заданий); иначе поиск выполняется при первом обращении;
+    retry_policy — RetryPolicy: повторы по классу ошибки и их счётчики
+    (по умолчанию общая для процесса);
+    metrics — MetricsRegistry, куда попадают замеры этапов и запусков ffmpeg
+    (по умолчанию общий для процесса); замеры задания — в job_metrics.
+    """
+
+    # Целевой профиль совместимости итогового MP4
+    COMPAT_VIDEO_CODECS = ('h264',)
+    COMPAT_PIX_FMTS = ('yuv420p', 'yuvj420p')
+    COMPAT_AUDIO_CODECS = ('aac',)
+    # Примерная скорость перекодирования (во сколько раз быстрее воспроизведения):
+    # видео — для 1080p, libx264 veryfast и аппаратных кодировщиков; аудио — AAC.
+    # По ней оценивается время, сэкономленное копированием потоков
+    TRANSCODE_SPEED = {'libx264': 2.5, 'hardware': 8.0, 'audio': 100.0}
+    # Как часто (по скачанным байтам) сохранять суммы блоков недокачанного файла
+    CHECKPOINT_BYTES = 8 * 1024 * 1024
+    # Имена этапов в замерах
+    STAGE_KEYS = {1: 'video', 2: 'audio', 3: 'audio_track', 4: 'merge'}
+
+    def __init__(self, download_path=None, log=None, confirm_redownload=None,
+                 ffmpeg_path=None, ffprobe_path=None, metadata_cache=None, pipe_audio=False,
+                 fragment_controller=None, archive=None, filename_index=None,
+                 bandwidth=None, priority=0, weight=1.0, session=None, retry_policy=None,
+                 metrics=None, tools=None):
+        self.download_path = download_path or str(Path.home() / "Downloads")
+        self.log = log or default_log
+        self.confirm_redownload = confirm_redownload
+        self.metadata_cache = metadata_cache
+        self.pipe_audio = pipe_audio
+        self.fragment_controller = fragment_controller
+        self.archive = archive
+        # Экземпляры yt-dlp с открытыми соединениями переиспользуются между этапами и заданиями
+        self.session = session or default_session()
+        self.retry_policy = retry_policy or default_policy()
+        # Время этапов, байты и запуски ffmpeg/ffprobe текущего задания
+        self.metrics = metrics or default_registry()
+        self.job_metrics = JobMetrics(self.metrics)
+        # Пользователь уже подтвердил повторное скачивание (по архиву)
+        self.redownload_confirmed = False
+        # Имена файлов в папке загрузки без повторных обращений к диску
+        self.filename_index = filename_index or FilenameIndex()
+        self.reserved_filename = None
+        # Занятые заданием временные файлы (см. claim_temp_file)
+        self.claimed_temp_file = None
+        # Журнал возобновления текущего задания
+        self.journal = None
+        # .part-файлы, для которых в журнал пишутся суммы блоков: путь → поток и следующий порог
+        self.checkpoints = {}
+        # Прогресс текущей загрузки; клиенты опрашивают progress.snapshot()
+        self.progress = ProgressModel()
+        # Общий лимит скорости: доля задания и последние учтённые размеры файлов
+        self.bandwidth = bandwidth
+        self.priority = priority
+        self.weight = weight
+        self.bandwidth_slot = None
+        # Последние размеры файлов из сообщений yt-dlp (для учёта прироста)
+        self.transfer_seen = {}
+
+        self.video_info = None
+        self.available_formats = []
+        # Экземпляр yt-dlp, через который лениво читаются записи плейлиста
+        self.playlist_ydl = None
+
+        # Переменные для отслеживания ошибок и возобновления
+        self.current_temp_file = None
+        self.download_cancelled = False
+        # Остановить параллельные потоки задания (без отмены всего задания)
+        self.streams_aborted = False
+        # Имя вспомогательных потоков задания (по нему их находит профилировщик)
+        self.thread_prefix = f"engine-{id(self):x}"
+
+        # Пути к ffmpeg/ffprobe (автодетект) и их возможности
+        self.tools = tools
+        self.ffmpeg_path = ffmpeg_path or (tools or {}).get('ffmpeg')
+        self.ffprobe_path = ffprobe_path or (tools or {}).get('ffprobe')
+
+        # Отслеживание этапов
+        self.current_stage = 0
+        self.total_stages = 4
+        self.stage_names = [
+            "Скачивание основного видео потока",
+            "Скачивание дополнительного потока",
+            "Получение звуковой дорожки",
+            "Объединение звуковой дорожки с основным видео потоком"
+        ]
+
+    def log_message(self, message):
+        """Передать сообщение в лог клиента"""
+        try:
+            self.log(message)
+        except Exception:
+            # fail-safe: ошибки лога не должны ронять загрузку
+            pass
+
+    def check_for_temp_files(self):
+        """Найти прерванные загрузки (журналы возобновления) в папке загрузки"""
+        try:
+            if not Path(self.download_path).exists():
+                return []
+
+            journals = find_interrupted(self.download_path)
+            for journal in journals:
+                title = journal.data.get('title') or journal.data.get('url')
+                self.log_message(f"🔄 Прерванная загрузка: {title} (этап {journal.stage or 1})")
+            if journals:
+                self.log_message("Можно возобновить загрузку")
+            return journals
+        except Exception as e:
+            self.log_message(f"⚠️ Ошибка проверки временных файлов: {e}")
+        return []
+
+    def detect_ffmpeg_paths(self):
+        """Автоматически определить пути к ffmpeg/ffprobe и сохранить в self.ffmpeg_path/self.ffprobe_path"""
+        try:
+            # PATH, затем WinGet (Gyan.FFmpeg); результат кэшируется на диске
+            log_tools(self.tool_info(), self.log_message)
+        except Exception as e:
+            self.log_message(f"⚠️ Автоопределение FFmpeg не удалось: {e}")
+
+    def ydl_download(self, ydl_opts, url):
+        """Скачать через yt-dlp, используя уже полученную информацию о видео.
+
+        Повторное извлечение страницы и плеера не нужно: yt-dlp только выбирает
+        формат из self.video_info. Если ссылки на потоки устарели — качаем по URL.
+        """
+        with self.session.use(ydl_opts) as ydl:
+            if not self.video_info:
+                ydl.download([url])
+                return
+            info = ydl.sanitize_info(self.video_info, remove_private_keys=True)
+            try:
+                ydl.process_ie_result(info, download=True)
+            except yt_dlp.utils.DownloadError as e:
+                if self.download_cancelled or self.streams_aborted:
+                    raise
+                self.log_message(f"⚠️ Не удалось скачать по сохранённой информации ({e}), повторное извлечение...")
+                if self.metadata_cache:
+                    self.metadata_cache.invalidate(url)
+                ydl.download([url])
+
+    def ffmpeg_location_opts(self):
+        """Опция ffmpeg_location для yt-dlp, если путь к ffmpeg известен"""
+        return {'ffmpeg_location': os.path.dirname(self.ffmpeg_path)} if self.ffmpeg_path else {}
+
+    # ------------------------------------------------------------------
+    # Информация о видео и форматы
+    # ------------------------------------------------------------------
+
+    def extract_lazy(self, ydl, url):
+        """Извлечь информацию без обработки, пройдя перенаправления (канал → вкладка видео).
+
+        Записи плейлиста при этом остаются ленивыми: страницы списка
+        запрашиваются по мере перебора entries.
+        """
+        info = ydl.extract_info(url, download=False, process=False)
+        for _ in range(5):
+            if not info or info.get('_type') != 'url':
+                break
+            info = ydl.extract_info(info['url'], download=False, process=False,
+                                    ie_key=info.get('ie_key'))
+        return info
+
+    def get_video_info(self, url, use_cache=True, allow_playlist=False):
+        """Получить информацию о видео и доступные форматы.
+
+        Для плейлиста или канала при allow_playlist=True возвращается
+        плейлист с ленивыми плоскими записями (см. iter_playlist_entries).
+        """
+        self.log_message("Получение информации о видео...")
+
+        self.job_metrics.begin_stage('info')
+        try:
+            info = None
+            if use_cache and self.metadata_cache:
+                info = self.metadata_cache.get(url)
+                if info:
+                    self.log_message("📦 Информация о видео взята из кэша")
+
+            if not info:
+                ydl_opts = {
+                    'quiet': True,
+                    'no_warnings': True,
+                    'extract_flat': 'in_playlist',
+                    'lazy_playlist': True,
+                }
+
+                with self.session.use(ydl_opts) as ydl:
+                    info = self.extract_lazy(ydl, url)
+                    if is_playlist_info(info):
+                        title = info.get('title') or url
+                        if not allow_playlist:
+                            raise DownloadFailed(f"Это плейлист или канал, а не одно видео: {title}")
+                        self.log_message(f"📃 Плейлист: {title}")
+                        # Записи читаются через этот экземпляр, пока плейлист перебирают:
+                        # в пул он не возвращается, его закрывает close_playlist()
+                        self.session.detach(ydl)
+                        self.playlist_ydl = ydl
+                        return info
+                    info = ydl.process_ie_result(info, download=False)
+                if self.metadata_cache:
+                    self.metadata_cache.put(url, info)
+        finally:
+            self.job_metrics.end_stage('info')
+
+        self.video_info = info
+
+        title = info.get('title', 'Неизвестное название')
+        duration = int(info.get('duration') or 0)
+        self.log_message(f"Название: {title}")
+        self.log_message(f"Длительность: {duration // 60}:{duration % 60:02d}")
+
+        self.available_formats = self.build_format_list(info)
+        if self.available_formats:
+            self.log_message(f"Найдено {len(self.available_formats)} доступных форматов")
+        else:
+            self.log_message("❌ Не удалось получить информацию о форматах")
+        return info
+
+    def close_playlist(self):
+        """Плейлист перебран (или не нужен) — закрыть экземпляр yt-dlp, читавший его записи"""
+        ydl, self.playlist_ydl = self.playlist_ydl, None
+        if ydl:
+            try:
+                ydl.close()
+            except Exception:
+                pass
+
+    def build_format_list(self, info):
+        """Список (описание, format_id) видео-форматов, от лучшего к худшему"""
+        video_formats = []
+
+        for f in info.get('formats', []):
+            # Показываем все видео-форматы (с аудио или без), чтобы расширить список разрешений
+            if (f.get('vcodec') != 'none' and f.get('height')):
+                height = f.get('height', 0)
+                ext = f.get('ext', 'unknown')
+                format_id = f.get('format_id', 'unknown')
+                filesize = f.get('filesize', 0)
+
+                if filesize:
+                    size_mb = filesize / (1024 * 1024)
+                    format_desc = f"{height}p ({ext}) - {size_mb:.1f}MB"
+                else:
+                    format_desc = f"{height}p ({ext})"
+
+                video_formats.append((format_desc, format_id))
+
+        # Сортировать по разрешению (по убыванию)
+        video_formats.sort(key=lambda x: int(x[0].split('p')[0]), reverse=True)
+        return video_formats
+
+    def find_format_by_height(self, max_height=None):
+        """Выбрать лучший format_id не выше max_height (None — самый лучший)"""
+        for desc, fid in self.available_formats:
+            height = int(desc.split('p')[0])
+            if max_height is None or height <= max_height:
+                return fid
+        # Ничего не подошло по высоте — берём самый низкий из доступных
+        if self.available_formats:
+            return self.available_formats[-1][1]
+        return None
+
+    def get_format_extension(self, format_id):
+        """Исходное расширение выбранного формата"""
+        if self.video_info:
+            for f in self.video_info.get('formats', []):
+                if f.get('format_id') == format_id:
+                    ext = f.get('ext')
+                    if ext in ['mp4', 'webm', 'mkv', 'avi']:
+                        return ext
+                    break
+        return 'mp4'
+
+    # ------------------------------------------------------------------
+    # Имена файлов и состояние
+    # ------------------------------------------------------------------
+
+    def generate_file_hash(self, url, format_id, title):
+        """Хеш для имени временного файла: зависит только от видео и формата,
+        поэтому повторная попытка и перезапуск находят свои файлы"""
+        video_key = video_key_for_info(self.video_info or {}) or video_key_for_url(url)
+        content = f"{video_key}_{format_id}"
+        return hashlib.md5(content.encode()).hexdigest()[:12]
+
+    def get_unique_filename(self, title, extension, is_redownload=False):
+        """Получить уникальное имя файла и занять его в индексе папки"""
+        download_dir = Path(self.download_path)
+        if not download_dir.exists():
+            download_dir.mkdir(parents=True, exist_ok=True)
+
+        base_name = title
+        # При перескачивании добавляем _copy_
+        suffix = "_copy" if is_redownload else ""
+
+        def candidates():
+            yield f"{base_name}{suffix}.{extension}"
+            counter = 2
+            while True:
+                yield f"{base_name}{suffix}_{counter}.{extension}"
+                counter += 1
+
+        self.reserved_filename = self.filename_index.reserve(str(download_dir), candidates())
+        return self.reserved_filename
+
+    def is_archived(self, url, format_id=None, max_height=None, title=None):
+        """Видео уже есть в архиве скачанных, и качать его заново не нужно"""
+        if not (self.archive is not None and self.archive.contains(url, format_key(format_id, max_height))):
+            return False
+        if self.confirm_redownload and self.confirm_redownload(title or url):
+            self.log_message("Пользователь выбрал скачать заново")
+            self.redownload_confirmed = True
+            return False
+        self.log_message(f"⏭️ Уже скачано (архив): {title or url}")
+        return True
+
+    def record_in_archive(self, url, format_id=None, max_height=None):
+        """Отметить видео скачанным в архиве"""
+        if self.archive is not None:
+            self.archive.add(url, self.video_info, format_key(format_id, max_height))
+
+    def check_existing_file(self, title):
+        """Проверить, существует ли уже файл с таким названием"""
+        download_dir = Path(self.download_path)
+        if not download_dir.exists():
+            return None
+
+        # Ищем файлы с похожим названием по индексу папки (без обхода диска)
+        title_key = os.path.normcase(title)
+        for ext in ['mp4', 'webm', 'mkv', 'avi']:
+            suffix = f".{ext}"
+            name = self.filename_index.find(
+                str(download_dir), lambda n: n.endswith(suffix) and title_key in n[:-len(suffix)])
+            if name:
+                return download_dir / name
+        return None
+
+    def reset_download_state(self):
+        """Сбросить состояние загрузки"""
+        self.current_temp_file = None
+        self.download_cancelled = False
+        self.streams_aborted = False
+
+    def resolve_existing_temp_variant(self, base_temp_path):
+        """Вернуть существующий путь временного файла с учетом .part"""
+        variants = [
+            base_temp_path,
+            base_temp_path + '.part',
+        ]
+        for v in variants:
+            if os.path.exists(v):
+                return v
+        return base_temp_path
+
+    def cancel(self):
+        """Прервать загрузку"""
+        self.download_cancelled = True
+
+    # ------------------------------------------------------------------
+    # Ограничение скорости
+    # ------------------------------------------------------------------
+
+    def acquire_bandwidth(self):
+        """Получить долю общего лимита скорости на время загрузки"""
+        if self.bandwidth is not None and self.bandwidth_slot is None:
+            self.bandwidth_slot = self.bandwidth.register(self.priority, self.weight)
+        self.transfer_seen = {}
+
+    def release_bandwidth(self):
+        """Вернуть долю лимита"""
+        slot, self.bandwidth_slot = self.bandwidth_slot, None
+        if slot is not None:
+            slot.close()
+
+    def set_priority(self, priority=None, weight=None):
+        """Изменить приоритет и вес задания (в том числе во время загрузки)"""
+        if priority is not None:
+            self.priority = priority
+        if weight is not None:
+            self.weight = weight
+        slot = self.bandwidth_slot
+        if slot is not None:
+            slot.set_priority(priority, weight)
+
+    def throttle(self, nbytes):
+        """Учесть полученные байты в общем лимите (ждёт, если доля исчерпана)"""
+        slot = self.bandwidth_slot
+        if slot is not None and nbytes > 0:
+            slot.consume(nbytes, cancelled=lambda: self.download_cancelled)
+
+    def count_transfer(self, nbytes, stream=None):
+        """Учесть полученные байты в замерах этапа и в общем лимите скорости"""
+        self.job_metrics.add_downloaded(self.metrics_stage(stream), nbytes)
+        self.throttle(nbytes)
+
+    def account_progress(self, d, stream=None):
+        """Учесть прирост файла, о котором сообщил yt-dlp"""
+        # Свои HTTP-загрузки (stream_http_to) учитываются при каждом чтении и имени файла не передают
+        name = d.get('tmpfilename') or d.get('filename')
+        if not name or d.get('status') not in ('downloading', 'finished'):
+            return
+        downloaded = d.get('downloaded_bytes') or 0
+        checkpoint = self.checkpoints.get(name)
+        if checkpoint and downloaded >= checkpoint['next_at']:
+            checkpoint['next_at'] = downloaded + self.CHECKPOINT_BYTES
+            self.journal.record_chunks(checkpoint['stream'], name)
+        previous = self.transfer_seen.get(name)
+        self.transfer_seen[name] = downloaded
+        # Первое сообщение по файлу — точка отсчёта: докачанное ранее уже не считается
+        if previous is not None:
+            self.count_transfer(downloaded - previous, stream)
+
+    # ------------------------------------------------------------------
+    # Прогресс и этапы
+    # ------------------------------------------------------------------
+
+    def progress_hook(self, d, stream=None):
+        """Обработчик прогресса скачивания"""
+        # Корректная отмена загрузки
+        if self.download_cancelled:
+            raise yt_dlp.utils.DownloadError('Отменено пользователем')
+        if stream and self.streams_aborted:
+            raise yt_dlp.utils.DownloadError('Поток остановлен')
+        # Только запись чисел в модель; проценты и скорость выводят клиенты
+        self.progress.update(d, stream)
+        self.account_progress(d, stream)
+        if d['status'] == 'finished':
+            prefix = f"{stream}: " if stream else ""
+            self.log_message(f"{prefix}Скачивание завершено!")
+
+    def make_progress_hook(self, stream):
+        """Обработчик прогресса для отдельного потока (видео/аудио)"""
+        return lambda d: self.progress_hook(d, stream)
+
+    def metrics_stage(self, stream=None):
+        """Этап, к которому относятся байты потока stream"""
+        if stream == "Аудио":
+            return 'audio'
+        if stream == "Видео":
+            return 'video'
+        return self.STAGE_KEYS.get(self.current_stage, 'video')
+
+    def count_written(self, stage, path):
+        """Учесть размер файла, получившегося на этапе"""
+        try:
+            self.job_metrics.add_written(stage, os.path.getsize(path))
+        except OSError:
+            pass
+
+    def start_stage(self, stage_num, stage_name):
+        """Начать новый этап"""
+        self.current_stage = stage_num
+        self.progress.set_stage(stage_num, stage_name)
+        self.job_metrics.begin_stage(self.STAGE_KEYS[stage_num])
+        self.log_message(f"Этап {stage_num}/{self.total_stages}:")
+        self.log_message(f"{stage_name}.")
+
+    def log_stage_progress(self, progress_text):
+        """Логировать прогресс текущего этапа"""
+        self.log_message(progress_text)
+
+    def finish_stage(self, stage_num, completion_text):
+        """Завершить этап"""
+        self.job_metrics.end_stage(self.STAGE_KEYS[stage_num])
+        self.log_message(completion_text)
+
+    # ------------------------------------------------------------------
+    # Конвейер
+    # ------------------------------------------------------------------
+
+    def download_video(self, url, format_id=None):
+        """Скачать видео со звуком и вернуть путь к итоговому файлу.
+
+        Возвращает None, если пользователь отказался от повторного скачивания.
+        Бросает DownloadCancelled при отмене и DownloadFailed при ошибке.
+        Замеры этапов остаются в job_metrics (сводка — job_metrics.summary()).
+        """
+        if self.job_metrics.result is not None:
+            # Движок качает уже не первое видео — замеры заново
+            self.job_metrics = JobMetrics(self.metrics)
+        self.job_metrics.start(url=url)
+        result = 'failed'
+        path = None
+        try:
+            path = self.run_pipeline(url, format_id)
+            result = 'done' if path else 'skipped'
+            return path
+        except DownloadCancelled:
+            result = 'cancelled'
+            raise
+        finally:
+            self.job_metrics.finish(result, title=(self.video_info or {}).get('title'), output=path)
+            if result == 'done':
+                self.log_message(f"⏱️ {format_job_metrics(self.job_metrics.summary())}")
+
+    def run_pipeline(self, url, format_id=None):
+        """Этапы download_video: скачивание потоков, объединение, финализация"""
+        self.acquire_bandwidth()
+        try:
+            # Получить информацию о видео, если еще не получена
+            if not self.video_info:
+                self.get_video_info(url)
+
+            title = self.video_info.get('title', 'Неизвестное название')
+
+            # Проверить, существует ли уже файл
+            is_redownload = self.redownload_confirmed
+            existing_file = None if is_redownload else self.check_existing_file(title)
+            if existing_file:
+                if not (self.confirm_redownload and self.confirm_redownload(existing_file)):
+                    self.log_message(f"⏭️ Файл уже существует: {existing_file.name}")
+                    return None
+                self.log_message("Пользователь выбрал скачать заново")
+                is_redownload = True
+
+            # Выбрать формат
+            if not format_id:
+                format_id = self.find_format_by_height() or 'best'  # Fallback
+            self.job_metrics.fields['format_id'] = format_id
+
+            # Исходное расширение выбранного формата
+            file_extension = self.get_format_extension(format_id)
+            # Всегда финализируем в MP4 для максимальной совместимости
+            container_ext = 'mp4'
+
+            # Создать уникальное имя файла
+            final_filename = self.get_unique_filename(title, container_ext, is_redownload)
+
+            # Имя временного файла постоянно для пары «видео + формат»
+            temp_hash = self.generate_file_hash(url, format_id, title)
+            temp_filename = f"temp_{temp_hash}.{container_ext}"
+            temp_path = os.path.join(self.download_path, temp_filename)
+            self.claim_temp_file(temp_path)
+            self.current_temp_file = temp_path
+
+            video_only_path = temp_path  # сохранённый выбранный формат
+            audio_path = os.path.splitext(temp_path)[0] + '_audio.m4a'
+
+            # Журнал: после сбоя задание продолжится с достигнутого этапа
+            self.journal = ResumeJournal(os.path.splitext(temp_path)[0] + '.json')
+            if self.journal.stage:
+                self.log_message(f"🔄 Возобновление прерванной загрузки с этапа {self.journal.stage}")
+            self.journal.update(url=url, format_id=format_id, title=title,
+                                download_path=self.download_path, stage=self.journal.stage or 1)
+            video_done = self.journal.stream_done('video', temp_path)
+            audio_done = self.journal.stream_done('audio', audio_path)
+
+            # Если заранее известно, что формат без звука, — качаем аудио параллельно с видео
+            # (или, в режиме pipe_audio, передаём его в ffmpeg при объединении;
+            # уже скачанное аудио повторно не передаём)
+            video_only = self.is_video_only_format(format_id) and self.has_ffmpeg()
+            pipe_audio_format = (self.select_pipe_audio_format()
+                                 if (video_only and self.pipe_audio and not audio_done) else None)
+            parallel_audio = video_only and not pipe_audio_format
+            executor = None
+            audio_future = None
+            success = False
+
+            # Этап 1: Скачиваем выбранный формат (как есть)
+            self.progress.reset()
+            self.start_stage(1, self.stage_names[0])
+            if parallel_audio and not audio_done:
+                # Этап 2 идёт одновременно с этапом 1
+                self.start_stage(2, self.stage_names[1])
+                executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.thread_prefix)
+                audio_future = executor.submit(self.acquire_audio, url, audio_path, "Аудио")
+            try:
+                if video_done:
+                    self.log_stage_progress("Видеопоток уже скачан ранее")
+                    success = True
+                else:
+                    success = self.download_with_retry(url, temp_path, format_id, file_extension,
+                                                       stream=("Видео" if parallel_audio else None))
+                    if success and os.path.exists(temp_path):
+                        self.journal.mark_stream_done('video', temp_path)
+                        self.count_written('video', temp_path)
+            finally:
+                if executor:
+                    if not success or self.download_cancelled:
+                        # Видео не скачалось — аудио больше не нужно
+                        self.streams_aborted = True
+                    executor.shutdown(wait=True)
+
+            if self.download_cancelled:
+                raise DownloadCancelled()
+            if not success:
+                raise DownloadFailed("Не удалось скачать видео после нескольких попыток", self.current_temp_file)
+
+            # Если уже есть аудиодорожка — просто финализируем
+            if not parallel_audio and (self.has_audio_track(temp_path) or not self.has_ffmpeg()):
+                part_path = temp_path + '.part'
+                if os.path.exists(part_path):
+                    raise DownloadFailed("Файл ещё не докачан (обнаружен .part). Попробуйте возобновить загрузку.", part_path)
+                if os.path.exists(temp_path):
+                    os.rename(temp_path, final_filename)
+                self.journal.remove()
+                self.finish_stage(1, "✅ Видео успешно скачано!")
+                return self.keep_reserved_filename(final_filename)
+
+            self.finish_stage(1, "Видеопоток скачан!")
+            if pipe_audio_format:
+                self.start_stage(2, self.stage_names[1])
+                self.start_stage(4, self.stage_names[3])
+                self.log_stage_progress("Аудио передаётся в ffmpeg напрямую, без временного файла")
+                if self.merge_with_piped_audio(video_only_path, pipe_audio_format, final_filename):
+                    self.finish_stage(2, "Аудио передано в ffmpeg!")
+                    self.count_written('merge', final_filename)
+                    if os.path.exists(video_only_path):
+                        try:
+                            os.remove(video_only_path)
+                        except Exception:
+                            pass
+                    self.finalize_output(final_filename)
+                    self.finish_stage(4, "✅ Видео со звуком готово!")
+                    return self.keep_reserved_filename(final_filename)
+                # Неудачная попытка учитывается в замерах; этапы 2 и 4 начнутся заново
+                self.job_metrics.end_stage(self.STAGE_KEYS[2])
+                self.job_metrics.end_stage(self.STAGE_KEYS[4])
+                if self.download_cancelled:
+                    raise DownloadCancelled()
+                self.log_message("⚠️ Передача аудио через канал не удалась, скачиваем аудио в файл")
+
+            self.journal.update(stage=2)
+            if audio_done:
+                # Этап 2 не начинался: аудио есть с прошлого запуска
+                self.log_stage_progress("Аудиодорожка уже скачана ранее")
+                audio_ok = True
+            elif parallel_audio:
+                audio_ok = audio_future.result()
+            else:
+                # Этап 2: Скачивание дополнительного потока (аудио)
+                self.start_stage(2, self.stage_names[1])
+                audio_ok = self.acquire_audio(url, audio_path)
+            if self.download_cancelled:
+                raise DownloadCancelled()
+            if not audio_ok:
+                raise DownloadFailed("Не удалось получить аудиодорожку", self.current_temp_file)
+            if not audio_done:
+                self.journal.mark_stream_done('audio', audio_path)
+                self.count_written('audio', audio_path)
+                self.finish_stage(2, "Скачивание завершено!")
+
+            # Этап 3: Получение звуковой дорожки
+            self.start_stage(3, self.stage_names[2])
+            self.log_stage_progress("Получено: 100%")
+            self.finish_stage(3, "Звуковая дорожка получена!")
+
+            # Этап 4: Объединение звуковой дорожки с основным видео потоком
+            self.journal.update(stage=4)
+            self.start_stage(4, self.stage_names[3])
+            merged_ok = self.merge_video_audio(video_only_path, audio_path, final_filename)
+            if not merged_ok:
+                # Скачанные потоки оставляем: при повторе объединение начнётся сразу
+                raise DownloadFailed("Не удалось объединить видео и звук", video_only_path)
+            self.count_written('merge', final_filename)
+            # Удаляем временные отдельные файлы
+            for f in [video_only_path, audio_path]:
+                if os.path.exists(f):
+                    try:
+                        os.remove(f)
+                    except Exception:
+                        pass
+            # Доп. совместимость: приводим к h264/aac только то, что ещё не совместимо
+            self.finalize_output(final_filename)
+            self.finish_stage(4, "✅ Видео со звуком готово!")
+            return self.keep_reserved_filename(final_filename)
+
+        except (DownloadCancelled, DownloadFailed):
+            self.release_reserved_filename()
+            raise
+        except Exception as e:
+            self.release_reserved_filename()
+            if self.download_cancelled:
+                raise DownloadCancelled()
+            raise DownloadFailed(f"Ошибка при скачивании: {str(e)}", self.current_temp_file)
+        finally:
+            self.release_temp_file()
+            self.release_bandwidth()
+
+    def claim_temp_file(self, temp_path):
+        """Занять временные файлы задания: два задания не должны писать в одни и те же файлы"""
+        key = os.path.normcase(os.path.abspath(temp_path))
+        with _claimed_lock:
+            if key in _claimed_temp_files:
+                raise DownloadFailed("Это видео в этом формате уже скачивается другим заданием")
+            _claimed_temp_files.add(key)
+        self.claimed_temp_file = key
+
+    def release_temp_file(self):
+        """Освободить временные файлы задания"""
+        if self.claimed_temp_file:
+            with _claimed_lock:
+                _claimed_temp_files.discard(self.claimed_temp_file)
+            self.claimed_temp_file = None
+
+    def keep_reserved_filename(self, path):
+        """Итоговый файл записан — закрепить имя в индексе папки"""
+        self.filename_index.add(path)
+        self.reserved_filename = None
+        return path
+
+    def release_reserved_filename(self):
+        """Освободить занятое имя, если итоговый файл так и не появился"""
+        if self.reserved_filename and not os.path.exists(self.reserved_filename):
+            self.filename_index.discard(self.reserved_filename)
+        self.reserved_filename = None
+
+    def acquire_audio(self, url, audio_path, stream=None):
+        """Получить аудиодорожку: отдельный аудиопоток, иначе — из маленького видео со звуком"""
+        audio_ok = self.download_audio_separately(url, audio_path, stream)
+        if not audio_ok and not (self.download_cancelled or self.streams_aborted):
+            # скачать маленькое видео со звуком и извлечь
+            small_with_audio = os.path.splitext(audio_path)[0] + '_small.mp4'
+            try:
+                ydl_opts = {
+                    'outtmpl': small_with_audio,
+                    'format': 'worst[acodec!=none]',
+                    'progress_hooks': [self.make_progress_hook(stream or "Аудио")],
+                    **self.ffmpeg_location_opts(),
+                }
+                self.retry_stage('audio', lambda: self.ydl_download(ydl_opts, url))
+                audio_ok = self.extract_audio_from_video(small_with_audio, audio_path)
+            except Exception as e:
+                self.log_message(f"❌ Ошибка получения аудио из видео: {e}")
+                audio_ok = False
+            finally:
+                if os.path.exists(small_with_audio):
+                    try:
+                        os.remove(small_with_audio)
+                    except Exception:
+                        pass
+        return audio_ok
+
+    def retry_stage(self, stage, action, progress_path=None):
+        """Выполнить действие этапа с повторами по политике (пауза и число попыток
+        зависят от класса ошибки); после отказа пробрасывается последняя ошибка.
+
+        Если за неудачную попытку файл progress_path вырос, попытка не
+        считается безуспешной и счётчик начинается заново.
+        """
+        def size():
+            return os.path.getsize(progress_path) if progress_path and os.path.exists(progress_path) else 0
+
+        attempt = 0
+        total = 0
+        while True:
+            attempt += 1
+            total += 1
+            size_before = size()
+            self.retry_policy.metrics.attempt(stage)
+            try:
+                return action()
+            except Exception as e:
+                if self.download_cancelled or self.streams_aborted:
+                    raise
+                if size() > size_before:
+                    attempt = 1
+                error_class, delay = self.retry_policy.decide(stage, e, attempt, total)
+                self.job_metrics.record_retry(stage, error_class, gave_up=delay is None)
+                if delay is None:
+                    self.log_message(f"❌ {ERROR_CLASS_NAMES[error_class]}, повторов больше не будет: {e}")
+                    raise
+                self.log_message(f"🔄 {ERROR_CLASS_NAMES[error_class]}: {e}")
+                self.log_message(f"Повтор через {delay:.1f} с (попытка {total + 1})")
+                if not self.retry_policy.sleep(delay, lambda: self.download_cancelled):
+                    raise DownloadCancelled()
+
+    def download_with_retry(self, url, temp_path, format_id, file_extension, stream=None):
+        """Скачать выбранный видео-формат (без аудио) с повторами по классу ошибки"""
+        part_path = temp_path + '.part'
+
+        def attempt():
+            try:
+                # Перед продолжением .part-файла убедиться, что он цел
+                self.verify_partial_download(part_path, format_id)
+                # Скачиваем выбранный видео-формат (возможен и со звуком, если прогрессивный)
+                return self.download_selected_video(url, temp_path, format_id, stream)
+            finally:
+                self.checkpoints.pop(part_path, None)
+
+        try:
+            return self.retry_stage('video', attempt, progress_path=part_path)
+        except Exception as e:
+            if not self.download_cancelled:
+                self.log_message(f"❌ Видеопоток не скачан: {e}")
+            return False
+
+    def format_signature(self, format_id):
+        """Описание формата, по которому видно, что на сервере он не сменился"""
+        for f in (self.video_info or {}).get('formats', []):
+            if f.get('format_id') == format_id:
+                return {
+                    'format_id': format_id,
+                    'ext': f.get('ext'),
+                    'filesize': f.get('filesize'),
+                    'width': f.get('width'),
+                    'height': f.get('height'),
+                }
+        return None
+
+    def verify_partial_download(self, part_path, format_id, name='video'):
+        """Сверить .part-файл потока name с журналом; испорченный хвост обрезать, чужой файл удалить"""
+        if not self.journal:
+            return
+        size_before = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        signature = self.format_signature(format_id)
+        result = self.journal.verify_partial(name, part_path, signature)
+        fragment_state = part_path[:-len('.part')] + '.ytdl'
+        if result == 'truncated' and os.path.exists(fragment_state):
+            # Фрагменты yt-dlp учитывает по номерам (.ytdl), а не по байтам — начинаем заново
+            result = self.journal.reset_partial(name, part_path, signature)
+        if result == 'reset' and os.path.exists(fragment_state):
+            os.remove(fragment_state)
+        size_after = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        self.retry_policy.metrics.add_wasted(name, size_before - size_after)
+        self.job_metrics.add_wasted(size_before - size_after)
+        if result == 'truncated':
+            self.log_message(f"⚠️ Конец недокачанного файла повреждён: докачиваем с {size_after} байт "
+                             f"(было {size_before})")
+        elif result == 'reset' and size_before:
+            self.log_message("⚠️ Недокачанный файл не совпадает с форматом на сервере — скачиваем заново")
+        self.checkpoints[part_path] = {'stream': name, 'next_at': size_after + self.CHECKPOINT_BYTES}
+
+    def download_selected_video(self, url, temp_video_path, format_id, stream=None):
+        """Скачать видео выбранного формата format_id как есть (может быть со звуком, если прогрессивный)"""
+        ydl_opts = {
+            'outtmpl': temp_video_path,
+            'progress_hooks': [self.make_progress_hook(stream) if stream else self.progress_hook],
+            'format': format_id,
+            'continuedl': True,
+            'nopart': False,
+            'quiet': False,
+            **self.ffmpeg_location_opts(),
+        }
+        self.fragmented_download(ydl_opts, url, format_id, temp_video_path)
+        return True
+
+    def is_fragmented_format(self, format_id):
+        """Формат качается фрагментами (DASH/HLS/ISM)"""
+        for f in (self.video_info or {}).get('formats', []):
+            if f.get('format_id') == format_id:
+                protocol = f.get('protocol') or ''
+                return bool(f.get('fragments')) or any(p in protocol for p in ('dash', 'm3u8', 'ism', 'f4m'))
+        return False
+
+    def media_host(self, format_id, url):
+        """Хост, с которого идут фрагменты формата (CDN), иначе — хост страницы видео"""
+        for f in (self.video_info or {}).get('formats', []):
+            if f.get('format_id') == format_id:
+                for key in ('fragment_base_url', 'url', 'manifest_url'):
+                    host = urlparse(f.get(key) or '').hostname
+                    if host:
+                        return host
+        return urlparse(url).hostname or ''
+
+    def fragmented_download(self, ydl_opts, url, format_id, output_path):
+        """Скачать с подобранным числом параллельных фрагментов и сообщить контроллеру скорость"""
+        if not (self.fragment_controller and self.is_fragmented_format(format_id)):
+            self.ydl_download({**ydl_opts, 'concurrent_fragment_downloads': 1}, url)
+            return
+
+        host = self.media_host(format_id, url)
+        # Если все соединения заняты другими заданиями — ждём освобождения
+        level = self.fragment_controller.acquire(host, lambda: self.download_cancelled or self.streams_aborted)
+        if not level:
+            raise DownloadCancelled()
+        self.progress.set_fragment_level(level)
+        self.log_message(f"Параллельных фрагментов: {level}")
+
+        def file_size():
+            for path in (output_path, output_path + '.part'):
+                if os.path.exists(path):
+                    return os.path.getsize(path)
+            return 0
+
+        size_before = file_size()
+        started = time.time()
+        try:
+            self.ydl_download({**ydl_opts, 'concurrent_fragment_downloads': level}, url)
+        except Exception as e:
+            if self.download_cancelled or self.streams_aborted:
+                self.fragment_controller.release(host, level)
+            else:
+                error_lower = str(e).lower()
+                throttled = '429' in error_lower or 'too many requests' in error_lower
+                self.fragment_controller.release(host, level, error=True, throttled=throttled)
+            raise
+        self.fragment_controller.release(host, level, nbytes=max(0, file_size() - size_before),
+                                         seconds=time.time() - started)
+
+    def download_audio_separately(self, url, output_path, stream=None):
+        """Скачать только аудио"""
+        try:
+            base_no_ext = os.path.splitext(output_path)[0]
+            ydl_outtmpl = base_no_ext + ".%(ext)s"
+            # Без отдельного потока прогресса байты аудио всё равно учитываются в замерах
+            hooks = [self.make_progress_hook(stream)] if stream else [self.account_progress]
+
+            if self.has_ffmpeg():
+                # Аудио берём как есть (предпочитая AAC в m4a): при объединении оно будет
+                # скопировано, а перекодировано не более одного раза — только если это не AAC
+                ydl_opts = {
+                    'format': 'bestaudio[ext=m4a]/bestaudio/best',
+                    'outtmpl': ydl_outtmpl,
+                    'progress_hooks': hooks,
+                    'quiet': True,
+                    'no_warnings': True,
+                    **self.ffmpeg_location_opts(),
+                }
+            else:
+                # Без ffmpeg нельзя гарантировать m4a; попытаемся выбрать m4a, иначе любой bestaudio
+                ydl_opts = {
+                    'format': 'bestaudio[ext=m4a]/bestaudio',
+                    'outtmpl': ydl_outtmpl,
+                    'progress_hooks': hooks,
+                    'quiet': True,
+                    'no_warnings': True,
+                }
+
+            # Аудио в m4a сверяется с журналом так же, как видео
+            part_path = base_no_ext + '.m4a.part'
+            audio_format = self.select_pipe_audio_format()
+
+            def attempt():
+                try:
+                    self.verify_partial_download(part_path, (audio_format or {}).get('format_id'), 'audio')
+                    self.ydl_download(ydl_opts, url)
+                finally:
+                    self.checkpoints.pop(part_path, None)
+
+            self.retry_stage('audio', attempt, progress_path=part_path)
+
+            # Найти итоговый файл и переименовать в ожидаемый output_path
+            expected_m4a = base_no_ext + '.m4a'
+            if os.path.exists(expected_m4a):
+                if output_path != expected_m4a:
+                    try:
+                        if os.path.exists(output_path):
+                            os.remove(output_path)
+                    except Exception:
+                        pass
+                    os.replace(expected_m4a, output_path)
+                return True
+
+            # Если не вышло m4a, попробуем найти любой созданный аудио файл
+            for ext in ('.mp3', '.opus', '.webm', '.aac', '.ogg', '.mka'):
+                candidate = base_no_ext + ext
+                if os.path.exists(candidate):
+                    # Сохраняем поток как есть под именем output_path: ffmpeg определяет
+                    # формат по содержимому, а кодек при необходимости сменится при объединении
+                    if output_path != candidate:
+                        os.replace(candidate, output_path)
+                    return True
+
+            return False
+        except Exception as e:
+            self.log_message(f"❌ Ошибка скачивания аудио: {e}")
+            return False
+
+    # ------------------------------------------------------------------
+    # ffmpeg
+    # ------------------------------------------------------------------
+
+    def audio_codec_args(self, copy):
+        """Аргументы ffmpeg для аудио: копирование потока или перекодирование в AAC"""
+        if copy:
+            return ['-c:a', 'copy']
+        return ['-c:a', 'aac', '-b:a', '192k']
+
+    def can_copy_audio(self, media_path):
+        """Можно ли скопировать аудио без перекодирования (None — кодек не определён)"""
+        audio = first_stream(probe_media(media_path, self.ffprobe_path, self.ffmpeg_path, self.job_metrics),
+                             'audio')
+        if audio is None:
+            return None
+        return audio.get('codec_name') in self.COMPAT_AUDIO_CODECS
+
+    def extract_audio_from_video(self, video_path, audio_path):
+        """Извлечь аудио из видео файла в m4a (копированием потока, иначе в AAC)"""
+        try:
+            result = None
+            # Сначала пробуем без перекодирования, затем — с перекодированием в AAC
+            for copy in (True, False):
+                cmd = [
+                    (self.ffmpeg_path or 'ffmpeg'), '-y', '-i', video_path,
+                    '-vn', *self.audio_codec_args(copy),
+                    audio_path
+                ]
+
+                result = run_tool(cmd, 'extract_audio', self.job_metrics,
+                                  capture_output=True, text=True, encoding='utf-8', errors='ignore')
+                if result.returncode == 0:
+                    return True
+            self.log_message(f"❌ Ошибка ffmpeg: {result.stderr}")
+            return False
+
+        except FileNotFoundError:
+            self.log_message("❌ FFmpeg не найден. Установите FFmpeg для извлечения аудио")
+            return False
+        except Exception as e:
+            self.log_message(f"❌ Ошибка извлечения аудио: {e}")
+            return False
+
+    def merge_video_audio(self, video_path, audio_path, output_path):
+        """Объединить видео и аудио (аудио копируется, если уже AAC)"""
+        try:
+            can_copy = self.can_copy_audio(audio_path)
+            # Кодек не определён — пробуем копирование, при ошибке перекодируем
+            attempts = [True, False] if can_copy is None else [can_copy]
+            result = None
+            for copy in attempts:
+                cmd = [
+                    (self.ffmpeg_path or 'ffmpeg'), '-y', '-i', video_path, '-i', audio_path,
+                    '-map', '0:v:0', '-map', '1:a:0',
+                    '-c:v', 'copy', *self.audio_codec_args(copy), '-shortest',
+                    output_path
+                ]
+
+                result = run_tool(cmd, 'merge', self.job_metrics,
+                                  capture_output=True, text=True, encoding='utf-8', errors='ignore')
+                if result.returncode == 0:
+                    self.log_message("Аудио: " + ("копирование потока" if copy else "перекодирование в AAC"))
+                    return True
+            self.log_message(f"❌ Ошибка объединения: {result.stderr}")
+            return False
+
+        except FileNotFoundError:
+            self.log_message("❌ FFmpeg не найден. Установите FFmpeg для объединения")
+            return False
+        except Exception as e:
+            self.log_message(f"❌ Ошибка объединения: {e}")
+            return False
+
+    def select_pipe_audio_format(self):
+        """Лучший аудиоформат, который можно передать в ffmpeg по HTTP (предпочитая m4a)"""
+        candidates = []
+        for f in (self.video_info or {}).get('formats', []):
+            if (f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')
+                    and f.get('protocol') in ('http', 'https') and f.get('url')):
+                candidates.append(f)
+        if not candidates:
+            return None
+        candidates.sort(key=lambda f: (f.get('ext') == 'm4a', f.get('abr') or f.get('tbr') or 0), reverse=True)
+        return candidates[0]
+
+    def merge_with_piped_audio(self, video_path, audio_format, output_path, stream="Аудио"):
+        """Объединить видео с аудиопотоком, который передаётся в ffmpeg через stdin"""
+        copy = (audio_format.get('acodec') or '').startswith('mp4a')
+        cmd = [
+            (self.ffmpeg_path or 'ffmpeg'), '-y', '-i', video_path, '-i', 'pipe:0',
+            '-map', '0:v:0', '-map', '1:a:0',
+            '-c:v', 'copy', *self.audio_codec_args(copy), '-shortest',
+            output_path
+        ]
+        started = time.perf_counter()
+        try:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except Exception as e:
+            self.log_message(f"❌ Не удалось запустить ffmpeg: {e}")
+            return False
+
+        # stderr читаем в отдельном потоке, чтобы ffmpeg не заблокировался на выводе
+        stderr_chunks = []
+        stderr_thread = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+        stderr_thread.start()
+
+        try:
+            try:
+                self.stream_http_to(audio_format, proc.stdin, stream)
+                proc.stdin.close()
+            except OSError as e:
+                # С -shortest ffmpeg закрывает вход, как только видео кончилось, —
+                # итог решает код возврата. Прочие ошибки (сеть) идут дальше
+                if not (isinstance(e, BrokenPipeError) or e.errno in (errno.EPIPE, errno.EINVAL)):
+                    raise
+                try:
+                    proc.stdin.close()
+                except OSError:
+                    pass
+            returncode = proc.wait()
+        except Exception as e:
+            proc.kill()
+            proc.wait()
+            if not self.download_cancelled:
+                self.log_message(f"❌ Ошибка передачи аудио: {e}")
+            returncode = None
+        stderr_thread.join(timeout=5)
+        self.job_metrics.record_subprocess(tool_name(cmd[0]), 'merge_pipe', time.perf_counter() - started,
+                                           returncode == 0)
+
+        if returncode == 0:
+            # Код 0 ещё не значит, что файл цел: m4a без faststart из канала
+            # ffmpeg не разбирает и пишет файл без звука или почти пустой
+            problem = self.merged_output_problem(video_path, output_path)
+            if problem is None:
+                self.log_message("Аудио: " + ("копирование потока" if copy else "перекодирование в AAC"))
+                return True
+            self.log_message(f"❌ Объединённый файл непригоден: {problem}")
+        elif returncode is not None:
+            stderr = b''.join(stderr_chunks).decode('utf-8', errors='ignore')
+            self.log_message(f"❌ Ошибка объединения: {stderr[-2000:]}")
+        if os.path.exists(output_path):
+            try:
+                os.remove(output_path)
+            except Exception:
+                pass
+        return False
+
+    def merged_output_problem(self, video_path, output_path):
+        """Проверить итог объединения: причина, по которой он непригоден, или None"""
+        try:
+            size = os.path.getsize(output_path)
+            video_size = os.path.getsize(video_path)
+            probe = probe_media(output_path, self.ffprobe_path, self.ffmpeg_path, self.job_metrics)
+            source = probe_media(video_path, self.ffprobe_path, self.ffmpeg_path, self.job_metrics)
+        except Exception as e:
+            return f"файл не читается ({e})"
+        if probe is None:
+            return "не удалось определить потоки"
+        if first_stream(probe, 'video') is None:
+            return "нет видеопотока"
+        if first_stream(probe, 'audio') is None:
+            return "нет аудиопотока"
+        # Видео копируется как есть — итог не может быть заметно меньше исходного видео
+        if size < video_size * 0.9:
+            return f"размер {size} байт при видеопотоке {video_size} байт"
+        duration = probe.get('duration')
+        source_duration = (source or {}).get('duration')
+        if duration and source_duration and duration < source_duration * 0.9:
+            return f"длительность {duration:.1f} с вместо {source_duration:.1f} с"
+        return None
+
+    def stream_http_to(self, fmt, output, stream=None):
+        """Скачать формат по HTTP в поток output (частями, если этого требует сайт)"""
+        headers = dict(fmt.get('http_headers') or {})
+        chunk_size = (fmt.get('downloader_options') or {}).get('http_chunk_size')
+        total = fmt.get('filesize') or fmt.get('filesize_approx')
+        downloaded = 0
+        last_report = 0
+
+        with self.session.use() as ydl:
+            while True:
+                request_headers = dict(headers)
+                if chunk_size:
+                    request_headers['Range'] = f"bytes={downloaded}-{downloaded + chunk_size - 1}"
+                response = ydl.urlopen(yt_dlp.networking.Request(fmt['url'], headers=request_headers))
+                # 200 вместо 206 — сервер отдаёт файл целиком
+                whole_file = not chunk_size or response.status != 206
+                received = 0
+                while True:
+                    data = response.read(64 * 1024)
+                    if not data:
+                        break
+                    output.write(data)
+                    received += len(data)
+                    downloaded += len(data)
+                    self.count_transfer(len(data), stream)
+                    if downloaded - last_report >= 1024 * 1024:
+                        last_report = downloaded
+                        self.progress_hook({'status': 'downloading', 'downloaded_bytes': downloaded,
+                                            'total_bytes': total}, stream)
+                response.close()
+                if whole_file or received < chunk_size or (total and downloaded >= total):
+                    break
+        self.progress_hook({'status': 'finished', 'downloaded_bytes': downloaded, 'total_bytes': total}, stream)
+        return downloaded
+
+    def plan_finalize(self, probe):
+        """Для каждого потока решить: копировать как есть или перекодировать"""
+        video = first_stream(probe, 'video')
+        audio = first_stream(probe, 'audio')
+        video_ok = video is None or (
+            video.get('codec_name') in self.COMPAT_VIDEO_CODECS
+            and (video.get('pix_fmt') is None or video.get('pix_fmt') in self.COMPAT_PIX_FMTS)
+        )
+        audio_ok = audio is None or audio.get('codec_name') in self.COMPAT_AUDIO_CODECS
+        return {
+            'video': 'copy' if video_ok else 'transcode',
+            'audio': 'copy' if audio_ok else 'transcode',
+        }
+
+    def estimate_transcode_seconds(self, probe, plan):
+        """Примерное время перекодирования потоков, которые решено копировать (0 — неизвестно)"""
+        duration = (probe or {}).get('duration') or 0
+        seconds = 0.0
+        if plan['video'] == 'copy':
+            video = first_stream(probe, 'video')
+            if video:
+                speed = self.TRANSCODE_SPEED['libx264' if self.h264_encoder() == 'libx264' else 'hardware']
+                pixels = (video.get('width') or 1920) * (video.get('height') or 1080)
+                seconds += duration / speed * pixels / (1920 * 1080)
+        if plan['audio'] == 'copy' and first_stream(probe, 'audio'):
+            seconds += duration / self.TRANSCODE_SPEED['audio']
+        return seconds
+
+    def finalize_output(self, path):
+        """Финализировать итоговый файл; временные потоки уже удалены, журнал больше не нужен.
+
+        Если финализация не удалась, файл остаётся в виде до неё,
+        а DownloadFailed уходит вызывающему: задание завершается с ошибкой.
+        """
+        try:
+            self.finalize_for_compatibility(path)
+        finally:
+            self.journal.remove()
+
+    def finalize_for_compatibility(self, path):
+        """Привести файл к профилю H.264 (yuv420p) + AAC, перекодируя только несовместимые потоки.
+
+        False — ffmpeg нет и файл оставлен как есть; при ошибке ffmpeg
+        файл тоже остаётся прежним, а выбрасывается DownloadFailed.
+        """
+        if not self.has_ffmpeg():
+            return False
+        started = time.time()
+        probe = probe_media(path, self.ffprobe_path, self.ffmpeg_path, self.job_metrics)
+        if probe is None:
+            self.log_message("⚠️ Не удалось определить кодеки, выполняется полное перекодирование")
+            plan = {'video': 'transcode', 'audio': 'transcode'}
+        else:
+            plan = self.plan_finalize(probe)
+
+        saved = self.estimate_transcode_seconds(probe, plan)
+        saved_text = f", сэкономлено ≈ {saved:.0f} с перекодирования" if saved >= 1 else ""
+        if plan['video'] == 'copy' and plan['audio'] == 'copy':
+            self.log_message(f"✅ Финализация: потоки уже H.264/AAC — перекодирование не требуется{saved_text}")
+            return True
+
+        video_args = ['-c:v', 'copy']
+        if plan['video'] == 'transcode':
+            video_args = ['-c:v', self.h264_encoder(), '-pix_fmt', 'yuv420p']
+            if video_args[1] == 'libx264':
+                video_args += ['-profile:v', 'high', '-preset', 'veryfast', '-crf', '20']
+            else:
+                video_args += ['-b:v', '8M']
+        audio_args = ['-c:a', 'copy']
+        if plan['audio'] == 'transcode':
+            audio_args = ['-c:a', 'aac', '-b:a', '192k']
+
+        tmp_compat = path + '.tmp.mp4'
+        cmd = [(self.ffmpeg_path or 'ffmpeg'), '-y', '-i', path, *video_args, *audio_args, '-movflags', '+faststart', tmp_compat]
+        try:
+            run_tool(cmd, 'finalize', self.job_metrics, check=True,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            os.replace(tmp_compat, path)
+            self.count_written(self.metrics_stage(), path)
+        except Exception as e:
+            if os.path.exists(tmp_compat):
+                try:
+                    os.remove(tmp_compat)
+                except Exception:
+                    pass
+            # Итоговый файл не передаём как временный: его нельзя предлагать удалить
+            raise DownloadFailed(f"Не удалось привести видео к H.264/AAC ({e}). "
+                                 f"Файл без финализации сохранён: {path}")
+
+        names = {'copy': 'копирование', 'transcode': 'перекодирование'}
+        self.log_message(f"Финализация: видео — {names[plan['video']]}, аудио — {names[plan['audio']]} "
+                         f"({time.time() - started:.1f} с{saved_text})")
+        return True
+
+    def tool_info(self):
+        """Пути и возможности ffmpeg/ffprobe (поиск — один раз за запуск)"""
+        if self.tools is None:
+            self.tools = discover_tools(self.ffmpeg_path, self.ffprobe_path)
+            self.ffmpeg_path = self.ffmpeg_path or self.tools.get('ffmpeg')
+            self.ffprobe_path = self.ffprobe_path or self.tools.get('ffprobe')
+        return self.tools
+
+    def has_encoder(self, name):
+        """Есть ли у ffmpeg кодировщик (если список неизвестен — считаем, что есть)"""
+        encoders = self.tool_info().get('encoders')
+        return not encoders or name in encoders
+
+    def h264_encoder(self):
+        """Доступный кодировщик H.264"""
+        for name in ('libx264', 'h264_mf', 'h264_videotoolbox', 'libopenh264'):
+            if self.has_encoder(name):
+                return name
+        return 'libx264'
+
+    def has_audio_track(self, video_path):
+        """Проверить, есть ли аудио в видео файле.
+
+        MP4 и WebM/Matroska разбираются по заголовку без запуска программ,
+        остальные контейнеры — через ffprobe / ffmpeg -i.
+        """
+        try:
+            probe = probe_container(video_path)
+            if probe is None:
+                self.tool_info()
+                if not (self.ffprobe_path or self.ffmpeg_path):
+                    return False
+                probe = probe_media(video_path, self.ffprobe_path, self.ffmpeg_path, self.job_metrics)
+            return first_stream(probe, 'audio') is not None
+        except Exception:
+            pass
+        return False
+
+    def has_ffmpeg(self):
+        """Проверить наличие ffmpeg в системе (по результату однократного поиска)"""
+        try:
+            return bool(self.tool_info().get('ffmpeg'))
+        except Exception:
+            return False
+
+    def is_progressive_format(self, format_id):
+        """Проверить, содержит ли формат и видео, и аудио"""
+        if not self.video_info:
+            return False
+        for f in self.video_info.get('formats', []):
+            if f.get('format_id') == format_id:
+                return f.get('vcodec') != 'none' and f.get('acodec') != 'none'
+        return False
+
+    def is_video_only_format(self, format_id):
+        """Проверить, что формат точно без звука (по данным extract_info)"""
+        if not self.video_info:
+            return False
+        for f in self.video_info.get('formats', []):
+            if f.get('format_id') == format_id:
+                return f.get('vcodec') != 'none' and f.get('acodec') == 'none'
+        return False
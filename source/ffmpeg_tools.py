@@ -0,0 +1,162 @@
+"""
+Поиск ffmpeg/ffprobe и их возможностей.
+
+Поиск (PATH, каталог WinGet) и опрос возможностей (версия, кодировщики,
+мультиплексоры) выполняются один раз за запуск и сохраняются в файл.
+При следующем запуске запись берётся из файла, если у найденных программ
+не изменились размер и mtime и не изменилась переменная PATH, — без
+запуска процессов и обхода каталогов.
+"""
+
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import threading
+from pathlib import Path
+
+from stage_metrics import run_tool
+
+# Строки вида " V....D libx264   libx264 H.264 / AVC ..." и "  E mp4   MP4 (MPEG-4 Part 14)"
+ENCODER_RE = re.compile(r'^\s*[VAS][A-Z.]{5}\s+(\S+)', re.MULTILINE)
+MUXER_RE = re.compile(r'^\s*D?E\s+(\S+)', re.MULTILINE)
+
+_lock = threading.Lock()
+_discovered = {}
+
+
+def default_cache_path():
+    """Файл с результатами поиска по умолчанию"""
+    return str(Path.home() / ".youtube_downloader" / "tools.json")
+
+
+def _file_stamp(path):
+    """Размер и mtime файла — признак того, что программа не менялась"""
+    try:
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime]
+    except OSError:
+        return None
+
+
+def _path_env_hash():
+    return hashlib.md5((os.environ.get('PATH') or '').encode('utf-8')).hexdigest()
+
+
+def _find_winget():
+    """ffmpeg/ffprobe из пакета WinGet Gyan.FFmpeg"""
+    base = os.path.join(os.getenv('LOCALAPPDATA') or '', 'Microsoft', 'WinGet', 'Packages')
+    try:
+        for name in os.listdir(base):
+            if not name.lower().startswith('gyan.ffmpeg'):
+                continue
+            package_dir = os.path.join(base, name)
+            for build in os.listdir(package_dir):
+                bin_dir = os.path.join(package_dir, build, 'bin')
+                ffmpeg = os.path.join(bin_dir, 'ffmpeg.exe')
+                if os.path.exists(ffmpeg):
+                    ffprobe = os.path.join(bin_dir, 'ffprobe.exe')
+                    return ffmpeg, (ffprobe if os.path.exists(ffprobe) else None)
+    except OSError:
+        pass
+    return None, None
+
+
+def _run(cmd):
+    try:
+        result = run_tool(cmd, 'capabilities', capture_output=True, text=True, encoding='utf-8', errors='ignore')
+    except (OSError, ValueError):
+        return ''
+    return result.stdout or ''
+
+
+def probe_capabilities(ffmpeg_path):
+    """Версия, кодировщики и мультиплексоры ffmpeg"""
+    version_line = _run([ffmpeg_path, '-hide_banner', '-version']).split('\n', 1)[0]
+    match = re.search(r'ffmpeg version (\S+)', version_line)
+    # В заголовках списков тоже есть строки вида " V..... = Video" — их отбрасываем
+    encoders = set(ENCODER_RE.findall(_run([ffmpeg_path, '-hide_banner', '-encoders']))) - {'='}
+    muxers = set(MUXER_RE.findall(_run([ffmpeg_path, '-hide_banner', '-muxers']))) - {'='}
+    return {
+        'version': match.group(1) if match else None,
+        'encoders': sorted(encoders),
+        'muxers': sorted(muxers),
+    }
+
+
+def _load(cache_path):
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save(cache_path, data):
+    try:
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+
+
+def _valid(entry):
+    """Сохранённая запись ещё соответствует системе"""
+    if not entry or entry.get('path_env') != _path_env_hash():
+        return False
+    # «Не найден» не запоминаем: ffmpeg могли установить в папку, уже указанную в PATH
+    if not entry.get('ffmpeg'):
+        return False
+    for tool in ('ffmpeg', 'ffprobe'):
+        path = entry.get(tool)
+        if path and _file_stamp(path) != entry.get(tool + '_stamp'):
+            return False
+    return True
+
+
+def discover_tools(ffmpeg_path=None, ffprobe_path=None, cache_path=None, refresh=False):
+    """Найти ffmpeg/ffprobe и их возможности (один раз за запуск, с кэшем на диске).
+
+    Возвращает словарь: ffmpeg, ffprobe, version, encoders, muxers
+    (пути — None, если программа не найдена).
+    """
+    cache_path = cache_path or default_cache_path()
+    key = f"{ffmpeg_path or ''}|{ffprobe_path or ''}"
+    with _lock:
+        if not refresh and key in _discovered:
+            return _discovered[key]
+
+        stored = _load(cache_path)
+        entry = stored.get(key)
+        if refresh or not _valid(entry):
+            ffmpeg = ffmpeg_path or shutil.which('ffmpeg')
+            ffprobe = ffprobe_path or shutil.which('ffprobe')
+            if platform.system() == 'Windows' and not (ffmpeg and ffprobe):
+                winget_ffmpeg, winget_ffprobe = _find_winget()
+                ffmpeg = ffmpeg or winget_ffmpeg
+                ffprobe = ffprobe or winget_ffprobe
+            entry = {
+                'ffmpeg': ffmpeg,
+                'ffprobe': ffprobe,
+                'ffmpeg_stamp': _file_stamp(ffmpeg) if ffmpeg else None,
+                'ffprobe_stamp': _file_stamp(ffprobe) if ffprobe else None,
+                'path_env': _path_env_hash(),
+                'version': None,
+                'encoders': [],
+                'muxers': [],
+            }
+            if ffmpeg:
+                entry.update(probe_capabilities(ffmpeg))
+            stored[key] = entry
+            # Движки, которым передали уже найденные пути, получат ту же запись
+            stored[f"{entry['ffmpeg'] or ''}|{entry['ffprobe'] or ''}"] = entry
+            _save(cache_path, stored)
+
+        _discovered[key] = entry
+        _discovered[f"{entry['ffmpeg'] or ''}|{entry['ffprobe'] or ''}"] = entry
+        return entry
@@ -0,0 +1,112 @@
+"""
+Индекс имён файлов в папках загрузки.
+
+Папка читается один раз (os.scandir), дальше проверка имени — поиск в
+множестве, без обращений к диску. Имена, которые выдаёт движок, сразу
+заносятся в индекс, поэтому параллельные задания не получат одно и то же
+имя. Изменения папки извне подхватываются повторным чтением, если с
+прошлого чтения прошло refresh_interval секунд и изменилось mtime папки.
+"""
+
+import os
+import threading
+import time
+
+
+class FilenameIndex:
+    """Множество имён файлов по папкам с резервированием уникальных имён"""
+
+    def __init__(self, refresh_interval=60.0):
+        self.refresh_interval = refresh_interval
+        self._dirs = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _norm(name):
+        # На Windows имена файлов не различают регистр
+        return os.path.normcase(name)
+
+    def _scan(self, directory, reserved=None):
+        """Прочитать содержимое папки, сохранив ещё не записанные резервы (под блокировкой)"""
+        reserved = set(reserved or ())
+        names = set(reserved)
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    names.add(self._norm(entry.name))
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            mtime = None
+        state = {'names': names, 'reserved': reserved, 'mtime': mtime,
+                 'checked_at': time.monotonic()}
+        self._dirs[directory] = state
+        return state
+
+    def _state(self, directory):
+        """Индекс папки, при необходимости перечитанный (под блокировкой)"""
+        state = self._dirs.get(directory)
+        if state is None:
+            return self._scan(directory)
+        if time.monotonic() - state['checked_at'] >= self.refresh_interval:
+            state['checked_at'] = time.monotonic()
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                mtime = None
+            if mtime != state['mtime']:
+                # Папку меняли извне (или мы сами) — перечитываем
+                state = self._scan(directory, state['reserved'])
+        return state
+
+    def refresh(self, directory):
+        """Принудительно перечитать папку"""
+        directory = os.path.abspath(directory)
+        with self._lock:
+            self._scan(directory, self._dirs.get(directory, {}).get('reserved'))
+
+    def exists(self, directory, name):
+        """Есть ли в папке файл с таким именем (по индексу)"""
+        directory = os.path.abspath(directory)
+        with self._lock:
+            return self._norm(name) in self._state(directory)['names']
+
+    def find(self, directory, predicate):
+        """Первое имя записанного файла в папке, для которого predicate(имя) истинно"""
+        directory = os.path.abspath(directory)
+        with self._lock:
+            state = self._state(directory)
+            for name in state['names']:
+                if name not in state['reserved'] and predicate(name):
+                    return name
+        return None
+
+    def reserve(self, directory, candidates):
+        """Занять первое свободное имя из последовательности candidates и вернуть путь"""
+        directory = os.path.abspath(directory)
+        with self._lock:
+            state = self._state(directory)
+            for name in candidates:
+                key = self._norm(name)
+                if key not in state['names']:
+                    state['names'].add(key)
+                    state['reserved'].add(key)
+                    return os.path.join(directory, name)
+        return None
+
+    def add(self, path):
+        """Отметить, что файл записан"""
+        directory, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            state = self._dirs.get(directory)
+            if state is not None:
+                state['names'].add(self._norm(name))
+                state['reserved'].discard(self._norm(name))
+
+    def discard(self, path):
+        """Освободить имя (файл не был записан или удалён)"""
+        directory, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            state = self._dirs.get(directory)
+            if state is not None:
+                state['names'].discard(self._norm(name))
+                state['reserved'].discard(self._norm(name))
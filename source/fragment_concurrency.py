@@ -0,0 +1,128 @@
+"""
+Адаптивное число параллельных фрагментов для DASH/HLS загрузок.
+
+yt-dlp задаёт concurrent_fragment_downloads на весь вызов download, поэтому
+уровень подбирается между загрузками: для каждого хоста начинаем с малого,
+увеличиваем, пока растёт измеренная скорость, и уменьшаем при ошибках и
+ограничениях со стороны сервера (429). Потолок, сниженный после 429,
+поднимается обратно после серии загрузок без ошибок. Общее число соединений
+всех заданий строго ограничено global_limit: загрузка получает не больше
+свободных соединений, а если свободных нет — ждёт, пока их вернут.
+"""
+
+import threading
+
+
+class FragmentConcurrency:
+    """Подбор concurrent_fragment_downloads по хостам с общим лимитом соединений"""
+
+    def __init__(self, initial=2, min_level=1, max_level=16, global_limit=32,
+                 improvement=1.1, reprobe_every=10, cap_recovery=5):
+        self.initial = initial
+        self.min_level = min_level
+        self.max_level = max_level
+        self.global_limit = global_limit
+        # Во сколько раз должна вырасти скорость, чтобы считать повышение уровня выгодным
+        self.improvement = improvement
+        # Через сколько успешных загрузок на «плато» снова пробовать повысить уровень
+        self.reprobe_every = reprobe_every
+        # Через сколько загрузок подряд без ошибок удваивать потолок, сниженный после 429
+        self.cap_recovery = cap_recovery
+
+        self._hosts = {}
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+    def _state(self, host):
+        """Состояние хоста (вызывается под блокировкой)"""
+        if host not in self._hosts:
+            self._hosts[host] = {
+                'level': self.initial,
+                'best_level': self.initial,
+                'best_throughput': None,
+                'cap': self.max_level,
+                'plateau': False,
+                'plateau_runs': 0,
+                'clean_runs': 0,
+            }
+        return self._hosts[host]
+
+    def acquire(self, host, cancelled=None):
+        """Выдать уровень параллельности для новой загрузки с хоста.
+
+        Уровень не больше свободных соединений (global_limit - выданные);
+        если свободных нет, вызов ждёт release. cancelled — функция,
+        по которой ожидание прерывается: тогда возвращается 0.
+        """
+        with self._released:
+            while self.global_limit - self._in_use <= 0:
+                if cancelled and cancelled():
+                    return 0
+                self._released.wait(0.5)
+            state = self._state(host)
+            level = max(self.min_level, state['level'])
+            level = min(level, self.global_limit - self._in_use)
+            self._in_use += level
+            return level
+
+    def release(self, host, level, nbytes=0, seconds=0.0, error=False, throttled=False):
+        """Вернуть соединения и учесть результат загрузки"""
+        with self._released:
+            self._in_use = max(0, self._in_use - level)
+            self._released.notify_all()
+            state = self._state(host)
+
+            if error or throttled:
+                # Откат: уменьшаем уровень вдвое, при 429 ещё и ограничиваем потолок хоста
+                state['level'] = max(self.min_level, level // 2)
+                if throttled:
+                    state['cap'] = max(self.min_level, state['level'])
+                state['best_throughput'] = None
+                state['plateau'] = False
+                state['clean_runs'] = 0
+                return
+
+            if not nbytes or seconds <= 0:
+                return
+            if state['cap'] < self.max_level:
+                state['clean_runs'] += 1
+                if state['clean_runs'] >= self.cap_recovery:
+                    # Сервер давно не ограничивал — пробуем больше соединений
+                    state['cap'] = min(self.max_level, state['cap'] * 2)
+                    state['clean_runs'] = 0
+                    state['plateau'] = False
+                    state['best_throughput'] = None
+            throughput = nbytes / seconds
+            best = state['best_throughput']
+
+            if best is None or throughput > best * self.improvement:
+                # Стало лучше — запоминаем и пробуем больше
+                state['best_throughput'] = throughput
+                state['best_level'] = level
+                if not state['plateau'] and level >= state['level']:
+                    state['level'] = min(state['cap'], max(level + 1, level * 2))
+            elif level > state['best_level']:
+                # Прироста нет — возвращаемся к лучшему уровню и останавливаемся
+                state['level'] = state['best_level']
+                state['plateau'] = True
+                state['plateau_runs'] = 0
+            else:
+                state['best_throughput'] = max(best, throughput) if best else throughput
+
+            if state['plateau']:
+                state['plateau_runs'] += 1
+                if state['plateau_runs'] >= self.reprobe_every:
+                    # Условия сети могли измениться — снова пробуем повысить
+                    state['plateau'] = False
+                    state['best_throughput'] = None
+
+    def in_use(self):
+        """Сколько соединений сейчас выдано"""
+        with self._lock:
+            return self._in_use
+
+    def levels(self):
+        """Текущие уровни по хостам"""
+        with self._lock:
+            return {host: state['level'] for host, state in self._hosts.items()}
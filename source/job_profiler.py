@@ -0,0 +1,250 @@
+"""
+Профилирование заданий.
+
+JobProfiler раз в несколько миллисекунд снимает стеки потоков задания
+(поток очереди и вспомогательные потоки движка, например параллельное
+скачивание аудио) и копит время по стекам. Каждый стек относится к этапу
+по ближайшему методу конвейера в нём: получение информации, видео, аудио,
+объединение, финализация; остальное — «other». Учитывается и время
+ожидания (сеть, ffmpeg, паузы перед повтором), поэтому видно, куда уходит
+время задания, а не только процессор.
+
+Профили не засоряют папку загрузки: они сохраняются в отдельной папке
+(по умолчанию ~/.youtube_downloader/profiles) под хешем временных файлов
+задания (<хеш>.profile.txt) в формате «свёрнутых стеков»
+(этап;функция;...;функция миллисекунды). Их открывают flamegraph.pl и
+speedscope, а сводку горячих мест по этапам выводит сам модуль:
+
+    python job_profiler.py ~/.youtube_downloader/profiles/*.profile.txt --top 10
+
+Профилировщик создаётся только для заданий с включённым профилированием;
+без него никаких обработчиков и потоков не добавляется.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+PROFILE_SUFFIX = '.profile.txt'
+# Интервал снятия стеков (сек)
+SAMPLE_INTERVAL = 0.005
+
+# Метод движка → этап; этап стека — по ближайшему к вершине методу из списка
+STAGE_METHODS = {
+    'get_video_info': 'info',
+    'download_with_retry': 'video',
+    'acquire_audio': 'audio',
+    'merge_video_audio': 'merge',
+    'merge_with_piped_audio': 'merge',
+    'finalize_for_compatibility': 'finalize',
+}
+OTHER_STAGE = 'other'
+STAGE_ORDER = ('info', 'video', 'audio', 'merge', 'finalize', OTHER_STAGE)
+
+
+def frame_label(code):
+    """Имя функции с файлом и строкой — без «;», которые разделяют кадры"""
+    name = getattr(code, 'co_qualname', code.co_name)
+    label = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label.replace(';', ':')
+
+
+def default_profile_dir():
+    """Папка профилей по умолчанию"""
+    return str(Path.home() / ".youtube_downloader" / "profiles")
+
+
+def profile_path(engine, url, profile_dir=None):
+    """Путь профиля задания: имя — хеш временных файлов задания (как у журнала)"""
+    if engine.journal:
+        name = os.path.splitext(os.path.basename(engine.journal.path))[0]
+        name = name[len('temp_'):] if name.startswith('temp_') else name
+    else:
+        # Задание не дошло до скачивания (ошибка или пропуск на этапе информации)
+        name = engine.generate_file_hash(url, 'info', '')
+    return os.path.join(profile_dir or default_profile_dir(), name + PROFILE_SUFFIX)
+
+
+class JobProfiler:
+    """Сэмплирующий профилировщик одного задания (запускается в потоке задания)"""
+
+    def __init__(self, engine, interval=SAMPLE_INTERVAL):
+        self.engine = engine
+        self.interval = interval
+        # (этап, кадры от корня к вершине) → секунды
+        self.stacks = {}
+        self.samples = 0
+        self.stage_codes = self._stage_codes(type(engine))
+        self._labels = {}
+        self._thread_id = None
+        self._sampler = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _stage_codes(engine_class):
+        """Объекты кода методов конвейера, включая переопределённые в подклассах"""
+        codes = {}
+        for cls in engine_class.__mro__:
+            for name, stage in STAGE_METHODS.items():
+                method = cls.__dict__.get(name)
+                if hasattr(method, '__code__'):
+                    codes[method.__code__] = stage
+        return codes
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._sampler = threading.Thread(target=self._run, daemon=True)
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._sampler:
+            self._sampler.join()
+
+    def _job_threads(self):
+        prefix = self.engine.thread_prefix
+        idents = [self._thread_id]
+        idents.extend(t.ident for t in threading.enumerate() if t.name.startswith(prefix))
+        return idents
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            frames = sys._current_frames()
+            for ident in self._job_threads():
+                frame = frames.get(ident)
+                if frame is not None:
+                    self._record(frame, elapsed)
+            del frames
+            self.samples += 1
+
+    def _record(self, frame, elapsed):
+        stack = []
+        stage = None
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = frame_label(code)
+            stack.append(label)
+            if stage is None:
+                stage = self.stage_codes.get(code)
+            frame = frame.f_back
+        stack.reverse()
+        key = (stage or OTHER_STAGE, tuple(stack))
+        self.stacks[key] = self.stacks.get(key, 0.0) + elapsed
+
+    def collapsed_lines(self):
+        """Строки «этап;кадр;...;кадр миллисекунды»"""
+        lines = []
+        for (stage, stack), seconds in sorted(self.stacks.items()):
+            ms = round(seconds * 1000)
+            if ms:
+                lines.append(f"{';'.join((stage,) + stack)} {ms}")
+        return lines
+
+    def summary(self, top=10):
+        """Горячие места по этапам (см. summarize_profile)"""
+        return summarize_profile([((stage,) + stack, seconds * 1000)
+                                  for (stage, stack), seconds in self.stacks.items()], top)
+
+    def save(self, path):
+        """Записать профиль; True — успешно"""
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(self.collapsed_lines()) + '\n')
+            return True
+        except OSError:
+            return False
+
+
+def read_collapsed(path):
+    """Стеки из файла профиля: список (кадры, миллисекунды)"""
+    stacks = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            frames, _, value = line.rstrip('\n').rpartition(' ')
+            try:
+                stacks.append((frames.split(';'), float(value)))
+            except ValueError:
+                continue
+    return stacks
+
+
+def summarize_profile(stacks, top=10):
+    """Горячие места по этапам: {этап: {'total_ms', 'functions': [(кадр, своё, всего)]}}.
+
+    «Своё» — время, когда функция была на вершине стека; «всего» — вместе с
+    вызванными ею функциями. Функции упорядочены по своему времени.
+    """
+    stages = {}
+    for frames, ms in stacks:
+        if len(frames) < 2:
+            continue
+        stage = stages.setdefault(frames[0], {'total_ms': 0.0, 'self': {}, 'cumulative': {}})
+        stage['total_ms'] += ms
+        stage['self'][frames[-1]] = stage['self'].get(frames[-1], 0.0) + ms
+        for label in set(frames[1:]):
+            stage['cumulative'][label] = stage['cumulative'].get(label, 0.0) + ms
+
+    summary = {}
+    order = {name: i for i, name in enumerate(STAGE_ORDER)}
+    for name in sorted(stages, key=lambda s: (order.get(s, len(order)), s)):
+        stage = stages[name]
+        hot = sorted(stage['self'].items(), key=lambda item: item[1], reverse=True)[:top]
+        summary[name] = {
+            'total_ms': round(stage['total_ms']),
+            'functions': [(label, round(ms), round(stage['cumulative'][label])) for label, ms in hot],
+        }
+    return summary
+
+
+def format_profile_summary(summary):
+    """Сводка горячих мест для вывода: строки текста"""
+    lines = []
+    for stage, data in summary.items():
+        total = data['total_ms'] or 1
+        lines.append(f"{stage}: {data['total_ms'] / 1000:.2f} с")
+        for label, self_ms, cumulative_ms in data['functions']:
+            lines.append(f"  {self_ms / 1000:8.2f} с {self_ms * 100 / total:5.1f}%  "
+                         f"(всего {cumulative_ms / 1000:.2f} с)  {label}")
+    return lines
+
+
+def hottest(summary, count=3):
+    """Самые долгие функции всех этапов одной строкой (для лога задания)"""
+    functions = [(self_ms, stage, label.split(' (')[0])
+                 for stage, data in summary.items() for label, self_ms, _ in data['functions']]
+    functions.sort(reverse=True)
+    return ", ".join(f"{stage}/{name} {ms / 1000:.2f} с" for ms, stage, name in functions[:count])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сводка горячих мест по профилям заданий")
+    parser.add_argument('profiles', nargs='+', help="файлы профилей (*.profile.txt)")
+    parser.add_argument('--top', type=int, default=10, help="сколько функций показывать на этап")
+    args = parser.parse_args(argv)
+
+    stacks = []
+    for path in args.profiles:
+        try:
+            stacks.extend(read_collapsed(path))
+        except OSError as e:
+            print(f"⚠️ Не удалось прочитать {path}: {e}", file=sys.stderr)
+    if not stacks:
+        print("❌ Нет данных профиля", file=sys.stderr)
+        return 1
+    for line in format_profile_summary(summarize_profile(stacks, args.top)):
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
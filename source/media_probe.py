@@ -0,0 +1,584 @@
+"""
+Определение потоков и кодеков медиафайла.
+
+Сначала заголовок MP4 (moov/trak) или Matroska/WebM (Info/Tracks) разбирается
+прямо в процессе: читаются только служебные блоки, без запуска программ.
+Если контейнер не распознан — ffprobe (JSON), при его отсутствии — разбор
+вывода `ffmpeg -i`.
+"""
+
+import json
+import os
+import re
+import struct
+from array import array
+
+from stage_metrics import run_tool
+
+# Разбор строк вида "Stream #0:0(und): Video: h264 (High) (avc1 / 0x31637661), yuv420p(tv, ...), ..."
+FFMPEG_STREAM_RE = re.compile(r'Stream #\d+:\d+.*?: (Video|Audio|Subtitle|Data): ([^\s,]+)([^\n]*)')
+FFMPEG_DURATION_RE = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+PIX_FMT_RE = re.compile(r',\s*(yuv\w+|rgb\w+|gray\w*|nv\d+)')
+
+# Заголовок (moov, Info/Tracks) больше этого размера не читаем — пусть разбирает ffprobe
+MAX_HEADER_BYTES = 32 * 1024 * 1024
+
+MP4_FORMAT_NAME = 'mov,mp4,m4a,3gp,3g2,mj2'
+MATROSKA_FORMAT_NAME = 'matroska,webm'
+# Типы первого бокса, по которым файл опознаётся как MP4/MOV
+MP4_FIRST_BOXES = (b'ftyp', b'styp', b'moov', b'mdat', b'free', b'skip', b'wide')
+MATROSKA_MAGIC = b'\x1a\x45\xdf\xa3'
+
+# Названия кодеков — как у ffprobe, чтобы результаты были взаимозаменяемы
+MP4_CODECS = {
+    b'avc1': 'h264', b'avc3': 'h264', b'hvc1': 'hevc', b'hev1': 'hevc',
+    b'av01': 'av1', b'vp09': 'vp9', b'vp08': 'vp8', b'mp4v': 'mpeg4',
+    b'mp4a': 'aac', b'Opus': 'opus', b'fLaC': 'flac', b'ac-3': 'ac3',
+    b'ec-3': 'eac3', b'.mp3': 'mp3',
+}
+# objectTypeIndication из esds для дорожек mp4a
+MP4A_OBJECT_TYPES = {0x40: 'aac', 0x66: 'aac', 0x67: 'aac', 0x68: 'aac', 0x69: 'mp3', 0x6b: 'mp3'}
+MP4_HANDLERS = {b'vide': 'video', b'soun': 'audio', b'subt': 'subtitle', b'text': 'subtitle', b'sbtl': 'subtitle'}
+
+MATROSKA_CODECS = {
+    'V_MPEG4/ISO/AVC': 'h264', 'V_MPEGH/ISO/HEVC': 'hevc', 'V_AV1': 'av1',
+    'V_VP9': 'vp9', 'V_VP8': 'vp8', 'A_OPUS': 'opus', 'A_VORBIS': 'vorbis',
+    'A_AAC': 'aac', 'A_MPEG/L3': 'mp3', 'A_AC3': 'ac3', 'A_EAC3': 'eac3',
+    'A_FLAC': 'flac',
+}
+MATROSKA_TRACK_TYPES = {1: 'video', 2: 'audio', 17: 'subtitle'}
+
+# Профили H.264 (AVCProfileIndication) и формат пикселей по умолчанию для них
+H264_PROFILES = {
+    66: ('Baseline', 'yuv420p'), 77: ('Main', 'yuv420p'), 88: ('Extended', 'yuv420p'),
+    100: ('High', 'yuv420p'), 110: ('High 10', 'yuv420p10le'),
+    122: ('High 4:2:2', 'yuv422p'), 244: ('High 4:4:4 Predictive', 'yuv444p'),
+}
+CHROMA_FORMATS = {0: 'gray', 1: 'yuv420p', 2: 'yuv422p', 3: 'yuv444p'}
+
+# Идентификаторы элементов EBML
+EBML_SEGMENT = 0x18538067
+EBML_INFO = 0x1549A966
+EBML_TRACKS = 0x1654AE6B
+EBML_CLUSTER = 0x1F43B675
+EBML_TIMECODE_SCALE = 0x2AD7B1
+EBML_DURATION = 0x4489
+EBML_TRACK_ENTRY = 0xAE
+EBML_TRACK_TYPE = 0x83
+EBML_CODEC_ID = 0x86
+EBML_CODEC_PRIVATE = 0x63A2
+EBML_VIDEO = 0xE0
+EBML_AUDIO = 0xE1
+EBML_PIXEL_WIDTH = 0xB0
+EBML_PIXEL_HEIGHT = 0xBA
+EBML_SAMPLING_FREQUENCY = 0xB5
+EBML_CHANNELS = 0x9F
+
+
+# ----------------------------------------------------------------------
+# Общее
+# ----------------------------------------------------------------------
+
+def _stream(codec_type, codec_name, pix_fmt=None, profile=None, duration=None, bit_rate=None, **extra):
+    stream = {
+        'codec_type': codec_type,
+        'codec_name': codec_name,
+        'pix_fmt': pix_fmt,
+        'profile': profile,
+        'duration': duration,
+        'bit_rate': bit_rate,
+    }
+    stream.update(extra)
+    return stream
+
+
+def _avc_details(avcc):
+    """Профиль и формат пикселей H.264 из AVCDecoderConfigurationRecord"""
+    if len(avcc) < 7:
+        return None, None
+    profile_idc = avcc[1]
+    profile, pix_fmt = H264_PROFILES.get(profile_idc, (None, 'yuv420p'))
+    if profile_idc in (100, 110, 122, 244):
+        # Для High-профилей после SPS/PPS может идти точное описание цветности и разрядности
+        try:
+            pos = 6
+            for _ in range(avcc[5] & 0x1F):
+                pos += 2 + struct.unpack_from('>H', avcc, pos)[0]
+            pps_count = avcc[pos]
+            pos += 1
+            for _ in range(pps_count):
+                pos += 2 + struct.unpack_from('>H', avcc, pos)[0]
+            if pos + 3 <= len(avcc):
+                depth = (avcc[pos + 1] & 0x07) + 8
+                pix_fmt = CHROMA_FORMATS[avcc[pos] & 0x03] + ('' if depth == 8 else f'{depth}le')
+        except (struct.error, IndexError):
+            pass
+    return profile, pix_fmt
+
+
+def _bit_rate(size, duration):
+    if size and duration:
+        return int(size * 8 / duration)
+    return None
+
+
+# ----------------------------------------------------------------------
+# MP4 / MOV
+# ----------------------------------------------------------------------
+
+def _boxes(data, start, end):
+    """Боксы (тип, начало содержимого, конец) в диапазоне data[start:end]"""
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+
+def _box(data, start, end, *path):
+    """Вложенный бокс по цепочке типов: (начало, конец) или None"""
+    for box_type in path:
+        for found_type, box_start, box_end in _boxes(data, start, end):
+            if found_type == box_type:
+                start, end = box_start, box_end
+                break
+        else:
+            return None
+    return start, end
+
+
+def _read_moov(f, file_size):
+    """Прочитать только бокс moov: остальные боксы верхнего уровня (mdat) пропускаются"""
+    pos = 0
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        header = f.read(16)
+        if len(header) < 8:
+            return None
+        size, box_type = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                return None
+            size = struct.unpack_from('>Q', header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header_size:
+            return None
+        if box_type == b'moov':
+            if size > MAX_HEADER_BYTES or pos + size > file_size:
+                return None
+            f.seek(pos + header_size)
+            return f.read(size - header_size)
+        pos += size
+    return None
+
+
+def _full_box_times(data, start):
+    """timescale и duration из mvhd/mdhd (версии 0 и 1)"""
+    if data[start] == 1:
+        return struct.unpack_from('>IQ', data, start + 20)
+    return struct.unpack_from('>II', data, start + 12)
+
+
+def _esds_info(data, start, end):
+    """objectTypeIndication и средний битрейт из esds"""
+    def descriptor(pos):
+        tag = data[pos]
+        pos += 1
+        size = 0
+        for _ in range(4):
+            byte = data[pos]
+            pos += 1
+            size = (size << 7) | (byte & 0x7F)
+            if not byte & 0x80:
+                break
+        return tag, pos, size
+
+    tag, pos, _ = descriptor(start + 4)
+    if tag != 0x03:
+        return None, None
+    flags = data[pos + 2]
+    pos += 3
+    if flags & 0x80:
+        pos += 2
+    if flags & 0x40:
+        pos += 1 + data[pos]
+    if flags & 0x20:
+        pos += 2
+    tag, pos, _ = descriptor(pos)
+    if tag != 0x04 or pos + 13 > end:
+        return None, None
+    object_type = data[pos]
+    avg_bitrate = struct.unpack_from('>I', data, pos + 9)[0]
+    return object_type, avg_bitrate or None
+
+
+def _stsz_total(data, start, end):
+    """Суммарный размер сэмплов дорожки из stsz"""
+    sample_size, count = struct.unpack_from('>II', data, start + 4)
+    if sample_size:
+        return sample_size * count
+    table_end = start + 12 + count * 4
+    if not count or table_end > end:
+        return None
+    sizes = array('I', data[start + 12:table_end])
+    if sizes.itemsize != 4:
+        return None
+    if struct.pack('=I', 1) != struct.pack('>I', 1):
+        sizes.byteswap()
+    return sum(sizes)
+
+
+def _mp4_track(data, start, end, movie_duration):
+    hdlr = _box(data, start, end, b'mdia', b'hdlr')
+    if hdlr is None:
+        return None
+    codec_type = MP4_HANDLERS.get(data[hdlr[0] + 8:hdlr[0] + 12], 'data')
+
+    duration = None
+    mdhd = _box(data, start, end, b'mdia', b'mdhd')
+    if mdhd is not None:
+        timescale, units = _full_box_times(data, mdhd[0])
+        if timescale and units and units != 0xFFFFFFFF:
+            duration = units / timescale
+    duration = duration or movie_duration
+
+    stbl = _box(data, start, end, b'mdia', b'minf', b'stbl')
+    stsd = _box(data, stbl[0], stbl[1], b'stsd') if stbl else None
+    if stsd is None:
+        return _stream(codec_type, None, duration=duration)
+    entries = list(_boxes(data, stsd[0] + 8, stsd[1]))
+    if not entries:
+        return _stream(codec_type, None, duration=duration)
+    fourcc, entry_start, entry_end = entries[0]
+    codec_name = MP4_CODECS.get(fourcc, fourcc.decode('latin-1').strip().lower())
+    pix_fmt = profile = bit_rate = None
+    extra = {}
+
+    if codec_type == 'video':
+        extra['width'], extra['height'] = struct.unpack_from('>HH', data, entry_start + 24)
+        children = entry_start + 78
+        avcc = _box(data, children, entry_end, b'avcC')
+        if avcc is not None:
+            profile, pix_fmt = _avc_details(data[avcc[0]:avcc[1]])
+    elif codec_type == 'audio':
+        # Версии 1 и 2 звуковой записи QuickTime длиннее на 16 и 36 байт
+        version = struct.unpack_from('>H', data, entry_start + 8)[0]
+        extra['channels'] = struct.unpack_from('>H', data, entry_start + 16)[0]
+        extra['sample_rate'] = struct.unpack_from('>I', data, entry_start + 24)[0] >> 16
+        children = entry_start + 28 + {1: 16, 2: 36}.get(version, 0)
+        esds = _box(data, children, entry_end, b'esds')
+        if esds is not None:
+            object_type, bit_rate = _esds_info(data, esds[0], esds[1])
+            if fourcc == b'mp4a':
+                codec_name = MP4A_OBJECT_TYPES.get(object_type, codec_name)
+    else:
+        children = entry_end
+
+    btrt = _box(data, children, entry_end, b'btrt')
+    if btrt is not None and not bit_rate:
+        bit_rate = struct.unpack_from('>I', data, btrt[0] + 8)[0] or None
+    if not bit_rate:
+        stsz = _box(data, stbl[0], stbl[1], b'stsz')
+        if stsz is not None:
+            bit_rate = _bit_rate(_stsz_total(data, stsz[0], stsz[1]), duration)
+    return _stream(codec_type, codec_name, pix_fmt, profile, duration, bit_rate, **extra)
+
+
+def probe_mp4(f, file_size):
+    """Потоки MP4/MOV по боксу moov; None — если moov не найден"""
+    moov = _read_moov(f, file_size)
+    if not moov:
+        return None
+    duration = None
+    mvhd = _box(moov, 0, len(moov), b'mvhd')
+    if mvhd is not None:
+        timescale, units = _full_box_times(moov, mvhd[0])
+        if not units:
+            # Фрагментированный MP4 (DASH): длительность в mvex/mehd
+            mehd = _box(moov, 0, len(moov), b'mvex', b'mehd')
+            if mehd is not None:
+                version = moov[mehd[0]]
+                units = struct.unpack_from('>Q' if version == 1 else '>I', moov, mehd[0] + 4)[0]
+        if timescale and units:
+            duration = units / timescale
+
+    streams = []
+    for box_type, start, end in _boxes(moov, 0, len(moov)):
+        if box_type == b'trak':
+            stream = _mp4_track(moov, start, end, duration)
+            if stream is not None:
+                streams.append(stream)
+    if not streams:
+        return None
+    if duration is None:
+        duration = max((s['duration'] or 0) for s in streams) or None
+    return {'streams': streams, 'duration': duration, 'format_name': MP4_FORMAT_NAME,
+            'bit_rate': _bit_rate(file_size, duration)}
+
+
+# ----------------------------------------------------------------------
+# Matroska / WebM
+# ----------------------------------------------------------------------
+
+def _vint(data, pos, keep_marker=False):
+    """Число переменной длины EBML: (значение, длина, «размер неизвестен»)"""
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while not first & mask:
+        mask >>= 1
+        length += 1
+        if length > 8:
+            raise ValueError("Некорректное число EBML")
+    if pos + length > len(data):
+        raise ValueError("Обрезанное число EBML")
+    value = first if keep_marker else first & (mask - 1)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, length, unknown
+
+
+def _elements(data, start, end):
+    """Элементы EBML (id, начало содержимого, конец) в диапазоне data[start:end]"""
+    pos = start
+    while pos < end:
+        element_id, id_length, _ = _vint(data, pos, keep_marker=True)
+        size, size_length, unknown = _vint(data, pos + id_length)
+        body = pos + id_length + size_length
+        body_end = end if unknown else min(body + size, end)
+        yield element_id, body, body_end
+        pos = body_end
+
+
+def _ebml_uint(data, start, end):
+    return int.from_bytes(data[start:end], 'big') if end > start else 0
+
+
+def _ebml_float(data, start, end):
+    if end - start == 4:
+        return struct.unpack_from('>f', data, start)[0]
+    if end - start == 8:
+        return struct.unpack_from('>d', data, start)[0]
+    return 0.0
+
+
+def _read_segment_header(f, file_size):
+    """Прочитать элементы Info и Tracks сегмента, пропуская остальное; до первого Cluster"""
+    header = f.read(64)
+    if not header.startswith(MATROSKA_MAGIC):
+        return None, None
+    # EBML-заголовок
+    _, id_length, _ = _vint(header, 0, keep_marker=True)
+    size, size_length, _ = _vint(header, id_length)
+    pos = id_length + size_length + size
+
+    f.seek(pos)
+    header = f.read(12)
+    element_id, id_length, _ = _vint(header, 0, keep_marker=True)
+    if element_id != EBML_SEGMENT:
+        return None, None
+    size, size_length, unknown = _vint(header, id_length)
+    pos += id_length + size_length
+    segment_end = file_size if unknown else min(pos + size, file_size)
+
+    info = tracks = None
+    while pos < segment_end and (info is None or tracks is None):
+        f.seek(pos)
+        header = f.read(12)
+        if len(header) < 2:
+            break
+        element_id, id_length, _ = _vint(header, 0, keep_marker=True)
+        size, size_length, unknown = _vint(header, id_length)
+        body = pos + id_length + size_length
+        if element_id == EBML_CLUSTER or unknown:
+            break
+        if element_id in (EBML_INFO, EBML_TRACKS):
+            if size > MAX_HEADER_BYTES:
+                break
+            f.seek(body)
+            data = f.read(size)
+            if element_id == EBML_INFO:
+                info = data
+            else:
+                tracks = data
+        pos = body + size
+    return info, tracks
+
+
+def _matroska_track(data, start, end, duration):
+    codec_type = codec_name = pix_fmt = profile = None
+    codec_id = ''
+    extra = {}
+    for element_id, body, body_end in _elements(data, start, end):
+        if element_id == EBML_TRACK_TYPE:
+            codec_type = MATROSKA_TRACK_TYPES.get(_ebml_uint(data, body, body_end), 'data')
+        elif element_id == EBML_CODEC_ID:
+            codec_id = data[body:body_end].rstrip(b'\x00').decode('ascii', 'ignore')
+        elif element_id == EBML_CODEC_PRIVATE:
+            extra['_private'] = data[body:body_end]
+        elif element_id == EBML_VIDEO:
+            for child_id, child, child_end in _elements(data, body, body_end):
+                if child_id == EBML_PIXEL_WIDTH:
+                    extra['width'] = _ebml_uint(data, child, child_end)
+                elif child_id == EBML_PIXEL_HEIGHT:
+                    extra['height'] = _ebml_uint(data, child, child_end)
+        elif element_id == EBML_AUDIO:
+            for child_id, child, child_end in _elements(data, body, body_end):
+                if child_id == EBML_SAMPLING_FREQUENCY:
+                    extra['sample_rate'] = int(_ebml_float(data, child, child_end))
+                elif child_id == EBML_CHANNELS:
+                    extra['channels'] = _ebml_uint(data, child, child_end)
+    if codec_type is None:
+        return None
+    codec_name = MATROSKA_CODECS.get(codec_id)
+    if codec_name is None and codec_id.startswith('A_AAC'):
+        codec_name = 'aac'
+    private = extra.pop('_private', None)
+    if codec_name == 'h264' and private:
+        profile, pix_fmt = _avc_details(private)
+    return _stream(codec_type, codec_name or codec_id.lower() or None, pix_fmt, profile, duration, **extra)
+
+
+def probe_matroska(f, file_size):
+    """Потоки Matroska/WebM по элементам Info и Tracks; None — если их нет"""
+    info, tracks = _read_segment_header(f, file_size)
+    if not tracks:
+        return None
+    duration = None
+    if info:
+        scale = 1000000
+        units = None
+        for element_id, body, body_end in _elements(info, 0, len(info)):
+            if element_id == EBML_TIMECODE_SCALE:
+                scale = _ebml_uint(info, body, body_end) or scale
+            elif element_id == EBML_DURATION:
+                units = _ebml_float(info, body, body_end)
+        if units:
+            duration = units * scale / 1e9
+
+    streams = []
+    for element_id, body, body_end in _elements(tracks, 0, len(tracks)):
+        if element_id == EBML_TRACK_ENTRY:
+            stream = _matroska_track(tracks, body, body_end, duration)
+            if stream is not None:
+                streams.append(stream)
+    if not streams:
+        return None
+    return {'streams': streams, 'duration': duration, 'format_name': MATROSKA_FORMAT_NAME,
+            'bit_rate': _bit_rate(file_size, duration)}
+
+
+def probe_container(path):
+    """Потоки по заголовку контейнера (MP4/MOV, Matroska/WebM) без запуска программ.
+
+    Контейнер определяется по первым байтам, а не по расширению.
+    None — если формат не распознан или заголовок повреждён.
+    """
+    try:
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            head = f.read(12)
+            f.seek(0)
+            if head.startswith(MATROSKA_MAGIC):
+                return probe_matroska(f, file_size)
+            if head[4:8] in MP4_FIRST_BOXES:
+                return probe_mp4(f, file_size)
+    except (OSError, ValueError, IndexError, KeyError, struct.error):
+        pass
+    return None
+
+
+def probe_with_ffprobe(path, ffprobe_path=None, metrics=None):
+    """Потоки и длительность через ffprobe, None — если не удалось"""
+    cmd = [(ffprobe_path or 'ffprobe'), '-v', 'quiet', '-print_format', 'json',
+           '-show_streams', '-show_format', path]
+    try:
+        result = run_tool(cmd, 'probe', metrics, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+    except (OSError, ValueError):
+        return None
+    if result.returncode != 0 or not result.stdout:
+        return None
+    try:
+        data = json.loads(result.stdout)
+    except ValueError:
+        return None
+
+    streams = []
+    for s in data.get('streams', []):
+        streams.append({
+            'codec_type': s.get('codec_type'),
+            'codec_name': s.get('codec_name'),
+            'pix_fmt': s.get('pix_fmt'),
+            'profile': s.get('profile'),
+            'duration': float(s['duration']) if s.get('duration') else None,
+            'bit_rate': int(s['bit_rate']) if str(s.get('bit_rate') or '').isdigit() else None,
+        })
+    duration = (data.get('format') or {}).get('duration')
+    bit_rate = str((data.get('format') or {}).get('bit_rate') or '')
+    return {
+        'streams': streams,
+        'duration': float(duration) if duration else None,
+        'format_name': (data.get('format') or {}).get('format_name'),
+        'bit_rate': int(bit_rate) if bit_rate.isdigit() else None,
+    }
+
+
+def probe_with_ffmpeg(path, ffmpeg_path=None, metrics=None):
+    """Потоки и длительность по выводу `ffmpeg -i`, None — если не удалось"""
+    try:
+        result = run_tool([(ffmpeg_path or 'ffmpeg'), '-hide_banner', '-i', path], 'probe', metrics,
+                          capture_output=True, text=True, encoding='utf-8', errors='ignore')
+    except (OSError, ValueError):
+        return None
+    output = (result.stderr or '') + (result.stdout or '')
+
+    streams = []
+    for kind, codec, rest in FFMPEG_STREAM_RE.findall(output):
+        pix_fmt = None
+        if kind == 'Video':
+            match = PIX_FMT_RE.search(rest)
+            pix_fmt = match.group(1) if match else None
+        streams.append({
+            'codec_type': kind.lower(),
+            'codec_name': codec.lower(),
+            'pix_fmt': pix_fmt,
+            'profile': None,
+            'duration': None,
+            'bit_rate': None,
+        })
+    if not streams:
+        return None
+
+    duration = None
+    match = FFMPEG_DURATION_RE.search(output)
+    if match:
+        hours, minutes, seconds = match.groups()
+        duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    return {'streams': streams, 'duration': duration, 'format_name': None, 'bit_rate': None}
+
+
+def probe_media(path, ffprobe_path=None, ffmpeg_path=None, metrics=None):
+    """Описание потоков файла: заголовок контейнера, иначе ffprobe, иначе ffmpeg -i;
+    None — если ничего не вышло. Запуски программ учитываются в metrics"""
+    return (probe_container(path) or probe_with_ffprobe(path, ffprobe_path, metrics)
+            or probe_with_ffmpeg(path, ffmpeg_path, metrics))
+
+
+def first_stream(probe, codec_type):
+    """Первый поток заданного типа ('video' / 'audio')"""
+    for s in (probe or {}).get('streams', []):
+        if s.get('codec_type') == codec_type:
+            return s
+    return None
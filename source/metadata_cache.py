@@ -0,0 +1,265 @@
+"""
+Дисковый кэш информации о видео (результат extract_info).
+
+Записи хранятся по одной в JSON-файле с ключом «экстрактор_id видео»;
+под ключом URL, если он другой, лежит только ссылка на этот файл.
+Срок жизни записи ограничен TTL и временем истечения ссылок на потоки
+(параметр expire в URL форматов), при переполнении удаляются давно
+не использованные записи (LRU по времени последнего обращения).
+"""
+
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+import yt_dlp
+
+# Параметр истечения ссылки: ...&expire=1700000000 или .../expire/1700000000/...
+EXPIRE_RE = re.compile(r'[?&/]expires?[=/](\d{9,11})')
+
+
+@functools.lru_cache(maxsize=4096)
+def video_key_for_url(url):
+    """Ключ видео по URL без сети: «экстрактор_id», иначе хеш URL"""
+    key = None
+    try:
+        for ie in yt_dlp.extractor.gen_extractor_classes():
+            if ie.ie_key() == 'Generic':
+                continue
+            if ie.suitable(url):
+                video_id = ie.get_temp_id(url)
+                if video_id:
+                    key = f"{ie.ie_key()}_{video_id}"
+                break
+    except Exception:
+        key = None
+    if not key:
+        key = 'url_' + hashlib.md5(url.encode('utf-8')).hexdigest()
+    return re.sub(r'[^\w.-]', '_', key)
+
+
+def video_key_for_info(info):
+    """Ключ видео по уже полученной информации о нём"""
+    extractor = info.get('extractor_key') or info.get('ie_key')
+    video_id = info.get('id')
+    if not (extractor and video_id):
+        return None
+    return re.sub(r'[^\w.-]', '_', f"{extractor}_{video_id}")
+
+
+def default_cache_dir():
+    """Папка кэша по умолчанию"""
+    return str(Path.home() / ".youtube_downloader" / "metadata_cache")
+
+
+class MetadataCache:
+    """Кэш info-словарей yt-dlp с TTL, LRU-вытеснением и счётчиками"""
+
+    def __init__(self, cache_dir=None, ttl=6 * 3600, max_entries=500, expire_margin=600):
+        self.cache_dir = Path(cache_dir or default_cache_dir())
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.expire_margin = expire_margin
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        # Сколько файлов в папке кэша (None — ещё не считали); папка обходится
+        # для вытеснения только тогда, когда файлов больше max_entries
+        self._file_count = None
+
+    # ------------------------------------------------------------------
+    # Ключи
+    # ------------------------------------------------------------------
+
+    def key_for_url(self, url):
+        """Ключ по URL без сети: экстрактор + id видео, иначе хеш URL"""
+        return video_key_for_url(url)
+
+    def key_for_info(self, info):
+        """Ключ по уже полученной информации о видео"""
+        return video_key_for_info(info)
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.json"
+
+    # ------------------------------------------------------------------
+    # Срок жизни
+    # ------------------------------------------------------------------
+
+    def expiry_for(self, info, now=None):
+        """Момент, после которого запись устаревает"""
+        now = now or time.time()
+        expires_at = now + self.ttl
+        urls = [info.get('url')] + [f.get('url') for f in info.get('formats') or []]
+        for url in urls:
+            if not url:
+                continue
+            match = EXPIRE_RE.search(url)
+            if match:
+                expires_at = min(expires_at, int(match.group(1)) - self.expire_margin)
+        return expires_at
+
+    # ------------------------------------------------------------------
+    # Чтение и запись
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            return entry if isinstance(entry, dict) else None
+        except (OSError, ValueError):
+            return None
+
+    def _resolve(self, path):
+        """Запись по файлу ключа, пройдя ссылку: (путь записи, запись) или (None, None)"""
+        entry = self._read(path)
+        if entry and 'alias' in entry:
+            alias_path = path
+            path = self._path(entry['alias'])
+            entry = self._read(path)
+            if entry is None:
+                # Запись вытеснена — ссылка больше не нужна
+                self._remove_file(alias_path)
+            else:
+                self._touch(alias_path)
+        return (path, entry) if entry else (None, None)
+
+    def get(self, url):
+        """Вернуть info для URL или None (промах / запись устарела)"""
+        with self._lock:
+            path, entry = self._resolve(self._path(self.key_for_url(url)))
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry.get('expires_at', 0) <= time.time():
+                self.expired += 1
+                self.misses += 1
+                self._remove_entry(path, entry)
+                return None
+
+            # Отметить обращение для LRU
+            self._touch(path)
+            self.hits += 1
+            return entry.get('info')
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def put(self, url, info):
+        """Сохранить info под ключом «экстрактор_id» и ссылку на него под ключом URL"""
+        if not info or info.get('_type', 'video') != 'video':
+            return
+        info = yt_dlp.YoutubeDL.sanitize_info(info, remove_private_keys=True)
+        now = time.time()
+        entry = {
+            'url': url,
+            'created_at': now,
+            'expires_at': self.expiry_for(info, now),
+            'info': info,
+        }
+        url_key = self.key_for_url(url)
+        info_key = self.key_for_info(info) or url_key
+        with self._lock:
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                if self._file_count is None:
+                    self._file_count = len(list(self.cache_dir.glob('*.json')))
+                self._write(info_key, entry)
+                if url_key != info_key:
+                    self._write(url_key, {'alias': info_key})
+                if self._file_count > self.max_entries:
+                    self._evict()
+            except OSError:
+                # Кэш — не критичная часть: ошибки записи игнорируем
+                pass
+
+    def _write(self, key, data):
+        """Атомарно записать файл ключа (под блокировкой)"""
+        path = self._path(key)
+        existed = path.exists()
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        if not existed and self._file_count is not None:
+            self._file_count += 1
+
+    def _remove_file(self, path):
+        """Удалить файл кэша (под блокировкой)"""
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        if self._file_count is not None:
+            self._file_count = max(0, self._file_count - 1)
+        return True
+
+    def invalidate(self, url):
+        """Удалить запись для URL вместе с её копией под ключом «экстрактор_id»"""
+        url_path = self._path(self.key_for_url(url))
+        with self._lock:
+            path, entry = self._resolve(url_path)
+            self._remove_file(url_path)
+            if entry:
+                self._remove_entry(path, entry)
+
+    def _remove_entry(self, path, entry):
+        """Удалить файл записи и все её копии: по URL и по ключу видео (под блокировкой)"""
+        paths = {path}
+        if entry.get('url'):
+            paths.add(self._path(self.key_for_url(entry['url'])))
+        info_key = self.key_for_info(entry.get('info') or {})
+        if info_key:
+            paths.add(self._path(info_key))
+        for stale in paths:
+            self._remove_file(stale)
+
+    def clear(self):
+        """Очистить кэш целиком"""
+        with self._lock:
+            for path in self.cache_dir.glob('*.json'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._file_count = None
+
+    def _evict(self):
+        """Удалить самые давние записи сверх max_entries (под блокировкой)"""
+        entries = list(self.cache_dir.glob('*.json'))
+        self._file_count = len(entries)
+        excess = len(entries) - self.max_entries
+        if excess <= 0:
+            return
+        entries.sort(key=lambda p: p.stat().st_mtime)
+        for path in entries[:excess]:
+            if self._remove_file(path):
+                self.evictions += 1
+
+    def stats(self):
+        """Счётчики попаданий и промахов"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits / total) if total else 0.0,
+            }
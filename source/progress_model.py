@@ -0,0 +1,175 @@
+"""
+Модель прогресса скачивания.
+
+Обработчик прогресса yt-dlp только записывает числа (байты, скорость,
+фрагменты) в ProgressModel — без форматирования и вывода, поэтому его
+стоимость не зависит от частоты вызовов. Интерфейс, CLI и метрики сами
+опрашивают снимок прогресса с нужной им частотой.
+"""
+
+import threading
+import time
+
+# Имя основного потока, если поток не указан
+MAIN_STREAM = 'main'
+
+
+class ProgressModel:
+    """Прогресс задания по потокам: байты, мгновенная и сглаженная скорость, ETA"""
+
+    def __init__(self, smoothing=0.3):
+        # Вес нового замера в экспоненциальном сглаживании скорости
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Сбросить прогресс (новая загрузка)"""
+        with self._lock:
+            self._streams = {}
+            self._stage = (0, None)
+            self._fragment_level = None
+            self._started_at = time.monotonic()
+
+    def set_stage(self, number, name):
+        """Отметить текущий этап конвейера"""
+        with self._lock:
+            self._stage = (number, name)
+
+    def set_fragment_level(self, level):
+        """Отметить число параллельных фрагментов текущей загрузки"""
+        with self._lock:
+            self._fragment_level = level
+
+    def update(self, d, stream=None):
+        """Учесть словарь прогресса yt-dlp (постоянное время, без форматирования)"""
+        now = time.monotonic()
+        key = stream or MAIN_STREAM
+        downloaded = d.get('downloaded_bytes') or 0
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        with self._lock:
+            state = self._streams.get(key)
+            if state is None:
+                state = self._streams[key] = {
+                    'status': None, 'downloaded': 0, 'total': None, 'speed': None,
+                    'smoothed_speed': None, 'eta': None, 'fragment_index': None,
+                    'fragment_count': None, 'updated_at': now,
+                }
+            speed = d.get('speed')
+            if speed is None:
+                # Собственный замер: например, при передаче аудио через канал
+                elapsed = now - state['updated_at']
+                if elapsed > 0 and downloaded >= state['downloaded']:
+                    speed = (downloaded - state['downloaded']) / elapsed
+            if speed is not None:
+                previous = state['smoothed_speed']
+                state['smoothed_speed'] = speed if previous is None else (
+                    previous + self.smoothing * (speed - previous))
+            state['status'] = d.get('status')
+            state['downloaded'] = downloaded
+            state['total'] = total or state['total']
+            state['speed'] = speed
+            state['eta'] = d.get('eta')
+            state['fragment_index'] = d.get('fragment_index')
+            state['fragment_count'] = d.get('fragment_count')
+            state['updated_at'] = now
+
+    def snapshot(self):
+        """Согласованный снимок прогресса задания"""
+        with self._lock:
+            streams = {key: dict(state) for key, state in self._streams.items()}
+            stage_number, stage_name = self._stage
+            fragment_level = self._fragment_level
+            elapsed = time.monotonic() - self._started_at
+
+        downloaded = sum(s['downloaded'] for s in streams.values())
+        totals = [s['total'] for s in streams.values()]
+        total = sum(totals) if totals and all(totals) else None
+        speed = sum(s['smoothed_speed'] or 0 for s in streams.values()
+                    if s['status'] == 'downloading')
+        fragmented = [s for s in streams.values() if s['fragment_count'] and s['status'] == 'downloading']
+        percent = None
+        eta = None
+        if total:
+            percent = min(100.0, downloaded * 100.0 / total)
+            if speed > 0:
+                eta = max(0.0, (total - downloaded) / speed)
+        return {
+            'downloaded': downloaded,
+            'total': total,
+            'percent': percent,
+            'speed': speed,
+            'eta': eta,
+            'elapsed': elapsed,
+            'stage': stage_number,
+            'stage_name': stage_name,
+            # (фрагмент, всего фрагментов, параллельно) или None — загрузка не фрагментами
+            'fragments': ((fragmented[0]['fragment_index'] or 0, fragmented[0]['fragment_count'],
+                           fragment_level) if fragmented else None),
+            'streams': streams,
+        }
+
+
+class ProgressSampler:
+    """Фоновый поток, вызывающий callback() раз в interval секунд"""
+
+    def __init__(self, callback, interval=1.0):
+        self.callback = callback
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.callback()
+            except Exception:
+                pass
+
+
+def format_bytes(size):
+    """Размер в читаемом виде"""
+    for unit in ('Б', 'КБ', 'МБ', 'ГБ'):
+        if size < 1024 or unit == 'ГБ':
+            return f"{size:.0f} {unit}" if unit == 'Б' else f"{size:.1f} {unit}"
+        size /= 1024.0
+
+
+def format_duration(seconds):
+    """Длительность в виде Ч:ММ:СС или М:СС"""
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def format_progress(snapshot):
+    """Короткая строка прогресса: «45.2% · 3.1 МБ/с · осталось 0:42 · фрагмент 12/40, потоков: 4»"""
+    if not snapshot['streams']:
+        return ""
+    if snapshot['percent'] is not None:
+        parts = [f"{snapshot['percent']:.1f}%"]
+    else:
+        parts = [format_bytes(snapshot['downloaded'])]
+    if snapshot['speed']:
+        parts.append(f"{format_bytes(snapshot['speed'])}/с")
+    if snapshot['eta'] is not None:
+        parts.append(f"осталось {format_duration(snapshot['eta'])}")
+    if snapshot.get('fragments'):
+        index, count, level = snapshot['fragments']
+        parts.append(f"фрагмент {index}/{count}" + (f", потоков: {level}" if level else ""))
+    return " · ".join(parts)
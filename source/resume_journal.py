@@ -0,0 +1,214 @@
+"""
+Журнал возобновления загрузки.
+
+Рядом с временными файлами задания (temp_<хеш>.*) лежит temp_<хеш>.json:
+URL, формат, название, достигнутый этап и уже скачанные потоки. Имя
+временных файлов зависит только от видео и формата, поэтому после сбоя
+или перезапуска задание находит свои файлы, yt-dlp докачивает .part с
+того же места, а готовые потоки не скачиваются повторно.
+
+Для недокачанного потока (видео и аудио) журнал хранит описание формата
+(ожидаемый размер) и контрольные суммы всех полностью записанных блоков
+.part-файла. Перед продолжением блоки сверяются: если формат на сервере
+сменился, .part удаляется, а если блок не совпал — файл обрезается с
+начала этого блока, и докачивается только оставшееся. Данные после
+последнего записанного в журнал блока сохраняются.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+JOURNAL_SUFFIX = '.json'
+# Размер блока для контрольных сумм
+CHUNK_SIZE = 1024 * 1024
+
+
+def journal_path_for(temp_path):
+    """Путь журнала для временного файла задания (в т.ч. для .part и потоков)"""
+    base = temp_path[:-len('.part')] if temp_path.endswith('.part') else temp_path
+    base = os.path.splitext(base)[0]
+    for stream_suffix in ('_audio', '_video'):
+        if base.endswith(stream_suffix):
+            base = base[:-len(stream_suffix)]
+    return base + JOURNAL_SUFFIX
+
+
+class ResumeJournal:
+    """Состояние одного задания, сохраняемое атомарной заменой файла"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.data = self._read(self.path) or {}
+        # Журнал обновляют и обработчики прогресса из потоков загрузки
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else None
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def stage(self):
+        return self.data.get('stage', 0)
+
+    def update(self, **fields):
+        """Обновить поля и сохранить журнал"""
+        with self._lock:
+            self.data.update(fields)
+            self.data.setdefault('created_at', time.time())
+            self.data['updated_at'] = time.time()
+            self._save()
+
+    def mark_stream_done(self, name, path):
+        """Поток скачан полностью"""
+        with self._lock:
+            streams = self.data.setdefault('streams', {})
+            streams[name] = {'path': os.path.basename(path), 'size': os.path.getsize(path)}
+            (self.data.get('partial') or {}).pop(name, None)
+            self.update()
+
+    def stream_done(self, name, path):
+        """Поток уже скачан в прошлый раз и файл на месте, того же размера"""
+        stream = (self.data.get('streams') or {}).get(name)
+        if not stream or not os.path.exists(path):
+            return False
+        return os.path.getsize(path) == stream.get('size')
+
+    # ------------------------------------------------------------------
+    # Целостность недокачанного файла
+    # ------------------------------------------------------------------
+
+    def _partial(self, name):
+        """Состояние недокачанного потока: подпись формата и суммы блоков по порядку"""
+        partial = self.data.setdefault('partial', {}).setdefault(name, {'signature': None})
+        # Старые журналы хранили суммы только последних блоков — проверить по ним весь файл нельзя
+        partial.pop('chunks', None)
+        partial.setdefault('hashes', [])
+        return partial
+
+    def record_chunks(self, name, part_path):
+        """Посчитать суммы новых полностью записанных блоков .part-файла"""
+        with self._lock:
+            hashes = self._partial(name)['hashes']
+            offset = len(hashes) * CHUNK_SIZE
+            try:
+                size = os.path.getsize(part_path)
+                if size < offset + CHUNK_SIZE:
+                    return
+                with open(part_path, 'rb') as f:
+                    f.seek(offset)
+                    while offset + CHUNK_SIZE <= size:
+                        data = f.read(CHUNK_SIZE)
+                        if len(data) < CHUNK_SIZE:
+                            break
+                        hashes.append(hashlib.sha1(data).hexdigest())
+                        offset += CHUNK_SIZE
+            except OSError:
+                return
+            self.update()
+
+    def verify_partial(self, name, part_path, signature=None):
+        """Проверить .part-файл перед продолжением загрузки.
+
+        Возвращает 'ok', 'truncated' (файл обрезан с первого несовпавшего
+        блока) или 'reset' (файл удалён: формат на сервере сменился).
+        """
+        with self._lock:
+            partial = self._partial(name)
+            if not os.path.exists(part_path):
+                partial['signature'] = signature
+                partial['hashes'] = []
+                self.update()
+                return 'ok'
+
+            size = os.path.getsize(part_path)
+            expected = (signature or {}).get('filesize')
+            if (partial['signature'] and signature and partial['signature'] != signature) or \
+                    (expected and size > expected):
+                return self._reset_partial(partial, part_path, signature)
+
+            # Блоки сверяются по порядку до первого несовпадения
+            hashes = partial['hashes']
+            verified = 0
+            bad_offset = None
+            try:
+                with open(part_path, 'rb') as f:
+                    for checksum in hashes:
+                        data = f.read(CHUNK_SIZE)
+                        if len(data) < CHUNK_SIZE:
+                            # Файл короче записанного в журнал — проверять дальше нечего
+                            break
+                        if hashlib.sha1(data).hexdigest() != checksum:
+                            bad_offset = verified * CHUNK_SIZE
+                            break
+                        verified += 1
+            except OSError:
+                return self._reset_partial(partial, part_path, signature)
+
+            partial['signature'] = signature or partial['signature']
+            del hashes[verified:]
+            if bad_offset is not None:
+                try:
+                    with open(part_path, 'r+b') as f:
+                        f.truncate(bad_offset)
+                except OSError:
+                    return self._reset_partial(partial, part_path, signature)
+                self.update()
+                return 'truncated'
+            self.update()
+            return 'ok'
+
+    def reset_partial(self, name, part_path, signature=None):
+        """Удалить .part-файл и забыть его блоки"""
+        with self._lock:
+            return self._reset_partial(self._partial(name), part_path, signature)
+
+    def _reset_partial(self, partial, part_path, signature):
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        partial['signature'] = signature
+        partial['hashes'] = []
+        self.update()
+        return 'reset'
+
+    def remove(self):
+        """Задание завершено — журнал больше не нужен"""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # Без журнала загрузка всё равно идёт, просто без возобновления по этапам
+            pass
+
+
+def find_interrupted(download_dir):
+    """Журналы прерванных заданий в папке загрузки (самые новые — первыми)"""
+    journals = []
+    try:
+        paths = list(Path(download_dir).glob('temp_*' + JOURNAL_SUFFIX))
+    except OSError:
+        return journals
+    for path in paths:
+        journal = ResumeJournal(path)
+        if journal.data.get('url'):
+            journals.append(journal)
+    journals.sort(key=lambda j: j.data.get('updated_at', 0), reverse=True)
+    return journals
@@ -0,0 +1,256 @@
+"""
+Повторы после ошибок по классу ошибки.
+
+Ошибка относится к одному из классов: сеть, ограничение запросов (429),
+нет места на диске, нет доступа, видео недоступно, формат/кодек. Класс
+определяется по самому исключению (HTTP-статус, errno, тип ошибки
+транспорта yt-dlp), а если его не видно — по тексту сообщения. Для
+каждого класса задано своё число попыток и кривая пауз (экспонента с
+разбросом); бесполезные повторы (диск, доступ, видео удалено) не делаются.
+
+Счётчики попыток, повторов, отказов и потерянных байт по этапам
+собираются в RetryMetrics.
+"""
+
+import errno
+import random
+import re
+import threading
+import time
+
+from progress_model import format_bytes
+
+NETWORK = 'network'
+THROTTLED = 'throttled'
+DISK_FULL = 'disk_full'
+PERMISSION = 'permission'
+UNAVAILABLE = 'unavailable'
+CODEC = 'codec'
+UNKNOWN = 'unknown'
+
+ERROR_CLASS_NAMES = {
+    NETWORK: 'Сетевая ошибка',
+    THROTTLED: 'Сервер ограничил число запросов',
+    DISK_FULL: 'Нет места на диске',
+    PERMISSION: 'Нет доступа к файлу или папке',
+    UNAVAILABLE: 'Видео недоступно',
+    CODEC: 'Формат или кодек не поддерживается',
+    UNKNOWN: 'Ошибка',
+}
+
+# attempts — сколько попыток подряд без продвижения; пауза перед n-м повтором —
+# base * 2^(n-1), но не больше max, из них половина случайна
+RETRY_RULES = {
+    NETWORK: {'attempts': 5, 'base': 1.0, 'max': 30.0},
+    THROTTLED: {'attempts': 6, 'base': 15.0, 'max': 300.0},
+    DISK_FULL: {'attempts': 1, 'base': 0.0, 'max': 0.0},
+    PERMISSION: {'attempts': 1, 'base': 0.0, 'max': 0.0},
+    UNAVAILABLE: {'attempts': 1, 'base': 0.0, 'max': 0.0},
+    CODEC: {'attempts': 2, 'base': 0.0, 'max': 0.0},
+    UNKNOWN: {'attempts': 3, 'base': 2.0, 'max': 20.0},
+}
+# Предел попыток этапа с учётом попыток, после которых файл всё же вырос
+MAX_TOTAL_ATTEMPTS = 20
+# Шаг ожидания паузы: чаще проверяем отмену
+SLEEP_STEP = 0.25
+
+DISK_FULL_ERRNOS = {errno.ENOSPC, getattr(errno, 'EDQUOT', errno.ENOSPC)}
+PERMISSION_ERRNOS = {errno.EACCES, errno.EPERM}
+
+# Классы по тексту сообщения — в порядке проверки
+MESSAGE_PATTERNS = (
+    (THROTTLED, re.compile(r'\b429\b|too many requests|rate.?limit', re.IGNORECASE)),
+    (DISK_FULL, re.compile(r'no space|disk full|enospc|errno 28\b|недостаточно места', re.IGNORECASE)),
+    (PERMISSION, re.compile(r'permission denied|access is denied|access denied|errno 13\b|отказано в доступе',
+                            re.IGNORECASE)),
+    (UNAVAILABLE, re.compile(r'not found|\b404\b|\b410\b|private video|video unavailable|is unavailable|'
+                             r'has been removed|does not exist|members.only|confirm your age|not available in your',
+                             re.IGNORECASE)),
+    (CODEC, re.compile(r'codec|unsupported|requested format is not available|invalid data found|'
+                       r'conversion failed', re.IGNORECASE)),
+    (NETWORK, re.compile(r'connection|network|timed out|timeout|unreachable|reset by peer|'
+                         r'temporary failure|incompleteread|incomplete read|\bssl\b|http error 5\d\d|\b50[234]\b',
+                         re.IGNORECASE)),
+)
+
+
+def _causes(error):
+    """Исключение и его причины (в т.ч. исходная ошибка внутри DownloadError yt-dlp)"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        exc_info = getattr(error, 'exc_info', None)
+        inner = exc_info[1] if isinstance(exc_info, tuple) and len(exc_info) > 1 else None
+        error = inner or error.__cause__ or error.__context__
+
+
+def _http_status(error):
+    for attr in ('status', 'code'):
+        value = getattr(error, attr, None)
+        if isinstance(value, int) and 100 <= value < 600:
+            return value
+    return None
+
+
+def retry_after(error):
+    """Пауза из заголовка Retry-After ответа сервера (сек), если он есть"""
+    if not isinstance(error, BaseException):
+        return None
+    for cause in _causes(error):
+        response = getattr(cause, 'response', None)
+        headers = getattr(response, 'headers', None) or getattr(cause, 'headers', None)
+        if headers:
+            try:
+                value = headers.get('Retry-After')
+                if value and str(value).strip().isdigit():
+                    return float(value)
+            except Exception:
+                pass
+    return None
+
+
+def classify_error(error):
+    """Класс ошибки (NETWORK, THROTTLED, ...) по исключению или тексту сообщения"""
+    if isinstance(error, BaseException):
+        for cause in _causes(error):
+            status = _http_status(cause)
+            if status == 429:
+                return THROTTLED
+            if status in (404, 410):
+                return UNAVAILABLE
+            if status is not None and (status >= 500 or status in (403, 408)):
+                # 403 у YouTube обычно значит устаревшую ссылку на поток — помогает повтор
+                return NETWORK
+            if isinstance(cause, OSError):
+                if cause.errno in DISK_FULL_ERRNOS:
+                    return DISK_FULL
+                if isinstance(cause, PermissionError) or cause.errno in PERMISSION_ERRNOS:
+                    return PERMISSION
+                if isinstance(cause, (ConnectionError, TimeoutError)):
+                    return NETWORK
+            if type(cause).__name__ in ('TransportError', 'ProxyError', 'SSLError', 'IncompleteRead'):
+                return NETWORK
+        message = ' '.join(str(cause) for cause in _causes(error))
+    else:
+        message = str(error or '')
+
+    for error_class, pattern in MESSAGE_PATTERNS:
+        if pattern.search(message):
+            return error_class
+    return UNKNOWN
+
+
+class RetryMetrics:
+    """Счётчики попыток, повторов и потерянных байт по этапам (потокобезопасно)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = {}
+        self.retries = {}
+        self.give_ups = {}
+        self.wasted_bytes = {}
+        self.backoff_seconds = 0.0
+
+    @staticmethod
+    def _add(counter, key, value=1):
+        counter[key] = counter.get(key, 0) + value
+
+    def attempt(self, stage):
+        with self._lock:
+            self._add(self.attempts, stage)
+
+    def retry(self, stage, error_class, delay):
+        with self._lock:
+            self._add(self.retries, (stage, error_class))
+            self.backoff_seconds += delay
+
+    def give_up(self, stage, error_class):
+        with self._lock:
+            self._add(self.give_ups, (stage, error_class))
+
+    def add_wasted(self, stage, nbytes):
+        """Скачанные байты, которые пришлось выбросить"""
+        if nbytes > 0:
+            with self._lock:
+                self._add(self.wasted_bytes, stage, nbytes)
+
+    def snapshot(self):
+        """Копия счётчиков: ключи повторов и отказов — «этап/класс»"""
+        with self._lock:
+            return {
+                'attempts': dict(self.attempts),
+                'retries': {f"{stage}/{cls}": n for (stage, cls), n in self.retries.items()},
+                'give_ups': {f"{stage}/{cls}": n for (stage, cls), n in self.give_ups.items()},
+                'wasted_bytes': dict(self.wasted_bytes),
+                'backoff_seconds': round(self.backoff_seconds, 3),
+            }
+
+
+def format_retry_metrics(snapshot):
+    """Сводка повторов одной строкой; пустая строка — повторов и потерь не было"""
+    parts = []
+    if snapshot['retries']:
+        parts.append("повторов " + ", ".join(f"{key} {n}" for key, n in sorted(snapshot['retries'].items())))
+    if snapshot['give_ups']:
+        parts.append("отказов " + ", ".join(f"{key} {n}" for key, n in sorted(snapshot['give_ups'].items())))
+    wasted = sum(snapshot['wasted_bytes'].values())
+    if wasted:
+        parts.append(f"выброшено {format_bytes(wasted)}")
+    if snapshot['backoff_seconds']:
+        parts.append(f"ожидание {snapshot['backoff_seconds']:.1f} с")
+    return "; ".join(parts)
+
+
+class RetryPolicy:
+    """Решение «повторять ли и через сколько» по классу ошибки и номеру попытки"""
+
+    def __init__(self, rules=None, metrics=None, max_total_attempts=MAX_TOTAL_ATTEMPTS, rng=None):
+        self.rules = {**RETRY_RULES, **(rules or {})}
+        self.metrics = metrics or RetryMetrics()
+        self.max_total_attempts = max_total_attempts
+        self._random = rng or random.Random()
+
+    def backoff(self, error_class, attempt):
+        """Пауза перед повтором после attempt-й неудачной попытки (половина — случайная)"""
+        rule = self.rules.get(error_class, self.rules[UNKNOWN])
+        delay = min(rule['max'], rule['base'] * (2 ** (attempt - 1)))
+        return delay / 2 + self._random.uniform(0, delay / 2)
+
+    def decide(self, stage, error, attempt, total_attempts=None):
+        """(класс ошибки, пауза перед повтором или None — больше не повторять)"""
+        error_class = classify_error(error)
+        rule = self.rules.get(error_class, self.rules[UNKNOWN])
+        if attempt >= rule['attempts'] or (total_attempts or attempt) >= self.max_total_attempts:
+            self.metrics.give_up(stage, error_class)
+            return error_class, None
+        delay = self.backoff(error_class, attempt)
+        if error_class == THROTTLED:
+            delay = max(delay, retry_after(error) or 0)
+        self.metrics.retry(stage, error_class, delay)
+        return error_class, delay
+
+    @staticmethod
+    def sleep(delay, cancelled=None):
+        """Подождать delay секунд; False — если ожидание прервано отменой"""
+        deadline = time.monotonic() + delay
+        while True:
+            if cancelled and cancelled():
+                return False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            time.sleep(min(remaining, SLEEP_STEP))
+
+
+_default_policy = None
+_default_lock = threading.Lock()
+
+
+def default_policy():
+    """Политика повторов, общая для всех движков процесса (с общими счётчиками)"""
+    global _default_policy
+    with _default_lock:
+        if _default_policy is None:
+            _default_policy = RetryPolicy()
+        return _default_policy
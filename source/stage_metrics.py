@@ -0,0 +1,353 @@
+"""
+Замеры этапов заданий и запусков ffmpeg/ffprobe.
+
+JobMetrics собирает для одного задания длительность этапов (получение
+информации, скачивание видео и аудио, объединение), скачанные по сети и
+записанные на диск байты, запуски ffmpeg/ffprobe с их временем и повторы
+после ошибок; в конце задания из этого получается сводка для JSON.
+
+Те же числа накапливаются в общем для процесса MetricsRegistry, который
+отдаёт их в текстовом формате Prometheus — файлом (для textfile-коллектора
+node_exporter) или по HTTP на локальном порту (MetricsServer). Счётчики
+повторов берутся из RetryMetrics политики повторов.
+"""
+
+import os
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from progress_model import format_bytes
+from retry_policy import default_policy
+
+# Границы корзин гистограмм длительности (сек)
+DURATION_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+# Имя метрики → (тип, описание); в этом порядке метрики выводятся
+METRICS = {
+    'ytdl_stage_duration_seconds': ('histogram', "Длительность этапа задания"),
+    'ytdl_stage_downloaded_bytes_total': ('counter', "Байты, скачанные по сети на этапе"),
+    'ytdl_stage_written_bytes_total': ('counter', "Байты итоговых файлов этапа"),
+    'ytdl_subprocess_duration_seconds': ('histogram', "Время работы ffmpeg/ffprobe"),
+    'ytdl_subprocess_failures_total': ('counter', "Запуски ffmpeg/ffprobe, завершившиеся ошибкой"),
+    'ytdl_jobs_active': ('gauge', "Загрузки, которые выполняются сейчас"),
+    'ytdl_jobs_total': ('counter', "Завершённые загрузки по результату"),
+    'ytdl_retries_total': ('counter', "Повторы после ошибок по этапу и классу ошибки"),
+    'ytdl_retry_give_ups_total': ('counter', "Отказы от повторов по этапу и классу ошибки"),
+    'ytdl_retry_wasted_bytes_total': ('counter', "Скачанные байты, которые пришлось выбросить"),
+    'ytdl_retry_backoff_seconds_total': ('counter', "Суммарная пауза перед повторами"),
+}
+
+
+def tool_name(executable):
+    """Имя программы без пути и .exe: ffmpeg, ffprobe"""
+    name = os.path.basename(str(executable)).lower()
+    return name[:-len('.exe')] if name.endswith('.exe') else name
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """Счётчики и гистограммы процесса с выводом в текстовом формате Prometheus"""
+
+    def __init__(self, retry_metrics=None):
+        self.retry_metrics = retry_metrics
+        self._lock = threading.Lock()
+        # (имя, метки) → значение; для гистограмм — [корзины, сумма, количество]
+        self._values = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name, labels=None, value=1):
+        """Увеличить счётчик (или изменить gauge на value)"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        """Добавить наблюдение в гистограмму длительности"""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.setdefault(key, [[0] * len(DURATION_BUCKETS), 0.0, 0])
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def record_subprocess(self, tool, purpose, seconds, ok):
+        """Учесть запуск внешней программы"""
+        labels = {'tool': tool, 'purpose': purpose}
+        self.observe('ytdl_subprocess_duration_seconds', seconds, labels)
+        if not ok:
+            self.inc('ytdl_subprocess_failures_total', labels)
+
+    def _retry_values(self):
+        if self.retry_metrics is None:
+            return {}
+        snapshot = self.retry_metrics.snapshot()
+        values = {}
+        for name, counter in (('ytdl_retries_total', snapshot['retries']),
+                              ('ytdl_retry_give_ups_total', snapshot['give_ups'])):
+            for key, count in counter.items():
+                stage, error_class = key.split('/', 1)
+                values[self._key(name, {'stage': stage, 'class': error_class})] = count
+        for stage, nbytes in snapshot['wasted_bytes'].items():
+            values[self._key('ytdl_retry_wasted_bytes_total', {'stage': stage})] = nbytes
+        if snapshot['backoff_seconds']:
+            values[self._key('ytdl_retry_backoff_seconds_total', None)] = snapshot['backoff_seconds']
+        return values
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self._histograms.items()}
+        values.update(self._retry_values())
+
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            source = histograms if kind == 'histogram' else values
+            series = sorted((labels, value) for (metric, labels), value in source.items() if metric == name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in series:
+                if kind != 'histogram':
+                    lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+                    continue
+                buckets, total, count = value
+                for bound, bucket_count in zip(DURATION_BUCKETS, buckets):
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {bucket_count}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Записать метрики в файл атомарной заменой; False — если записать не удалось"""
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8', newline='\n') as f:
+                f.write(self.render())
+            os.replace(tmp_path, path)
+            return True
+        except OSError:
+            return False
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if urlparse(self.path).path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """Локальная HTTP-точка /metrics для Prometheus"""
+
+    daemon_threads = True
+
+    def __init__(self, registry, port, host='127.0.0.1'):
+        super().__init__((host, port), _MetricsHandler)
+        self.registry = registry
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+_default_registry = None
+_default_lock = threading.Lock()
+
+
+def default_registry():
+    """Реестр метрик, общий для всех движков процесса"""
+    global _default_registry
+    with _default_lock:
+        if _default_registry is None:
+            _default_registry = MetricsRegistry(default_policy().metrics)
+        return _default_registry
+
+
+def run_tool(cmd, purpose, metrics=None, **kwargs):
+    """subprocess.run с замером времени: запуск учитывается в metrics
+    (JobMetrics задания или MetricsRegistry; по умолчанию — общий реестр)"""
+    started = time.perf_counter()
+    ok = False
+    try:
+        result = subprocess.run(cmd, **kwargs)
+        ok = result.returncode == 0
+        return result
+    finally:
+        (metrics or default_registry()).record_subprocess(
+            tool_name(cmd[0]), purpose, time.perf_counter() - started, ok)
+
+
+class JobMetrics:
+    """Замеры одного задания; всё записанное сразу попадает и в общий реестр"""
+
+    def __init__(self, registry=None):
+        self.registry = registry or default_registry()
+        self.started_at = time.time()
+        self.result = None
+        self.fields = {}
+        self.stages = {}
+        self.subprocesses = {}
+        self.retries = {}
+        self.wasted_bytes = 0
+        self._started = time.perf_counter()
+        self._finished = None
+        self._running = False
+        self._open = {}
+        # Этапы видео и аудио идут в разных потоках
+        self._lock = threading.Lock()
+
+    def _stage(self, name):
+        return self.stages.setdefault(name, {'seconds': 0.0, 'downloaded_bytes': 0, 'written_bytes': 0})
+
+    def begin_stage(self, name):
+        with self._lock:
+            self._open.setdefault(name, time.perf_counter())
+            self._stage(name)
+
+    def end_stage(self, name):
+        with self._lock:
+            started = self._open.pop(name, None)
+            if started is None:
+                return
+            seconds = time.perf_counter() - started
+            # Этап мог выполняться несколько раз — время суммируется
+            self._stage(name)['seconds'] += seconds
+        self.registry.observe('ytdl_stage_duration_seconds', seconds, {'stage': name})
+
+    def add_downloaded(self, stage, nbytes):
+        """Байты, полученные по сети"""
+        if nbytes > 0:
+            with self._lock:
+                self._stage(stage)['downloaded_bytes'] += nbytes
+            self.registry.inc('ytdl_stage_downloaded_bytes_total', {'stage': stage}, nbytes)
+
+    def add_written(self, stage, nbytes):
+        """Байты файла, получившегося на этапе"""
+        if nbytes > 0:
+            with self._lock:
+                self._stage(stage)['written_bytes'] += nbytes
+            self.registry.inc('ytdl_stage_written_bytes_total', {'stage': stage}, nbytes)
+
+    def record_subprocess(self, tool, purpose, seconds, ok):
+        """Учесть запуск ffmpeg/ffprobe"""
+        with self._lock:
+            entry = self.subprocesses.setdefault(f"{tool}/{purpose}", {'runs': 0, 'seconds': 0.0, 'failures': 0})
+            entry['runs'] += 1
+            entry['seconds'] += seconds
+            if not ok:
+                entry['failures'] += 1
+        self.registry.record_subprocess(tool, purpose, seconds, ok)
+
+    def record_retry(self, stage, error_class, gave_up=False):
+        """Повтор или отказ от повторов (в реестр они попадают из RetryMetrics)"""
+        with self._lock:
+            entry = self.retries.setdefault(f"{stage}/{error_class}", {'retries': 0, 'give_ups': 0})
+            entry['give_ups' if gave_up else 'retries'] += 1
+
+    def add_wasted(self, nbytes):
+        if nbytes > 0:
+            with self._lock:
+                self.wasted_bytes += nbytes
+
+    def start(self, **fields):
+        """Началась загрузка (этап получения информации мог пройти раньше)"""
+        self.fields.update(fields)
+        if not self._running:
+            self._running = True
+            self.registry.inc('ytdl_jobs_active')
+
+    def finish(self, result, **fields):
+        """Задание завершено: закрыть незавершённые этапы и учесть результат"""
+        for name in list(self._open):
+            self.end_stage(name)
+        self.fields.update(fields)
+        if self._running:
+            self._running = False
+            self.registry.inc('ytdl_jobs_active', value=-1)
+        if self.result is None:
+            self._finished = time.perf_counter()
+            self.result = result
+            self.registry.inc('ytdl_jobs_total', {'result': result})
+
+    def summary(self):
+        """Сводка задания для JSON"""
+        with self._lock:
+            stages = {name: dict(stage) for name, stage in self.stages.items()}
+            subprocesses = {key: dict(entry) for key, entry in self.subprocesses.items()}
+            retries = {key: dict(entry) for key, entry in self.retries.items()}
+        for stage in stages.values():
+            stage['download_rate'] = (round(stage['downloaded_bytes'] / stage['seconds'])
+                                      if stage['downloaded_bytes'] and stage['seconds'] else None)
+            stage['seconds'] = round(stage['seconds'], 3)
+        for entry in subprocesses.values():
+            entry['seconds'] = round(entry['seconds'], 3)
+
+        # На что ушло больше всего времени: видео и аудио могут качаться одновременно
+        spent = {
+            'info': stages.get('info', {}).get('seconds', 0),
+            'download': max(stages.get(name, {}).get('seconds', 0) for name in ('video', 'audio')),
+            'ffmpeg': sum(entry['seconds'] for entry in subprocesses.values()),
+        }
+        return {
+            **self.fields,
+            'result': self.result,
+            'started_at': round(self.started_at, 3),
+            'seconds': round((self._finished or time.perf_counter()) - self._started, 3),
+            'bound_by': max(spent, key=spent.get) if any(spent.values()) else None,
+            'stages': stages,
+            'subprocesses': subprocesses,
+            'retries': retries,
+            'wasted_bytes': self.wasted_bytes,
+        }
+
+
+def format_job_metrics(summary):
+    """Этапы задания одной строкой: время и скачанные байты"""
+    parts = []
+    for name, stage in summary['stages'].items():
+        text = f"{name} {stage['seconds']:.1f} с"
+        if stage['downloaded_bytes']:
+            text += f" ({format_bytes(stage['downloaded_bytes'])})"
+        parts.append(text)
+    ffmpeg_seconds = sum(entry['seconds'] for entry in summary['subprocesses'].values())
+    if ffmpeg_seconds:
+        parts.append(f"ffmpeg/ffprobe {ffmpeg_seconds:.1f} с")
+    return ", ".join(parts)
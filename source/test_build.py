@@ -47,7 +47,7 @@ def test_main_script():
             ('def download_video', 'Метод скачивания'),
             ('def get_video_info', 'Метод получения информации'),
             ('tkinter', 'GUI библиотека'),
-            ('yt_dlp', 'YouTube библиотека'),
+            ('downloader_engine', 'Движок скачивания'),
         ]
         
         for check, description in checks:
@@ -62,6 +62,28 @@ def test_main_script():
         print("✗ Файл youtube_downloader.py не найден")
         return False
 
+def test_engine_modules():
+    """Проверить движок скачивания и пакетный CLI"""
+    print("\nПроверка движка и CLI...")
+    modules = [
+        ('downloader_engine.py', ['class DownloadEngine', 'def download_video', 'yt_dlp']),
+        ('download_queue.py', ['class DownloadQueue', 'class DownloadJob']),
+        ('batch_download.py', ['def main', 'DownloadQueue']),
+    ]
+    for filename, checks in modules:
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except FileNotFoundError:
+            print(f"✗ Файл {filename} не найден")
+            return False
+        for check in checks:
+            if check not in content:
+                print(f"✗ {filename}: нет '{check}'")
+                return False
+        print(f"✓ {filename}")
+    return True
+
 def test_requirements():
     """Проверить файл requirements.txt"""
     print("\nПроверка requirements.txt...")
@@ -88,7 +110,7 @@ def main():
     
     # Проверки
     failed_imports = test_imports()
-    script_ok = test_main_script()
+    script_ok = test_main_script() and test_engine_modules()
     requirements_ok = test_requirements()
     
     print("\n" + "=" * 50)
@@ -0,0 +1,38 @@
+"""
+Проверки общего лимита соединений FragmentConcurrency
+"""
+
+import threading
+
+from fragment_concurrency import FragmentConcurrency
+
+
+def test_grant_never_exceeds_global_limit():
+    controller = FragmentConcurrency(initial=4, min_level=2, global_limit=5)
+    first = controller.acquire('a.example.com')
+    second = controller.acquire('b.example.com')
+
+    assert (first, second) == (4, 1)
+    assert controller.in_use() == 5
+
+
+def test_acquire_waits_for_release_when_saturated():
+    controller = FragmentConcurrency(initial=2, global_limit=2)
+    level = controller.acquire('a.example.com')
+    granted = []
+    waiter = threading.Thread(target=lambda: granted.append(controller.acquire('b.example.com')))
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive() and not granted
+
+    controller.release('a.example.com', level)
+    waiter.join(2)
+    assert granted == [2]
+
+
+def test_cancelled_wait_returns_zero():
+    controller = FragmentConcurrency(initial=2, global_limit=2)
+    controller.acquire('a.example.com')
+
+    assert controller.acquire('b.example.com', cancelled=lambda: True) == 0
+    assert controller.in_use() == 2
@@ -0,0 +1,137 @@
+"""
+Проверки разбора заголовков MP4 и WebM (файлы собираются в тестах, без ffmpeg)
+"""
+
+import struct
+import time
+
+from media_probe import first_stream, probe_container, probe_media
+
+
+# ----------------------------------------------------------------------
+# MP4
+# ----------------------------------------------------------------------
+
+def box(kind, *payload):
+    body = b''.join(payload)
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def full_box(kind, payload, version=0):
+    return box(kind, bytes([version, 0, 0, 0]), payload)
+
+
+def mp4_track(handler, entry, duration, timescale=1000):
+    stsd = full_box(b'stsd', struct.pack('>I', 1) + entry)
+    stsz = full_box(b'stsz', struct.pack('>III', 0, 1, 1000))
+    mdhd = full_box(b'mdhd', struct.pack('>IIII', 0, 0, timescale, int(duration * timescale)) + b'\0' * 4)
+    hdlr = full_box(b'hdlr', struct.pack('>I4s', 0, handler) + b'\0' * 12)
+    return box(b'trak', box(b'mdia', mdhd, hdlr, box(b'minf', box(b'stbl', stsd, stsz))))
+
+
+def avc1(width=1280, height=720, profile_idc=100):
+    avcc = box(b'avcC', bytes([1, profile_idc, 0, 31, 0xFF, 0xE0, 0]))
+    return box(b'avc1', b'\0' * 6 + struct.pack('>H', 1) + b'\0' * 16
+               + struct.pack('>HH', width, height) + b'\0' * 50, avcc)
+
+
+def mp4a(channels=2, sample_rate=44100):
+    return box(b'mp4a', b'\0' * 6 + struct.pack('>H', 1) + b'\0' * 8
+               + struct.pack('>HHHHI', channels, 16, 0, 0, sample_rate << 16))
+
+
+def mp4_file(duration=10.0, audio=True, faststart=True, mdat_size=100000):
+    """MP4 с moov в начале (faststart) или в конце, как пишет ffmpeg без +faststart"""
+    traks = mp4_track(b'vide', avc1(), duration)
+    if audio:
+        traks += mp4_track(b'soun', mp4a(), duration)
+    mvhd = full_box(b'mvhd', struct.pack('>IIII', 0, 0, 1000, int(duration * 1000)) + b'\0' * 80)
+    moov = box(b'moov', mvhd, traks)
+    ftyp = box(b'ftyp', b'isom', struct.pack('>I', 512), b'isomiso2avc1mp41')
+    mdat = box(b'mdat', b'\0' * mdat_size)
+    return ftyp + (moov + mdat if faststart else mdat + moov)
+
+
+# ----------------------------------------------------------------------
+# WebM
+# ----------------------------------------------------------------------
+
+def element(element_id, *payload):
+    body = b''.join(payload)
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+    return id_bytes + bytes([0x01]) + len(body).to_bytes(7, 'big') + body
+
+
+def webm_file(duration=10.0):
+    ebml = element(0x1A45DFA3, element(0x4282, b'webm'))
+    info = element(0x1549A966, element(0x2AD7B1, (1000000).to_bytes(3, 'big')),
+                   element(0x4489, struct.pack('>d', duration * 1000)))
+    video = element(0xAE, element(0x83, b'\x01'), element(0x86, b'V_VP9'),
+                    element(0xE0, element(0xB0, (1920).to_bytes(2, 'big')), element(0xBA, (1080).to_bytes(2, 'big'))))
+    audio = element(0xAE, element(0x83, b'\x02'), element(0x86, b'A_OPUS'),
+                    element(0xE1, element(0xB5, struct.pack('>d', 48000.0)), element(0x9F, b'\x02')))
+    tracks = element(0x1654AE6B, video, audio)
+    cluster = element(0x1F43B675, b'\0' * 1000)
+    return ebml + element(0x18538067, info, tracks, cluster)
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_faststart_mp4(tmp_path):
+    probe = probe_container(write(tmp_path, 'faststart.mp4', mp4_file()))
+
+    assert probe['duration'] == 10.0
+    video = first_stream(probe, 'video')
+    assert (video['codec_name'], video['profile'], video['pix_fmt']) == ('h264', 'High', 'yuv420p')
+    assert (video['width'], video['height']) == (1280, 720)
+    audio = first_stream(probe, 'audio')
+    assert (audio['codec_name'], audio['channels'], audio['sample_rate']) == ('aac', 2, 44100)
+
+
+def test_moov_at_end_matches_faststart(tmp_path):
+    faststart = probe_container(write(tmp_path, 'faststart.mp4', mp4_file()))
+    moov_at_end = probe_container(write(tmp_path, 'end.mp4', mp4_file(faststart=False)))
+
+    assert moov_at_end['streams'] == faststart['streams']
+    assert moov_at_end['duration'] == faststart['duration']
+
+
+def test_video_only_mp4_has_no_audio(tmp_path):
+    probe = probe_container(write(tmp_path, 'video.mp4', mp4_file(audio=False)))
+
+    assert first_stream(probe, 'video') is not None
+    assert first_stream(probe, 'audio') is None
+
+
+def test_truncated_mp4_is_not_recognized(tmp_path):
+    # Загрузка оборвалась до конца moov — заголовок не разбираем, а не угадываем
+    data = mp4_file(faststart=False)
+    assert probe_container(write(tmp_path, 'cut.mp4', data[:-50])) is None
+    assert probe_container(write(tmp_path, 'no_moov.mp4', data[:len(data) // 2])) is None
+    # Без ffprobe/ffmpeg probe_media тоже возвращает None, а не исключение
+    assert probe_media(str(tmp_path / 'cut.mp4'), str(tmp_path / 'no-ffprobe'), str(tmp_path / 'no-ffmpeg')) is None
+
+
+def test_webm(tmp_path):
+    probe = probe_container(write(tmp_path, 'clip.webm', webm_file()))
+
+    assert probe['duration'] == 10.0
+    video = first_stream(probe, 'video')
+    assert (video['codec_name'], video['width'], video['height']) == ('vp9', 1920, 1080)
+    audio = first_stream(probe, 'audio')
+    assert (audio['codec_name'], audio['channels'], audio['sample_rate']) == ('opus', 2, 48000)
+
+
+def test_header_probe_is_sub_millisecond(tmp_path):
+    # moov в конце большого файла: читаются только заголовки боксов и сам moov
+    path = write(tmp_path, 'large.mp4', mp4_file(faststart=False, mdat_size=8 * 1024 * 1024))
+    probe_container(path)
+    runs = 50
+    started = time.perf_counter()
+    for _ in range(runs):
+        probe_container(path)
+    assert (time.perf_counter() - started) / runs < 0.001
@@ -0,0 +1,60 @@
+"""
+Проверки дискового кэша информации о видео (без сети)
+"""
+
+import json
+import time
+
+from metadata_cache import MetadataCache
+
+URL = 'https://example.com/videos/clip.mp4'
+
+
+def video_info(video_id='clip', expire=None):
+    url = 'https://cdn.example.com/clip.mp4' + (f'?expire={expire}' if expire else '')
+    return {'_type': 'video', 'id': video_id, 'extractor_key': 'Generic', 'title': 'Клип',
+            'formats': [{'format_id': '18', 'url': url}]}
+
+
+def cache_files(cache):
+    return sorted(path.name for path in cache.cache_dir.glob('*.json'))
+
+
+def test_put_writes_entry_once_and_aliases_url(tmp_path):
+    cache = MetadataCache(tmp_path)
+    cache.put(URL, video_info())
+
+    files = cache_files(cache)
+    assert files == sorted(['Generic_clip.json', f'{cache.key_for_url(URL)}.json'])
+    alias = json.loads((tmp_path / f'{cache.key_for_url(URL)}.json').read_text(encoding='utf-8'))
+    assert alias == {'alias': 'Generic_clip'}
+    assert cache.get(URL)['title'] == 'Клип'
+    assert cache.stats()['hits'] == 1
+
+
+def test_invalidate_removes_url_and_video_key(tmp_path):
+    cache = MetadataCache(tmp_path)
+    cache.put(URL, video_info())
+    cache.invalidate(URL)
+
+    assert cache_files(cache) == []
+    assert cache.get(URL) is None
+
+
+def test_expired_entry_is_a_miss(tmp_path):
+    cache = MetadataCache(tmp_path, expire_margin=0)
+    cache.put(URL, video_info(expire=int(time.time()) - 10))
+
+    assert cache.get(URL) is None
+    assert cache.stats()['expired'] == 1
+    assert cache_files(cache) == []
+
+
+def test_eviction_only_over_budget(tmp_path):
+    cache = MetadataCache(tmp_path, max_entries=4)
+    for n in range(4):
+        cache.put(f'https://example.com/v{n}.mp4', video_info(f'v{n}'))
+    # 4 записи и 4 ссылки: вытеснение держит в папке не больше max_entries файлов
+    assert len(cache_files(cache)) <= 4
+    assert cache.stats()['evictions'] >= 4
+    assert cache.get('https://example.com/v3.mp4') is not None
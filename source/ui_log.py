@@ -0,0 +1,102 @@
+"""
+Потокобезопасный лог для Tk-окна.
+
+Сообщения из любых потоков складываются в очередь и выводятся в текстовое
+поле пачками по таймеру root.after, в потоке Tk. В поле хранится не больше
+max_lines последних строк; полный лог можно параллельно писать в файл.
+"""
+
+import queue
+import tkinter as tk
+
+
+class UILogPump:
+    """Очередь сообщений лога с периодической выгрузкой в tk.Text"""
+
+    def __init__(self, root, text_widget, max_lines=1000, interval_ms=100, log_file=None):
+        self.root = root
+        self.text_widget = text_widget
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+
+        self._queue = queue.SimpleQueue()
+        self._line_count = 0
+        self._file = None
+        self._running = False
+        if log_file:
+            self.set_log_file(log_file)
+
+    def write(self, message):
+        """Добавить сообщение (можно вызывать из любого потока)"""
+        self._queue.put(str(message))
+
+    def start(self):
+        """Запустить периодическую выгрузку"""
+        if not self._running:
+            self._running = True
+            self.root.after(self.interval_ms, self._drain)
+
+    def stop(self):
+        """Остановить выгрузку и закрыть файл лога"""
+        self._running = False
+        self._drain_once()
+        self.set_log_file(None)
+
+    def set_log_file(self, path):
+        """Писать полный лог в файл (None — перестать)"""
+        if self._file:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+        if path:
+            try:
+                self._file = open(path, 'a', encoding='utf-8')
+            except OSError as e:
+                self.write(f"⚠️ Не удалось открыть файл лога: {e}")
+
+    def clear(self):
+        """Очистить видимый лог"""
+        self.text_widget.delete('1.0', tk.END)
+        self._line_count = 0
+
+    def _drain(self):
+        if not self._running:
+            return
+        try:
+            self._drain_once()
+        finally:
+            self.root.after(self.interval_ms, self._drain)
+
+    def _drain_once(self):
+        """Забрать всё накопившееся и вывести одной вставкой"""
+        lines = []
+        while True:
+            try:
+                lines.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not lines:
+            return
+
+        if self._file:
+            try:
+                self._file.write('\n'.join(lines) + '\n')
+                self._file.flush()
+            except OSError:
+                pass
+
+        # В поле нужны только последние max_lines строк
+        shown = lines[-self.max_lines:]
+        try:
+            self.text_widget.insert(tk.END, '\n'.join(shown) + '\n')
+            self._line_count += sum(line.count('\n') + 1 for line in shown)
+            excess = self._line_count - self.max_lines
+            if excess > 0:
+                self.text_widget.delete('1.0', f'{excess + 1}.0')
+                self._line_count = self.max_lines
+            self.text_widget.see(tk.END)
+        except tk.TclError:
+            # Окно уже закрыто
+            pass
@@ -0,0 +1,160 @@
+"""
+Долгоживущие экземпляры yt-dlp.
+
+Создание YoutubeDL занимает около 0.1 с (разбор настроек, список
+экстракторов), и у каждого экземпляра свои соединения. Сессия держит пул
+готовых экземпляров с общими cookies: вызов берёт свободный экземпляр,
+накладывает на него свои настройки (outtmpl, format, обработчики
+прогресса) и по окончании возвращает исходные. Соединения keep-alive и
+кэши экстракторов (например, разобранный код плеера YouTube) переживают
+этапы одного задания и переходят к следующим заданиям.
+
+Экземпляр, который нужен дольше блока with (через него лениво читаются
+страницы плейлиста), отсоединяется от пула (detach): он сохраняет
+настройки вызова, в пул не возвращается и закрывается владельцем.
+"""
+
+import contextlib
+import threading
+
+import yt_dlp
+
+BASE_OPTIONS = {'quiet': True, 'no_warnings': True}
+# Настройки, которые yt-dlp читает только при создании экземпляра (сеть, cookies,
+# постпроцессоры): вызов с ними получает отдельный временный экземпляр
+FIXED_OPTIONS = (
+    'proxy', 'geo_verification_proxy', 'source_address', 'socket_timeout', 'http_headers',
+    'nocheckcertificate', 'legacyserverconnect', 'client_certificate', 'impersonate',
+    'cookiefile', 'cookiesfrombrowser', 'postprocessors', 'logger', 'paths', 'download_archive',
+)
+
+_default_session = None
+_default_lock = threading.Lock()
+
+
+def default_session():
+    """Сессия, общая для всех движков процесса"""
+    global _default_session
+    with _default_lock:
+        if _default_session is None:
+            _default_session = YDLSession()
+        return _default_session
+
+
+class YDLSession:
+    """Пул экземпляров YoutubeDL с общими cookies и наложением настроек на вызов"""
+
+    def __init__(self, options=None, max_idle=4):
+        self.options = {**BASE_OPTIONS, **(options or {})}
+        self.max_idle = max_idle
+        self._idle = []
+        self._detached = set()
+        self._lock = threading.Lock()
+        self._cookiejar = None
+        self._closed = False
+        self.created = 0
+        self.reused = 0
+
+    def _create(self):
+        ydl = yt_dlp.YoutubeDL(dict(self.options))
+        with self._lock:
+            if self._cookiejar is None:
+                self._cookiejar = ydl.cookiejar
+            else:
+                # cookiejar у YoutubeDL — cached_property: подставляем общий до первого запроса
+                ydl.__dict__['cookiejar'] = self._cookiejar
+            self.created += 1
+        return ydl
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+        return self._create()
+
+    def _checkin(self, ydl):
+        with self._lock:
+            if not self._closed and len(self._idle) < self.max_idle:
+                self._idle.append(ydl)
+                return
+        ydl.close()
+
+    @staticmethod
+    def _apply(ydl, options):
+        """Наложить настройки вызова; вернуть то, что нужно восстановить"""
+        saved = (ydl.params, ydl.format_selector, ydl._progress_hooks,
+                 ydl._postprocessor_hooks, ydl._post_hooks)
+        params = dict(ydl.params)
+        params.update(options)
+        if isinstance(params.get('outtmpl'), dict):
+            params['outtmpl'] = dict(params['outtmpl'])
+        ydl.params = params
+        if 'outtmpl' in options:
+            ydl._parse_outtmpl()
+        if 'format' in options:
+            fmt = options['format']
+            ydl.format_selector = fmt if fmt in (None, '-') or callable(fmt) else ydl.build_format_selector(fmt)
+        ydl._progress_hooks = list(options.get('progress_hooks') or ())
+        ydl._postprocessor_hooks = list(options.get('postprocessor_hooks') or ())
+        ydl._post_hooks = list(options.get('post_hooks') or ())
+        ydl._download_retcode = 0
+        return saved
+
+    @staticmethod
+    def _restore(ydl, saved):
+        (ydl.params, ydl.format_selector, ydl._progress_hooks,
+         ydl._postprocessor_hooks, ydl._post_hooks) = saved
+
+    def detach(self, ydl):
+        """Не возвращать экземпляр в пул по выходе из use(): его закроет владелец"""
+        with self._lock:
+            self._detached.add(id(ydl))
+
+    def _take_detached(self, ydl):
+        with self._lock:
+            if id(ydl) in self._detached:
+                self._detached.discard(id(ydl))
+                return True
+            return False
+
+    @contextlib.contextmanager
+    def use(self, options=None):
+        """Экземпляр YoutubeDL с настройками options поверх общих — на время блока with"""
+        options = dict(options or {})
+        if self._closed or any(key in FIXED_OPTIONS for key in options):
+            ydl = yt_dlp.YoutubeDL({**self.options, **options})
+            try:
+                yield ydl
+            finally:
+                if not self._take_detached(ydl):
+                    ydl.close()
+            return
+
+        ydl = self._checkout()
+        saved = None
+        try:
+            saved = self._apply(ydl, options)
+            yield ydl
+        finally:
+            if self._take_detached(ydl):
+                # Настройки вызова остаются: с ними экземпляр и будет использоваться дальше
+                pass
+            elif saved is not None:
+                self._restore(ydl, saved)
+                self._checkin(ydl)
+            else:
+                ydl.close()
+
+    def stats(self):
+        """Сколько экземпляров создано и сколько раз взят готовый"""
+        with self._lock:
+            return {'created': self.created, 'reused': self.reused, 'idle': len(self._idle)}
+
+    def close(self):
+        """Закрыть все свободные экземпляры и их соединения"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for ydl in idle:
+            ydl.close()
@@ -1,51 +1,69 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import yt_dlp
 import os
-import threading
 import subprocess
 import platform
-import hashlib
-import time
-import shutil
+import threading
 from pathlib import Path
 
+from bandwidth import BandwidthScheduler, PRIORITY_NAMES, format_rate, parse_rate
+from downloader_engine import DownloadEngine, analyze_error, is_playlist_info
+from download_archive import DownloadArchive
+from download_queue import DownloadJob, DownloadQueue
+from filename_index import FilenameIndex
+from fragment_concurrency import FragmentConcurrency
+from metadata_cache import MetadataCache
+from progress_model import format_progress
+from resume_journal import journal_path_for
+from ui_log import UILogPump
+
 class YouTubeDownloader:
+    # Как часто обновлять прогресс заданий в окне
+    PROGRESS_INTERVAL_MS = 250
+    # Пауза после вставки URL перед автоматическим получением информации
+    INFO_DEBOUNCE_MS = 500
+
     def __init__(self, root):
         self.root = root
         self.root.title("YouTube Downloader")
-        self.root.geometry("600x400")
+        self.root.geometry("640x600")
         self.root.resizable(False, False)
         
         # Переменные
         self.download_path = tk.StringVar()
         self.url = tk.StringVar()
-        self.is_downloading = False
-        self.available_formats = []
         self.selected_format = tk.StringVar()
-        self.video_info = None
-        
-        # Переменные для отслеживания ошибок и возобновления
-        self.errors_count = 0
-        self.temp_file_size = 0
-        self.current_temp_file = None
-        self.download_cancelled = False
-        self.download_thread = None
-        self.is_resuming = False
+        self.max_workers = tk.IntVar(value=2)
+        self.pipe_audio = tk.BooleanVar(value=False)
+        self.profile_jobs = tk.BooleanVar(value=False)
+        self.save_log = tk.BooleanVar(value=False)
+        self.rate_limit = tk.StringVar(value="")
+        self.info_url = None
+        # Фоновое получение информации: номер последнего запроса и отложенный запуск
+        self.info_request_id = 0
+        self.info_after_id = None
+        # Вопросы о повторном скачивании из рабочих потоков задаются по одному
+        self.confirm_lock = threading.Lock()
+
+        # Кэш информации о видео, общий для всех заданий
+        self.metadata_cache = MetadataCache()
+        # Архив скачанных видео: повторно они не качаются без подтверждения
+        self.archive = DownloadArchive()
+        # Индекс имён файлов в папках загрузки: уникальные имена без обхода диска
+        self.filename_index = FilenameIndex()
+        # Подбор числа параллельных фрагментов DASH/HLS с общим лимитом соединений
+        self.fragment_controller = FragmentConcurrency()
+        # Общий лимит скорости всех заданий
+        self.bandwidth = BandwidthScheduler()
+
+        # Движок для получения информации о видео (вся логика конвейера — без Tk)
+        self.engine = DownloadEngine(log=self.log_message,
+                                     confirm_redownload=self.confirm_redownload,
+                                     metadata_cache=self.metadata_cache)
 
-        # Пути к ffmpeg/ffprobe (автодетект)
-        self.ffmpeg_path = None
-        self.ffprobe_path = None
-        
-        # Отслеживание этапов
-        self.current_stage = 0
-        self.total_stages = 4
-        self.stage_names = [
-            "Скачивание основного видео потока",
-            "Скачивание дополнительного потока", 
-            "Получение звуковой дорожки",
-            "Объединение звуковой дорожки с основным видео потоком"
-        ]
+        # Очередь заданий: у каждого задания свой движок
+        self.queue = DownloadQueue(self.create_job_engine, max_workers=self.max_workers.get(),
+                                   per_host_limit=2, on_update=self.on_job_update)
         
         # Установить папку Downloads по умолчанию
         self.set_default_download_path()
@@ -57,7 +75,7 @@ class YouTubeDownloader:
         self.check_for_temp_files()
 
         # Определить пути к ffmpeg/ffprobe
-        self.detect_ffmpeg_paths()
+        self.engine.detect_ffmpeg_paths()
         
     def set_default_download_path(self):
         """Установить папку Downloads по умолчанию"""
@@ -66,62 +84,21 @@ class YouTubeDownloader:
         self.download_path.set(str(downloads_path))
         
     def check_for_temp_files(self):
-        """Проверить наличие временных файлов при запуске"""
-        try:
-            download_dir = Path(self.download_path.get())
-            if not download_dir.exists():
-                return
-                
-            # Ищем временные файлы
-            temp_files = list(download_dir.glob("temp_*"))
-            if temp_files:
-                # Найти самый новый временный файл
-                latest_temp = max(temp_files, key=os.path.getmtime)
-                self.current_temp_file = str(latest_temp)
-                self.temp_file_size = os.path.getsize(latest_temp)
-                self.log_message(f"🔄 Найден временный файл: {latest_temp.name}")
-                self.log_message("Можно возобновить загрузку")
-        except Exception as e:
-            self.log_message(f"⚠️ Ошибка проверки временных файлов: {e}")
-
-    def detect_ffmpeg_paths(self):
-        """Автоматически определить пути к ffmpeg/ffprobe и сохранить в self.ffmpeg_path/self.ffprobe_path"""
-        try:
-            # 1) Если доступны в PATH — используем их
-            import shutil as _sh
-            ff = _sh.which('ffmpeg')
-            fp = _sh.which('ffprobe')
-            if ff:
-                self.ffmpeg_path = ff
-            if fp:
-                self.ffprobe_path = fp
-
-            # 2) WinGet путь Gyan.FFmpeg (частый случай)
-            if platform.system() == 'Windows' and (not self.ffmpeg_path or not self.ffprobe_path):
-                base = os.path.join(os.getenv('LOCALAPPDATA') or '', 'Microsoft', 'WinGet', 'Packages')
-                try:
-                    # Ищем каталог Gyan.FFmpeg*
-                    for name in os.listdir(base):
-                        if name.lower().startswith('gyan.ffmpeg'):
-                            bin_dir = os.path.join(base, name, 'ffmpeg-8.0-full_build', 'bin')
-                            ff_cand = os.path.join(bin_dir, 'ffmpeg.exe')
-                            fp_cand = os.path.join(bin_dir, 'ffprobe.exe')
-                            if os.path.exists(ff_cand):
-                                self.ffmpeg_path = self.ffmpeg_path or ff_cand
-                            if os.path.exists(fp_cand):
-                                self.ffprobe_path = self.ffprobe_path or fp_cand
-                except Exception:
-                    pass
-
-            # Лог
-            if self.ffmpeg_path:
-                self.log_message(f"FFmpeg: {self.ffmpeg_path}")
-            else:
-                self.log_message("FFmpeg не найден в PATH. Можно указать путь вручную.")
-            if self.ffprobe_path:
-                self.log_message(f"FFprobe: {self.ffprobe_path}")
-        except Exception as e:
-            self.log_message(f"⚠️ Автоопределение FFmpeg не удалось: {e}")
+        """Найти прерванные загрузки при запуске и предложить их возобновить"""
+        self.engine.download_path = self.download_path.get()
+        journals = self.engine.check_for_temp_files()
+        if not journals:
+            return
+        if messagebox.askyesno("Прерванные загрузки",
+                               f"Найдено прерванных загрузок: {len(journals)}.\n\nВозобновить их?",
+                               icon='question'):
+            for journal in journals:
+                data = journal.data
+                job = self.queue.add(data['url'], format_id=data.get('format_id'),
+                                     download_path=data.get('download_path') or self.download_path.get(),
+                                     options=self.job_options(),
+                                     title=data.get('title'))
+                self.log_message(f"🔄 [{job.id}] Возобновление: {job.title}")
         
     def open_download_folder(self):
         """Открыть папку с загруженными файлами"""
@@ -181,7 +158,7 @@ class YouTubeDownloader:
                                 command=dialog.destroy)
         close_button.pack(side=tk.LEFT)
         
-    def show_error_dialog(self, error_msg, temp_file_path=None):
+    def show_error_dialog(self, error_msg, temp_file_path=None, job=None):
         """Показать диалог с ошибкой и рекомендациями"""
         dialog = tk.Toplevel(self.root)
         dialog.title("Ошибка загрузки")
@@ -239,189 +216,40 @@ class YouTubeDownloader:
         
         if temp_file_path and os.path.exists(temp_file_path):
             resume_button = ttk.Button(button_frame, text="Возобновить", 
-                                     command=lambda: [self.resume_download(), dialog.destroy()])
+                                     command=lambda: [self.resume_download(job), dialog.destroy()])
             resume_button.pack(side=tk.LEFT, padx=(0, 10))
             
             delete_button = ttk.Button(button_frame, text="Прервать и удалить", 
-                                     command=lambda: [self.delete_temp_file(temp_file_path), dialog.destroy()])
+                                     command=lambda: [self.delete_temp_file(temp_file_path, job), dialog.destroy()])
             delete_button.pack(side=tk.LEFT, padx=(0, 10))
         
         cancel_button = ttk.Button(button_frame, text="Прервать", 
-                                 command=lambda: [self.cancel_download(), dialog.destroy()])
+                                 command=lambda: [self.cancel_download(job), dialog.destroy()])
         cancel_button.pack(side=tk.LEFT, padx=(0, 10))
         
         close_button = ttk.Button(button_frame, text="Закрыть", 
                                 command=dialog.destroy)
         close_button.pack(side=tk.LEFT)
-        
+                
     def analyze_error(self, error_msg):
         """Анализировать ошибку и дать рекомендации"""
-        error_lower = error_msg.lower()
-        
-        if any(keyword in error_lower for keyword in ['connection', 'network', 'timeout', 'unreachable']):
-            return """• Проверьте подключение к интернету
-• Попробуйте перезапустить роутер
-• Проверьте настройки брандмауэра
-• Попробуйте использовать VPN"""
-        
-        elif any(keyword in error_lower for keyword in ['disk', 'space', 'no space', 'full']):
-            return """• Освободите место на диске
-• Удалите ненужные файлы
-• Выберите другую папку для сохранения
-• Очистите корзину"""
-        
-        elif any(keyword in error_lower for keyword in ['permission', 'access denied', 'denied']):
-            return """• Запустите программу от имени администратора
-• Проверьте права доступа к папке
-• Выберите другую папку для сохранения
-• Закройте другие программы, использующие файл"""
-        
-        elif any(keyword in error_lower for keyword in ['format', 'codec', 'unsupported']):
-            return """• Попробуйте другое разрешение видео
-• Обновите yt-dlp: pip install --upgrade yt-dlp
-• Проверьте, поддерживается ли формат вашей системой"""
-        
-        elif any(keyword in error_lower for keyword in ['url', 'video', 'not found', 'private']):
-            return """• Проверьте правильность URL
-• Убедитесь, что видео не приватное
-• Попробуйте другой URL
-• Проверьте, доступно ли видео в вашем регионе"""
-        
-        else:
-            return f"• Попробуйте перезапустить программу\n• Обновите yt-dlp: pip install --upgrade yt-dlp\n• Проверьте логи для подробной информации\n• Обратитесь за помощью с текстом ошибки"
+        return analyze_error(error_msg)
             
-    def delete_temp_file(self, temp_file_path):
+    def delete_temp_file(self, temp_file_path, job=None):
         """Удалить временный файл"""
         try:
             if os.path.exists(temp_file_path):
                 os.remove(temp_file_path)
                 self.log_message("🗑️ Временный файл удален")
-            self.current_temp_file = None
-            self.update_button_states("idle")
+            # Без файла журнал возобновления больше не нужен
+            journal_path = journal_path_for(temp_file_path)
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+            if job:
+                job.temp_file = None
+            self.update_button_states()
         except Exception as e:
             self.log_message(f"❌ Ошибка при удалении временного файла: {e}")
-            
-    def download_audio_separately(self, url, output_path):
-        """Скачать только аудио"""
-        try:
-            base_no_ext = os.path.splitext(output_path)[0]
-            ydl_outtmpl = base_no_ext + ".%(ext)s"
-
-            if self.has_ffmpeg():
-                ydl_opts = {
-                    'format': 'bestaudio/best',
-                    'outtmpl': ydl_outtmpl,
-                    'quiet': True,
-                    'no_warnings': True,
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'aac',
-                        'preferredquality': '192',
-                    }],
-                    **({'ffmpeg_location': os.path.dirname(self.ffmpeg_path)} if self.ffmpeg_path else {}),
-                }
-            else:
-                # Без ffmpeg нельзя гарантировать m4a; попытаемся выбрать m4a, иначе любой bestaudio
-                ydl_opts = {
-                    'format': 'bestaudio[ext=m4a]/bestaudio',
-                    'outtmpl': ydl_outtmpl,
-                    'quiet': True,
-                    'no_warnings': True,
-                }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-
-            # Найти итоговый файл и переименовать в ожидаемый output_path
-            expected_m4a = base_no_ext + '.m4a'
-            if os.path.exists(expected_m4a):
-                if output_path != expected_m4a:
-                    try:
-                        if os.path.exists(output_path):
-                            os.remove(output_path)
-                    except Exception:
-                        pass
-                    os.replace(expected_m4a, output_path)
-                return True
-
-            # Если не вышло m4a, попробуем найти любой созданный аудио файл
-            for ext in ('.mp3', '.opus', '.webm', '.aac'):
-                candidate = base_no_ext + ext
-                if os.path.exists(candidate):
-                    # Если есть ffmpeg — перекодируем в m4a/aac как output_path
-                    if self.has_ffmpeg():
-                        try:
-                            import subprocess
-                            cmd = [(self.ffmpeg_path or 'ffmpeg'), '-y', '-i', candidate, '-c:a', 'aac', '-b:a', '192k', output_path]
-                            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                            try:
-                                os.remove(candidate)
-                            except Exception:
-                                pass
-                            return True
-                        except Exception as e:
-                            self.log_message(f"❌ Ошибка перекодирования аудио: {e}")
-                            return False
-                    else:
-                        # Без ffmpeg вернуть как есть (хотя объединение позже потребует ffmpeg)
-                        if output_path != candidate:
-                            os.replace(candidate, output_path)
-                        return True
-
-            return False
-        except Exception as e:
-            self.log_message(f"❌ Ошибка скачивания аудио: {e}")
-            return False
-
-    def extract_audio_from_video(self, video_path, audio_path):
-        """Извлечь аудио из видео файла в AAC (m4a)"""
-        try:
-            import subprocess
-            
-            cmd = [
-                (self.ffmpeg_path or 'ffmpeg'), '-y', '-i', video_path,
-                '-vn', '-c:a', 'aac', '-b:a', '192k',
-                audio_path
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
-            if result.returncode == 0:
-                return True
-            else:
-                self.log_message(f"❌ Ошибка ffmpeg: {result.stderr}")
-                return False
-                
-        except FileNotFoundError:
-            self.log_message("❌ FFmpeg не найден. Установите FFmpeg для извлечения аудио")
-            return False
-        except Exception as e:
-            self.log_message(f"❌ Ошибка извлечения аудио: {e}")
-            return False
-            
-    def merge_video_audio(self, video_path, audio_path, output_path):
-        """Объединить видео и аудио"""
-        try:
-            import subprocess
-            
-            cmd = [
-                (self.ffmpeg_path or 'ffmpeg'), '-y', '-i', video_path, '-i', audio_path,
-                '-c:v', 'copy', '-c:a', 'aac', '-b:a', '192k', '-shortest',
-                output_path
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
-            if result.returncode == 0:
-                return True
-            else:
-                self.log_message(f"❌ Ошибка объединения: {result.stderr}")
-                return False
-                
-        except FileNotFoundError:
-            self.log_message("❌ FFmpeg не найден. Установите FFmpeg для объединения")
-            return False
-        except Exception as e:
-            self.log_message(f"❌ Ошибка объединения: {e}")
-            return False
         
     def setup_ui(self):
         # Главный фрейм
@@ -493,245 +321,277 @@ class YouTubeDownloader:
                                            command=self.open_download_folder)
         self.open_folder_button.pack(side=tk.LEFT)
         
+        # Очередь заданий
+        queue_label = ttk.Label(main_frame, text="Очередь:")
+        queue_label.grid(row=5, column=0, sticky=tk.W, pady=(0, 5))
+        
+        workers_frame = ttk.Frame(main_frame)
+        workers_frame.grid(row=5, column=1, columnspan=2, sticky=tk.E, pady=(0, 5))
+        ttk.Label(workers_frame, text="Параллельно:").pack(side=tk.LEFT, padx=(0, 5))
+        workers_spin = ttk.Spinbox(workers_frame, from_=1, to=8, width=4, state="readonly",
+                                   textvariable=self.max_workers, command=self.change_max_workers)
+        workers_spin.pack(side=tk.LEFT)
+        pipe_check = ttk.Checkbutton(workers_frame, text="Аудио без временного файла",
+                                     variable=self.pipe_audio)
+        pipe_check.pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Label(workers_frame, text="Лимит скорости:").pack(side=tk.LEFT, padx=(10, 5))
+        rate_entry = ttk.Entry(workers_frame, textvariable=self.rate_limit, width=7)
+        rate_entry.pack(side=tk.LEFT)
+        rate_entry.bind('<Return>', lambda event: self.apply_rate_limit())
+        rate_entry.bind('<FocusOut>', lambda event: self.apply_rate_limit())
+        
+        self.jobs_tree = ttk.Treeview(main_frame, columns=("state", "title", "progress"),
+                                      show="headings", height=6)
+        self.jobs_tree.heading("state", text="Состояние")
+        self.jobs_tree.heading("title", text="Видео")
+        self.jobs_tree.heading("progress", text="Прогресс")
+        self.jobs_tree.column("state", width=110, stretch=False)
+        self.jobs_tree.column("title", width=250)
+        self.jobs_tree.column("progress", width=190, stretch=False)
+        self.jobs_tree.grid(row=6, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=5)
+        self.jobs_tree.bind('<<TreeviewSelect>>', lambda event: self.update_button_states())
+        
+        # Кнопки управления порядком очереди
+        order_frame = ttk.Frame(main_frame)
+        order_frame.grid(row=6, column=3, sticky=tk.N, pady=5, padx=(5, 0))
+        ttk.Button(order_frame, text="▲", width=3, command=lambda: self.move_job(-1)).pack(pady=(0, 5))
+        ttk.Button(order_frame, text="▼", width=3, command=lambda: self.move_job(1)).pack(pady=(0, 5))
+        ttk.Button(order_frame, text="⚡", width=3, command=self.toggle_job_priority).pack()
+        
         # Прогресс бар
-        self.progress = ttk.Progressbar(main_frame, mode='indeterminate')
-        self.progress.grid(row=5, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=10)
+        self.progress = ttk.Progressbar(main_frame, mode='determinate', maximum=100)
+        self.progress.grid(row=7, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=10)
         
         # Текстовое поле для логов
         log_label = ttk.Label(main_frame, text="Лог скачивания:")
-        log_label.grid(row=6, column=0, sticky=tk.W, pady=(10, 5))
+        log_label.grid(row=8, column=0, sticky=tk.W, pady=(10, 5))
+        
+        log_options_frame = ttk.Frame(main_frame)
+        log_options_frame.grid(row=8, column=1, columnspan=2, sticky=tk.E, pady=(10, 5))
+        profile_check = ttk.Checkbutton(log_options_frame, text="Профилировать задания",
+                                        variable=self.profile_jobs)
+        profile_check.pack(side=tk.LEFT, padx=(0, 10))
+        save_log_check = ttk.Checkbutton(log_options_frame, text="Сохранять полный лог в файл",
+                                         variable=self.save_log, command=self.toggle_log_file)
+        save_log_check.pack(side=tk.LEFT)
         
         self.log_text = tk.Text(main_frame, height=10, width=70, wrap=tk.WORD)
-        self.log_text.grid(row=7, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
+        self.log_text.grid(row=9, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
+        
+        # Лог выводится пачками в потоке Tk, в поле — только последние строки
+        self.log_pump = UILogPump(self.root, self.log_text, max_lines=1000, interval_ms=100)
+        self.log_pump.start()
+        
+        # Прогресс заданий опрашивается с постоянной частотой
+        self.root.after(self.PROGRESS_INTERVAL_MS, self.poll_progress)
         
         # Скроллбар для логов
         scrollbar = ttk.Scrollbar(main_frame, orient="vertical", command=self.log_text.yview)
-        scrollbar.grid(row=7, column=3, sticky=(tk.N, tk.S), pady=5)
+        scrollbar.grid(row=9, column=3, sticky=(tk.N, tk.S), pady=5)
         self.log_text.configure(yscrollcommand=scrollbar.set)
         
         # Настройка растягивания
         main_frame.columnconfigure(1, weight=1)
-        main_frame.rowconfigure(7, weight=1)
+        main_frame.rowconfigure(9, weight=1)
         self.root.columnconfigure(0, weight=1)
         self.root.rowconfigure(0, weight=1)
         
         # Обновить состояние кнопок при запуске
-        self.update_button_states("idle")
+        self.update_button_states()
         
     def browse_folder(self):
         """Открыть диалог выбора папки"""
         folder = filedialog.askdirectory(title="Выберите папку для сохранения видео")
         if folder:
             self.download_path.set(folder)
-            
+                        
     def log_message(self, message):
-        """Добавить сообщение в лог"""
-        try:
-            if hasattr(self, 'log_text') and self.log_text:
-                self.log_text.insert(tk.END, f"{message}\n")
-                self.log_text.see(tk.END)
-                self.root.update_idletasks()
-        except Exception:
-            # fail-safe: не падаем, если UI еще не готов
-            pass
-        
-    def get_video_info(self):
-        """Получить информацию о видео и доступные форматы"""
-        if not self.url.get().strip():
-            messagebox.showerror("Ошибка", "Пожалуйста, введите URL видео")
+        """Добавить сообщение в лог (можно вызывать из любого потока)"""
+        # fail-safe: до создания UI сообщения не выводятся
+        if hasattr(self, 'log_pump'):
+            self.log_pump.write(message)
+
+    def toggle_log_file(self):
+        """Включить/выключить запись полного лога в файл в папке загрузки"""
+        if self.save_log.get():
+            log_path = os.path.join(self.download_path.get(), "youtube_downloader.log")
+            self.log_pump.set_log_file(log_path)
+            self.log_message(f"Полный лог пишется в {log_path}")
+        else:
+            self.log_pump.set_log_file(None)
+        
+    def schedule_info_lookup(self):
+        """Получить информацию о вставленном URL после короткой паузы"""
+        if self.info_after_id:
+            self.root.after_cancel(self.info_after_id)
+        self.info_after_id = self.root.after(self.INFO_DEBOUNCE_MS,
+                                             lambda: self.get_video_info(auto=True))
+
+    def get_video_info(self, auto=False):
+        """Получить информацию о видео и доступные форматы (в фоновом потоке)"""
+        if self.info_after_id:
+            self.root.after_cancel(self.info_after_id)
+            self.info_after_id = None
+
+        url = self.url.get().strip()
+        if not url:
+            if not auto:
+                messagebox.showerror("Ошибка", "Пожалуйста, введите URL видео")
             return
-            
-        try:
-            self.log_message("Получение информации о видео...")
-            
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(self.url.get(), download=False)
-                self.video_info = info
-                
-                title = info.get('title', 'Неизвестное название')
-                duration = info.get('duration', 0)
-                self.log_message(f"Название: {title}")
-                self.log_message(f"Длительность: {duration // 60}:{duration % 60:02d}")
-                
-                # Получить доступные форматы
-                formats = info.get('formats', [])
-                video_formats = []
-                
-                for f in formats:
-                    # Показываем все видео-форматы (с аудио или без), чтобы расширить список разрешений
-                    if (f.get('vcodec') != 'none' and f.get('height')):
-                        height = f.get('height', 0)
-                        ext = f.get('ext', 'unknown')
-                        format_id = f.get('format_id', 'unknown')
-                        filesize = f.get('filesize', 0)
-                        
-                        if filesize:
-                            size_mb = filesize / (1024 * 1024)
-                            format_desc = f"{height}p ({ext}) - {size_mb:.1f}MB"
-                        else:
-                            format_desc = f"{height}p ({ext})"
-                            
-                        video_formats.append((format_desc, format_id))
-                
-                # Сортировать по разрешению (по убыванию)
-                video_formats.sort(key=lambda x: int(x[0].split('p')[0]), reverse=True)
-                
-                if video_formats:
-                    self.available_formats = video_formats
-                    format_names = [f[0] for f in video_formats]
-                    self.format_combo['values'] = format_names
-                    self.format_combo.set(format_names[0])  # Выбрать лучшее качество по умолчанию
-                    self.log_message(f"Найдено {len(format_names)} доступных форматов")
-                else:
-                    self.log_message("❌ Не удалось получить информацию о форматах")
-                    
-        except Exception as e:
-            error_msg = f"Ошибка при получении информации: {str(e)}"
+        if auto and (not url.startswith(('http://', 'https://')) or url == self.info_url):
+            return
+
+        # Новый запрос вытесняет предыдущий: результат старого будет отброшен
+        self.info_request_id += 1
+        request_id = self.info_request_id
+        self.format_combo['values'] = []
+        self.format_combo.set("Загрузка...")
+
+        engine = DownloadEngine(log=self.log_message, metadata_cache=self.metadata_cache)
+
+        def lookup():
+            try:
+                info = engine.get_video_info(url, allow_playlist=True)
+                error = None
+            except Exception as e:
+                info = None
+                error = str(e)
+            finally:
+                # Записи плейлиста здесь не перебираются: их прочитает задание очереди
+                engine.close_playlist()
+            self.root.after(0, lambda: self.on_video_info(request_id, url, engine, info, error, auto))
+
+        threading.Thread(target=lookup, daemon=True).start()
+
+    def on_video_info(self, request_id, url, engine, info, error, auto):
+        """Показать результат получения информации (в потоке Tk)"""
+        if request_id != self.info_request_id:
+            # За это время был запрошен другой URL
+            return
+
+        if error:
+            self.format_combo.set("")
+            error_msg = f"Ошибка при получении информации: {error}"
             self.log_message(f"❌ {error_msg}")
-            messagebox.showerror("Ошибка", error_msg)
-            
-    def generate_file_hash(self, url, format_id, title):
-        """Создать хеш для уникального имени временного файла"""
-        content = f"{url}_{format_id}_{title}_{int(time.time())}"
-        return hashlib.md5(content.encode()).hexdigest()[:12]
-        
-    def get_unique_filename(self, title, extension, is_redownload=False):
-        """Получить уникальное имя файла"""
-        download_dir = Path(self.download_path.get())
-        if not download_dir.exists():
-            download_dir.mkdir(parents=True, exist_ok=True)
-            
-        base_name = title
-        counter = 1
-        
-        if is_redownload:
-            # При перескачивании добавляем _copy_
-            while True:
-                if counter == 1:
-                    filename = f"{base_name}_copy.{extension}"
-                else:
-                    filename = f"{base_name}_copy_{counter}.{extension}"
-                    
-                file_path = download_dir / filename
-                if not file_path.exists():
-                    return str(file_path)
-                counter += 1
+            if not auto:
+                messagebox.showerror("Ошибка", error_msg)
+            return
+
+        self.info_url = url
+        if is_playlist_info(info):
+            # Видео плейлиста добавятся в очередь по мере чтения списка, формат — лучший
+            self.engine.video_info = None
+            self.engine.available_formats = []
+            self.format_combo['values'] = []
+            self.format_combo.set("Плейлист: лучшее качество")
+            return
+
+        self.engine.video_info = engine.video_info
+        self.engine.available_formats = engine.available_formats
+        format_names = [f[0] for f in engine.available_formats]
+        self.format_combo['values'] = format_names
+        self.format_combo.set(format_names[0] if format_names else "")  # Лучшее качество по умолчанию
+
+    def confirm_redownload(self, existing_file):
+        """Спросить пользователя, качать ли заново существующий файл (или видео из архива).
+
+        Вызывается из рабочих потоков очереди: диалог показывается в потоке Tk,
+        а рабочий поток ждёт ответа.
+        """
+        if threading.current_thread() is threading.main_thread():
+            return self.ask_redownload(existing_file)
+        with self.confirm_lock:
+            answered = threading.Event()
+            answer = []
+
+            def ask():
+                try:
+                    answer.append(self.ask_redownload(existing_file))
+                finally:
+                    answered.set()
+
+            self.root.after(0, ask)
+            answered.wait()
+        return bool(answer and answer[0])
+
+    def ask_redownload(self, existing_file):
+        """Диалог «Скачать заново?» (в потоке Tk)"""
+        if isinstance(existing_file, Path):
+            text = f"Файл с похожим названием уже существует:\n{existing_file.name}\n\nСкачать заново?"
         else:
-            # Обычное скачивание
-            while True:
-                if counter == 1:
-                    filename = f"{base_name}.{extension}"
-                else:
-                    filename = f"{base_name}_{counter}.{extension}"
-                    
-                file_path = download_dir / filename
-                if not file_path.exists():
-                    return str(file_path)
-                counter += 1
-                
-    def check_existing_file(self, title):
-        """Проверить, существует ли уже файл с таким названием"""
-        download_dir = Path(self.download_path.get())
-        if not download_dir.exists():
+            text = f"Это видео уже скачивалось:\n{existing_file}\n\nСкачать заново?"
+        result = messagebox.askyesno("Файл уже существует", text, icon='question')
+        if not result:
+            self.log_message("Скачивание отменено пользователем")
+        return result
+        
+    def selected_job(self):
+        """Выбранное в списке задание"""
+        selection = self.jobs_tree.selection()
+        if not selection:
             return None
-            
-        # Ищем файлы с похожим названием
-        for ext in ['mp4', 'webm', 'mkv', 'avi']:
-            pattern = f"*{title}*.{ext}"
-            existing_files = list(download_dir.glob(pattern))
-            if existing_files:
-                return existing_files[0]
-        return None
-        
-    def reset_download_state(self):
-        """Сбросить состояние загрузки"""
-        self.errors_count = 0
-        self.temp_file_size = 0
-        self.current_temp_file = None
-        self.download_cancelled = False
-        
-    def check_temp_file_progress(self, temp_path):
-        """Проверить прогресс временного файла"""
-        if not os.path.exists(temp_path):
-            return False
-            
-        current_size = os.path.getsize(temp_path)
-        if current_size > self.temp_file_size:
-            self.temp_file_size = current_size
-            self.errors_count = 0  # Сброс счетчика ошибок при прогрессе
-            return True
-        return False
-        
-    def cancel_download(self):
-        """Прервать загрузку"""
-        self.download_cancelled = True
-        self.is_downloading = False
-        self.log_message("⏹️ Загрузка прервана пользователем")
-        self.update_button_states("cancelled")
-        
-    def resume_download(self):
-        """Возобновить загрузку"""
-        # проверяем также вариант с .part
-        real_temp = self.resolve_existing_temp_variant(self.current_temp_file) if self.current_temp_file else None
-        if real_temp and os.path.exists(real_temp):
-            self.log_message("🔄 Возобновление загрузки...")
-            self.is_resuming = True
-            self.start_download()
+        return self.queue.get(int(selection[0]))
+        
+    def cancel_download(self, job=None):
+        """Прервать выбранное задание (или все активные, если ничего не выбрано)"""
+        job = job or self.selected_job()
+        if job:
+            if self.queue.cancel(job.id):
+                self.log_message(f"⏹️ [{job.id}] Загрузка прервана пользователем")
         else:
-            messagebox.showerror("Ошибка", "Временный файл не найден для возобновления")
+            self.queue.cancel_all()
+            self.log_message("⏹️ Загрузки прерваны пользователем")
+        self.update_button_states()
+        
+    def resume_download(self, job=None):
+        """Вернуть в очередь выбранное (или все) прерванные и неудачные задания"""
+        job = job or self.selected_job()
+        jobs = [job] if job else self.queue.jobs()
+        for j in jobs:
+            if self.queue.retry(j.id):
+                self.log_message(f"🔄 [{j.id}] Возобновление загрузки...")
+        self.update_button_states()
+        
+    def move_job(self, offset):
+        """Переместить выбранное задание в очереди"""
+        job = self.selected_job()
+        if job and self.queue.move(job.id, offset):
+            self.refresh_jobs()
+            
+    def toggle_job_priority(self):
+        """Дать выбранному заданию высокий приоритет в лимите скорости (или снять его)"""
+        job = self.selected_job()
+        if not job:
+            return
+        priority = 0 if job.priority > 0 else PRIORITY_NAMES['high']
+        self.queue.set_priority(job.id, priority)
+        self.log_message(f"[{job.id}] Приоритет: {'высокий' if priority > 0 else 'обычный'}")
+
+    def apply_rate_limit(self):
+        """Применить лимит скорости из поля ввода (пусто или 0 — без ограничения)"""
+        try:
+            rate = parse_rate(self.rate_limit.get())
+        except ValueError:
+            # Без диалога: поле проверяется и при потере фокуса
+            self.log_message("⚠️ Некорректный лимит скорости — укажите, например, 500K или 2M")
+            return
+        if rate != self.bandwidth.current_rate():
+            self.bandwidth.set_rate(rate)
+            self.log_message(f"Лимит скорости: {format_rate(rate)}")
+
+    def change_max_workers(self):
+        """Применить новое число параллельных загрузок"""
+        self.queue.set_max_workers(self.max_workers.get())
+        self.log_message(f"Параллельных загрузок: {self.max_workers.get()}")
             
-    def update_button_states(self, state):
+    def update_button_states(self):
         """Обновить состояние кнопок"""
-        if state == "downloading":
-            self.download_button.config(state="disabled")
-            self.cancel_button.config(state="normal")
-            self.resume_button.config(state="disabled")
-        elif state == "cancelled":
-            self.download_button.config(state="normal")
-            self.cancel_button.config(state="disabled")
-            self.resume_button.config(state="normal" if self.current_temp_file else "disabled")
-        elif state == "idle":
-            self.download_button.config(state="normal")
-            self.cancel_button.config(state="disabled")
-            self.resume_button.config(state="disabled")
-        elif state == "error":
-            self.download_button.config(state="normal")
-            self.cancel_button.config(state="disabled")
-            self.resume_button.config(state="normal" if self.current_temp_file else "disabled")
-        
-    def progress_hook(self, d):
-        """Обработчик прогресса скачивания"""
-        # Корректная отмена загрузки
-        if getattr(self, 'download_cancelled', False):
-            raise yt_dlp.utils.DownloadError('Отменено пользователем')
-        if d['status'] == 'downloading':
-            if 'total_bytes' in d and d['total_bytes']:
-                percent = (d['downloaded_bytes'] / d['total_bytes']) * 100
-                self.log_message(f"Скачивание: {percent:.1f}%")
-            elif 'total_bytes_estimate' in d and d['total_bytes_estimate']:
-                percent = (d['downloaded_bytes'] / d['total_bytes_estimate']) * 100
-                self.log_message(f"Скачивание: {percent:.1f}%")
-        elif d['status'] == 'finished':
-            self.log_message("Скачивание завершено!")
-            
-    def start_stage(self, stage_num, stage_name):
-        """Начать новый этап"""
-        self.current_stage = stage_num
-        self.log_message(f"Этап {stage_num}/{self.total_stages}:")
-        self.log_message(f"{stage_name}.")
-        
-    def log_stage_progress(self, progress_text):
-        """Логировать прогресс текущего этапа"""
-        self.log_message(progress_text)
-        
-    def finish_stage(self, stage_num, completion_text):
-        """Завершить этап"""
-        self.log_message(completion_text)
+        jobs = self.queue.jobs()
+        job = self.selected_job()
+        has_active = any(not j.is_finished for j in jobs)
+        can_retry = any(j.state in (DownloadJob.FAILED, DownloadJob.CANCELLED) for j in ([job] if job else jobs))
+        self.cancel_button.config(state="normal" if has_active else "disabled")
+        self.resume_button.config(state="normal" if can_retry else "disabled")
         
     def paste_url(self, event):
         """Обработчик вставки URL из буфера обмена"""
@@ -742,6 +602,7 @@ class YouTubeDownloader:
                 # Очищаем поле и вставляем содержимое
                 self.url_entry.delete(0, tk.END)
                 self.url_entry.insert(0, clipboard_content)
+                self.schedule_info_lookup()
                 return "break"  # Предотвращаем стандартную обработку
         except tk.TclError:
             # Буфер обмена пуст или недоступен
@@ -788,419 +649,134 @@ class YouTubeDownloader:
         """Выделить весь текст"""
         self.url_entry.select_range(0, tk.END)
         self.url_entry.icursor(tk.END)
-            
+                        
     def download_video(self):
-        """Скачать видео с улучшенной обработкой ошибок и аудио"""
-        try:
-            if not self.url.get().strip():
-                messagebox.showerror("Ошибка", "Пожалуйста, введите URL видео")
-                return
-                
-            if not self.download_path.get():
-                messagebox.showerror("Ошибка", "Пожалуйста, выберите папку для сохранения")
-                return
-                
-            # Сбросить состояние при новой загрузке
-            if not self.is_downloading:
-                self.reset_download_state()
-                
-            # Получить информацию о видео, если еще не получена
-            if not self.video_info:
-                self.log_message("Получение информации о видео...")
-                ydl_opts = {'quiet': True, 'no_warnings': True}
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    self.video_info = ydl.extract_info(self.url.get(), download=False)
-            
-            title = self.video_info.get('title', 'Неизвестное название')
-            
-            # Проверить, существует ли уже файл
-            existing_file = self.check_existing_file(title)
-            is_redownload = False
-            if existing_file and not self.is_downloading:
-                result = messagebox.askyesno(
-                    "Файл уже существует", 
-                    f"Файл с похожим названием уже существует:\n{existing_file.name}\n\nСкачать заново?",
-                    icon='question'
-                )
-                if not result:
-                    self.log_message("Скачивание отменено пользователем")
-                    return
-                else:
-                    self.log_message("Пользователь выбрал скачать заново")
-                    is_redownload = True
+        """Поставить видео в очередь скачивания"""
+        if not self.url.get().strip():
+            messagebox.showerror("Ошибка", "Пожалуйста, введите URL видео")
+            return None
             
-            # Выбрать формат
+        if not self.download_path.get():
+            messagebox.showerror("Ошибка", "Пожалуйста, выберите папку для сохранения")
+            return None
+
+        url = self.url.get().strip()
+        format_id = None
+        video_info = None
+        # Если информация уже получена для этого URL — используем выбранный формат
+        if self.info_url == url and self.engine.video_info:
+            video_info = self.engine.video_info
             selected_format_desc = self.selected_format.get()
-            if not selected_format_desc or not self.available_formats:
-                messagebox.showerror("Ошибка", "Пожалуйста, сначала получите информацию о видео")
-                return
-                
-            # Найти format_id для выбранного формата
-            format_id = None
-            for desc, fid in self.available_formats:
+            for desc, fid in self.engine.available_formats:
                 if desc == selected_format_desc:
                     format_id = fid
                     break
-                    
-            if not format_id:
-                format_id = 'best'  # Fallback
-                
-            # Получить расширение файла из формата
-            file_extension = 'mp4'  # исходное расширение выбранного формата
-            for desc, fid in self.available_formats:
-                if desc == selected_format_desc:
-                    if '(' in desc and ')' in desc:
-                        ext_part = desc.split('(')[1].split(')')[0]
-                        if ext_part in ['mp4', 'webm', 'mkv', 'avi']:
-                            file_extension = ext_part
-                    break
-            # Всегда финализируем в MP4 для максимальной совместимости
-            container_ext = 'mp4'
-                
-            # Создать уникальное имя файла
-            final_filename = self.get_unique_filename(title, container_ext, is_redownload)
-            
-            # Создать уникальное имя для временного файла
-            temp_hash = self.generate_file_hash(self.url.get(), format_id, title)
-            temp_filename = f"temp_{temp_hash}.{container_ext}"
-            temp_path = os.path.join(self.download_path.get(), temp_filename)
-            self.current_temp_file = temp_path
-            
-            self.is_downloading = True
-            self.update_button_states("downloading")
-            self.progress.start()
-            
-            # Этап 1: Скачиваем выбранный формат (как есть)
-            self.start_stage(1, "Скачивание основного видео потока")
-            success = self.download_with_retry(temp_path, format_id, file_extension)
 
-            if success and not self.download_cancelled:
-                # Если уже есть аудиодорожка — просто финализируем
-                if self.has_audio_track(temp_path) or not self.has_ffmpeg():
-                    part_path = temp_path + '.part'
-                    if os.path.exists(part_path):
-                        self.update_button_states("error")
-                        self.show_error_dialog("Файл ещё не докачан (обнаружен .part). Попробуйте возобновить загрузку.", part_path)
-                        return
-                    if os.path.exists(temp_path):
-                        os.rename(temp_path, final_filename)
-                    self.finish_stage(1, "✅ Видео успешно скачано!")
-                    self.show_success_dialog(title, final_filename)
-                    self.update_button_states("idle")
-                else:
-                    # Этап 2: Скачивание дополнительного потока (аудио)
-                    self.start_stage(2, "Скачивание дополнительного потока")
-                    video_only_path = temp_path  # сохранённый выбранный формат
-                    audio_path = os.path.splitext(temp_path)[0] + '.m4a'
-                    audio_ok = self.download_audio_separately(self.url.get(), audio_path)
-                    if not audio_ok:
-                        # скачать маленькое видео со звуком и извлечь
-                        small_with_audio = os.path.splitext(temp_path)[0] + '_small.mp4'
-                        try:
-                            with yt_dlp.YoutubeDL({'outtmpl': small_with_audio, 'format': 'worst[acodec!=none]', **({'ffmpeg_location': os.path.dirname(self.ffmpeg_path)} if self.ffmpeg_path else {})}) as ydl:
-                                ydl.download([self.url.get()])
-                            audio_ok = self.extract_audio_from_video(small_with_audio, audio_path)
-                        finally:
-                            if os.path.exists(small_with_audio):
-                                try:
-                                    os.remove(small_with_audio)
-                                except Exception:
-                                    pass
-                    if not audio_ok:
-                        raise Exception("Не удалось получить аудиодорожку")
-                    self.finish_stage(2, "Скачивание завершено!")
-                    
-                    # Этап 3: Получение звуковой дорожки
-                    self.start_stage(3, "Получение звуковой дорожки")
-                    self.log_stage_progress("Получено: 100%")
-                    self.finish_stage(3, "Звуковая дорожка получена!")
-                    
-                    # Этап 4: Объединение звуковой дорожки с основным видео потоком
-                    self.start_stage(4, "Объединение звуковой дорожки с основным видео потоком")
-                    merged_ok = self.merge_video_audio(video_only_path, audio_path, final_filename)
-                    # Удаляем временные отдельные файлы
-                    for f in [video_only_path, audio_path]:
-                        if os.path.exists(f):
-                            try:
-                                os.remove(f)
-                            except Exception:
-                                pass
-                    if not merged_ok:
-                        raise Exception("Не удалось объединить видео и звук")
-                    # Доп. совместимость: при наличии ffmpeg перекодируем в h264/aac
-                    try:
-                        if self.has_ffmpeg():
-                            import subprocess as _sp
-                            tmp_compat = final_filename + '.tmp.mp4'
-                            cmd = [(self.ffmpeg_path or 'ffmpeg'), '-y', '-i', final_filename, '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-profile:v', 'high', '-preset', 'veryfast', '-crf', '20', '-c:a', 'aac', '-b:a', '192k', tmp_compat]
-                            _sp.run(cmd, check=True, stdout=_sp.DEVNULL, stderr=_sp.DEVNULL)
-                            os.replace(tmp_compat, final_filename)
-                    except Exception:
-                        pass
-                    self.finish_stage(4, "✅ Видео со звуком готово!")
-                    self.show_success_dialog(title, final_filename)
-                    self.update_button_states("idle")
-            elif self.download_cancelled:
-                self.log_message("⏹️ Скачивание прервано пользователем")
-                self.update_button_states("cancelled")
-            else:
-                # показать диалог действий после неудачных попыток
-                self.update_button_states("error")
-                self.show_error_dialog("Не удалось скачать видео после нескольких попыток", self.current_temp_file)
-                return
-            
-        except Exception as e:
-            error_msg = f"Ошибка при скачивании: {str(e)}"
-            self.log_message(f"❌ {error_msg}")
-            self.update_button_states("error")
-            self.show_error_dialog(error_msg, self.current_temp_file)
-            
-        finally:
-            if not self.download_cancelled:
-                self.is_downloading = False
-                self.progress.stop()
-                
-    def download_with_retry(self, temp_path, format_id, file_extension):
-        """Скачать выбранный видео-формат (без аудио) с повторами"""
-        max_retries = 3
-        attempts = 0
-        
-        while attempts < max_retries and not self.download_cancelled:
-            try:
-                # Проверить прогресс временного файла
-                if os.path.exists(temp_path):
-                    if not self.check_temp_file_progress(temp_path):
-                        # не было прогресса — засчитываем попытку
-                        attempts += 1
-                        self.log_message(f"🔄 Попытка возобновления {attempts}/{max_retries}")
-                        if attempts >= max_retries:
-                            break
-                
-                # Скачиваем выбранный видео-формат (возможен и со звуком, если прогрессивный)
-                if self.download_selected_video(temp_path, format_id):
-                    return True
-                    
-            except Exception as e:
-                attempts += 1
-                self.log_message(f"❌ Ошибка (попытка {attempts}/{max_retries}): {e}")
-                if attempts >= max_retries:
-                    break
-                    
-                # Проверить, есть ли прогресс в файле
-                if os.path.exists(temp_path):
-                    if not self.check_temp_file_progress(temp_path):
-                        self.log_message("🔄 Нет прогресса, повторяем...")
-                    else:
-                        self.log_message("📈 Есть прогресс, продолжаем...")
-                        
-        return False
+        known_ids = {queued.id for queued in self.queue.jobs()}
+        job = self.queue.add(url, format_id=format_id, video_info=video_info,
+                             download_path=self.download_path.get(),
+                             options=self.job_options())
+        if job.id in known_ids:
+            self.log_message(f"⏭️ [{job.id}] Уже в очереди: {job.title}")
+            return job
+        self.log_message(f"➕ [{job.id}] Добавлено в очередь: {job.title}")
+        return job
 
-    def download_selected_video(self, temp_video_path, format_id):
-        """Скачать видео выбранного формата format_id как есть (может быть со звуком, если прогрессивный)"""
-        ydl_opts = {
-            'outtmpl': temp_video_path,
-            'progress_hooks': [self.progress_hook],
-            'format': format_id,
-            'continuedl': True,
-            'nopart': False,
-            'concurrent_fragment_downloads': 1,
-            'quiet': False,
-            **({'ffmpeg_location': os.path.dirname(self.ffmpeg_path)} if self.ffmpeg_path else {}),
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([self.url.get()])
-        return True
-        
-    def download_with_audio_separation(self, temp_path, format_id, file_extension):
-        """Скачать видео с раздельным аудио"""
-        try:
-            # Сначала попробуем скачать видео+аудио вместе
-            ydl_opts = {
-                'outtmpl': temp_path,
-                'progress_hooks': [self.progress_hook],
-                # Формат: если есть ffmpeg — видео+лучшее аудио; иначе пробуем прогрессивный
-                'format': (f'{format_id}+bestaudio/best' if self.has_ffmpeg() else (self.find_progressive_format_by_height(None) or 'best[acodec!=none]')),
-                'merge_output_format': ('mkv' if self.has_ffmpeg() else None),
-                # Включаем возобновление
-                'continuedl': True,
-                'nopart': False,
-                'concurrent_fragment_downloads': 1,
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([self.url.get()])
-                
-            # Проверить, есть ли аудио в файле
-            if self.has_audio_track(temp_path):
-                self.log_message("✅ Видео с аудио скачано успешно")
-                return True
+    def job_options(self):
+        """Настройки нового задания из переключателей окна"""
+        return {'pipe_audio': self.pipe_audio.get(), 'profile': self.profile_jobs.get()}
+
+    def create_job_engine(self, job):
+        """Создать движок для задания очереди"""
+        return DownloadEngine(
+            download_path=job.download_path or self.download_path.get(),
+            log=lambda message: self.log_message(f"[{job.id}] {message}"),
+            confirm_redownload=self.confirm_redownload,
+            ffmpeg_path=self.engine.ffmpeg_path,
+            ffprobe_path=self.engine.ffprobe_path,
+            metadata_cache=self.metadata_cache,
+            pipe_audio=job.options.get('pipe_audio', False),
+            fragment_controller=self.fragment_controller,
+            archive=self.archive,
+            filename_index=self.filename_index,
+            bandwidth=self.bandwidth,
+            priority=job.options.get('priority', 0),
+            weight=job.options.get('weight', 1.0),
+        )
+
+    def on_job_update(self, job):
+        """Изменилось состояние задания (вызывается из рабочего потока)"""
+        state = job.state
+        self.root.after(0, lambda: self.refresh_job(job, state))
+
+    def refresh_job(self, job, state):
+        """Обновить задание в списке и показать итог (в потоке Tk)"""
+        self.refresh_jobs()
+        if state == DownloadJob.DONE:
+            self.show_success_dialog(job.title, job.result)
+        elif state == DownloadJob.FAILED:
+            self.log_message(f"❌ [{job.id}] {job.error}")
+            self.show_error_dialog(job.error or '', job.temp_file, job)
+
+    def refresh_jobs(self):
+        """Перерисовать список заданий в порядке очереди"""
+        selection = self.jobs_tree.selection()
+        jobs = self.queue.jobs()
+        for index, job in enumerate(jobs):
+            iid = str(job.id)
+            title = f"⚡ {job.title}" if job.priority > 0 else job.title
+            values = (job.state_name, title, self.job_progress_text(job))
+            if self.jobs_tree.exists(iid):
+                self.jobs_tree.item(iid, values=values)
+                self.jobs_tree.move(iid, '', index)
             else:
-                self.log_message("⚠️ Аудио не найдено, пробуем раздельное скачивание...")
-                return self.download_separate_audio_video(temp_path, format_id, file_extension)
-                
-        except Exception as e:
-            self.log_message(f"❌ Ошибка совместного скачивания: {e}")
-            return self.download_separate_audio_video(temp_path, format_id, file_extension)
-            
-    def download_separate_audio_video(self, temp_path, format_id, file_extension):
-        """Скачать видео и аудио раздельно"""
+                self.jobs_tree.insert('', index, iid=iid, values=values)
+        if selection:
+            self.jobs_tree.selection_set(selection)
+        self.update_button_states()
+
+    def job_progress_text(self, job):
+        """Строка прогресса для списка заданий"""
+        if job.state == DownloadJob.RUNNING and job.engine:
+            return format_progress(job.engine.progress.snapshot())
+        return ""
+
+    def poll_progress(self):
+        """Снять прогресс активных заданий и обновить список и общий индикатор"""
         try:
-            # Создать временные файлы
-            video_temp = temp_path.replace(f'.{file_extension}', f'_video.{file_extension}')
-            audio_temp = temp_path.replace(f'.{file_extension}', '_audio.m4a')
-            
-            # Скачать только видео
-            self.log_message("📹 Скачивание видео...")
-            ydl_opts = {
-                'outtmpl': video_temp,
-                'progress_hooks': [self.progress_hook],
-                'format': format_id,
-                'continuedl': True,
-                'nopart': False,
-                'concurrent_fragment_downloads': 1,
-                **({'ffmpeg_location': os.path.dirname(self.ffmpeg_path)} if self.ffmpeg_path else {}),
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([self.url.get()])
-                
-            # Попробовать скачать аудио отдельно (только если есть ffmpeg для объединения)
-            self.log_message("🎵 Скачивание аудио...")
-            if self.has_ffmpeg() and self.download_audio_separately(self.url.get(), audio_temp):
-                # Объединить видео и аудио
-                self.log_message("🔗 Объединение видео и аудио...")
-                if self.merge_video_audio(video_temp, audio_temp, temp_path):
-                    # Удалить временные файлы
-                    for temp_file in [video_temp, audio_temp]:
-                        if os.path.exists(temp_file):
-                            os.remove(temp_file)
-                    return True
-            else:
-                # Если не удалось скачать аудио отдельно, извлечь из самого маленького видео
-                if self.has_ffmpeg():
-                    self.log_message("🎵 Извлечение аудио из видео...")
-                    return self.extract_and_merge_audio(video_temp, temp_path, file_extension)
+            downloaded = 0
+            total = 0
+            unknown_total = False
+            running = 0
+            for job in self.queue.jobs():
+                if job.state != DownloadJob.RUNNING or not job.engine:
+                    continue
+                running += 1
+                snapshot = job.engine.progress.snapshot()
+                if self.jobs_tree.exists(str(job.id)):
+                    self.jobs_tree.set(str(job.id), "progress", format_progress(snapshot))
+                if snapshot['total']:
+                    downloaded += min(snapshot['downloaded'], snapshot['total'])
+                    total += snapshot['total']
                 else:
-                    # Без ffmpeg не сможем объединить — оставим прогрессивный или исходный video_temp как результат
-                    try:
-                        import shutil as _sh
-                        _sh.copyfile(video_temp, temp_path)
-                        return True
-                    except Exception:
-                        return False
-                
-        except Exception as e:
-            self.log_message(f"❌ Ошибка раздельного скачивания: {e}")
-            return False
-            
-    def extract_and_merge_audio(self, video_path, output_path, file_extension):
-        """Извлечь аудио из видео и объединить с выбранным качеством"""
-        try:
-            # Скачать самое маленькое видео с аудио
-            small_video = video_path.replace(f'_video.{file_extension}', '_small.mp4')
-            
-            ydl_opts = {
-                'outtmpl': small_video,
-                'format': 'worst[height<=480]',  # Самое маленькое качество
-                **({'ffmpeg_location': os.path.dirname(self.ffmpeg_path)} if self.ffmpeg_path else {}),
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([self.url.get()])
-                
-            # Извлечь аудио
-            audio_temp = video_path.replace(f'_video.{file_extension}', '_audio.m4a')
-            if self.extract_audio_from_video(small_video, audio_temp):
-                # Объединить с выбранным видео
-                if self.merge_video_audio(video_path, audio_temp, output_path):
-                    # Удалить временные файлы
-                    for temp_file in [small_video, audio_temp]:
-                        if os.path.exists(temp_file):
-                            os.remove(temp_file)
-                    return True
-                    
-        except Exception as e:
-            self.log_message(f"❌ Ошибка извлечения аудио: {e}")
-            
-        return False
-        
-    def has_audio_track(self, video_path):
-        """Проверить, есть ли аудио в видео файле"""
-        try:
-            import subprocess as _sp
-            if shutil.which('ffprobe') is not None or (self.ffprobe_path and os.path.exists(self.ffprobe_path)):
-                cmd = [(self.ffprobe_path or 'ffprobe'), '-v', 'quiet', '-select_streams', 'a', '-show_entries', 'stream=codec_type', '-of', 'csv=p=0', video_path]
-                result = _sp.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
-                return 'audio' in (result.stdout or '')
-            if shutil.which('ffmpeg') is not None or (self.ffmpeg_path and os.path.exists(self.ffmpeg_path)):
-                result = _sp.run([(self.ffmpeg_path or 'ffmpeg'), '-i', video_path], capture_output=True, text=True, encoding='utf-8', errors='ignore')
-                probe = (result.stderr or '') + (result.stdout or '')
-                return ('Audio:' in probe) or (' Stream #' in probe and 'Audio' in probe)
-        except Exception:
-            pass
-        return False
+                    unknown_total = True
+
+            # Общий размер известен — настоящий процент, иначе индикатор активности
+            if running and (unknown_total or not total):
+                if str(self.progress.cget('mode')) != 'indeterminate':
+                    self.progress.configure(mode='indeterminate')
+                    self.progress.start()
+            else:
+                if str(self.progress.cget('mode')) != 'determinate':
+                    self.progress.stop()
+                    self.progress.configure(mode='determinate')
+                self.progress['value'] = (downloaded * 100.0 / total) if total else 0
+        finally:
+            self.root.after(self.PROGRESS_INTERVAL_MS, self.poll_progress)
             
     def start_download(self):
-        """Запустить скачивание в отдельном потоке"""
-        if not self.is_downloading:
-            # Если это не резюмирование — чистим лог и сбрасываем состояние
-            if not getattr(self, 'is_resuming', False):
-                self.log_text.delete(1.0, tk.END)
-                self.reset_download_state()
-            else:
-                # сбрасываем флаг резюма перед стартом
-                self.is_resuming = False
-            # всегда снимаем флаг отмены перед стартом
-            self.download_cancelled = False
-            # Запустить скачивание в отдельном потоке
-            self.download_thread = threading.Thread(target=self.download_video)
-            self.download_thread.daemon = True
-            self.download_thread.start()
-
-    def has_ffmpeg(self):
-        """Проверить наличие ffmpeg в системе"""
-        try:
-            if self.ffmpeg_path and os.path.exists(self.ffmpeg_path):
-                return True
-            if shutil.which('ffmpeg') is not None:
-                return True
-            subprocess.run([(self.ffmpeg_path or 'ffmpeg'), '-version'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            return True
-        except Exception:
-            return False
-
-    def is_progressive_format(self, format_id):
-        """Проверить, содержит ли формат и видео, и аудио"""
-        if not self.video_info:
-            return False
-        for f in self.video_info.get('formats', []):
-            if f.get('format_id') == format_id:
-                return f.get('vcodec') != 'none' and f.get('acodec') != 'none'
-        return False
-
-    def find_progressive_format_by_height(self, height):
-        """Найти прогрессивный формат с заданным или ближайшим разрешением"""
-        candidates = []
-        for f in self.video_info.get('formats', []):
-            if f.get('vcodec') != 'none' and f.get('acodec') != 'none' and f.get('height'):
-                candidates.append(f)
-        if not candidates:
-            return None
-        # выбрать по минимальной разнице высоты, затем по максимальному битрейту
-        candidates.sort(key=lambda x: (abs((x.get('height') or 0) - (height or 0)), -(x.get('tbr') or 0)))
-        chosen = candidates[0]
-        return chosen.get('format_id')
-
-    def resolve_existing_temp_variant(self, base_temp_path):
-        """Вернуть существующий путь временного файла с учетом .part"""
-        variants = [
-            base_temp_path,
-            base_temp_path + '.part',
-        ]
-        for v in variants:
-            if os.path.exists(v):
-                return v
-        return base_temp_path
+        """Добавить видео в очередь (скачивание идёт в рабочих потоках)"""
+        self.download_video()
 
 def main():
     root = tk.Tk()